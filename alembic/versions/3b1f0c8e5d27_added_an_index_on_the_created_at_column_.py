@@ -0,0 +1,24 @@
+"""Added an index on the created_at column of tb_stream_chunk_highlight
+
+Revision ID: 3b1f0c8e5d27
+Revises: 8feba263d722
+Create Date: 2026-10-19 08:35:11.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b1f0c8e5d27'
+down_revision = '8feba263d722'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(op.f('ix_tb_stream_chunk_highlight_created_at'), 'tb_stream_chunk_highlight', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_tb_stream_chunk_highlight_created_at'), table_name='tb_stream_chunk_highlight')
@@ -0,0 +1,38 @@
+"""Added a table for roulette stats
+
+Revision ID: 5e2d9a41c6b8
+Revises: 3b1f0c8e5d27
+Create Date: 2026-10-19 08:36:10.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e2d9a41c6b8'
+down_revision = '3b1f0c8e5d27'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('tb_user_roulette_stats',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('num_roulettes', sa.Integer(), nullable=False),
+    sa.Column('num_wins', sa.Integer(), nullable=False),
+    sa.Column('profit', sa.Integer(), nullable=False),
+    sa.Column('total_points', sa.Integer(), nullable=False),
+    sa.Column('biggest_win', sa.Integer(), nullable=False),
+    sa.Column('biggest_loss', sa.Integer(), nullable=False),
+    sa.Column('last_roulette', sa.DateTime(), nullable=True),
+    sa.Column('current_streak', sa.Integer(), nullable=False),
+    sa.Column('longest_winstreak', sa.Integer(), nullable=False),
+    sa.Column('longest_losestreak', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['tb_user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('tb_user_roulette_stats')
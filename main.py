@@ -29,11 +29,16 @@ def run(args):
         log.error('The [sql] section in config is no longer used. See config.example.ini for the new format under [main].')
         sys.exit(1)
 
-    if 'db' not in config['main']:
-        log.error('Missing required db config in the [main] section.')
-        sys.exit(1)
-
-    pajbot = Bot(config, args)
+    if 'channels' in config:
+        # One process serving several channels, see pajbot/multichannel.py
+        from pajbot.multichannel import MultiChannelBot
+        pajbot = MultiChannelBot(config, args)
+    else:
+        if 'db' not in config['main']:
+            log.error('Missing required db config in the [main] section.')
+            sys.exit(1)
+
+        pajbot = Bot(config, args)
 
     pajbot.connect()
 
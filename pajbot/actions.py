@@ -2,6 +2,8 @@ import logging
 import queue
 import threading
 
+from pajbot.managers.channel import ChannelManager
+
 log = logging.getLogger(__name__)
 
 
@@ -49,7 +51,7 @@ class ActionQueue:
 
     def add(self, f, args=[], kwargs={}):
         action = Action()
-        action.func = f
+        action.func = ChannelManager.wrap(f)
 
         action.args = args
         action.kwargs = kwargs
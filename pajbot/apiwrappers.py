@@ -1,6 +1,11 @@
+import collections
+import concurrent.futures
 import datetime
+import io
 import json
 import logging
+import threading
+import time
 import urllib.parse
 import urllib.request
 
@@ -9,14 +14,239 @@ import requests
 log = logging.getLogger(__name__)
 
 
+class TokenBucket:
+    """ Client-side rate limiting.
+    Allows `rate` requests per second on average, with bursts of up to `capacity` requests. """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def block_for(self, seconds):
+        """ Don't hand out any tokens for the next `seconds` seconds (i.e. when the server says we're rate limited) """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def acquire(self, max_wait=30):
+        """ Take a token, sleeping until one is available (but at most max_wait seconds).
+        Returns how many seconds we slept """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            wait = max(0, self.blocked_until - now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+
+            # The token is reserved even if we have to wait for it, so concurrent callers queue up behind us
+            self.tokens -= 1
+
+        wait = min(wait, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class TTLCache:
+    """ A thread-safe dictionary where every value expires after a given amount of seconds """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns None if the key is not cached or has expired """
+        with self.lock:
+            if key not in self.data:
+                return None
+
+            expires_at, value = self.data[key]
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return None
+
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (time.monotonic() + ttl, value)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
 class APIBase:
+    """
+    All requests go through one shared requests.Session, so connections to
+    the same host are pooled and kept alive between requests.
+
+    Requests to each host are rate limited on the client side with a token bucket.
+    If the server tells us we're out of requests (through the Ratelimit-Remaining/Ratelimit-Reset
+    or Retry-After headers), no more requests are sent to that host until the limit resets.
+
+    GET requests can be cached in memory by passing cache_ttl (in seconds).
+
+    HTTP errors are raised as urllib.error.HTTPError for strict APIs, like they were with urllib.
+    Latency, error and cache hit metrics for each host are available through APIBase.get_metrics().
+    """
+
+    # Client-side rate limit for each host, in requests per second
+    RATE_LIMIT = 10
+    RATE_LIMIT_BURST = 20
+
+    POOL_SIZE = 10
+    TIMEOUT = 30
+
+    session = None
+    session_lock = threading.Lock()
+    buckets = {}
+    cache = TTLCache()
+    metrics = {}
+    metrics_lock = threading.Lock()
+
     def __init__(self, strict=False):
         self.strict = strict
 
-    def _get(self, url, headers={}):
+    def get_session():
+        with APIBase.session_lock:
+            if APIBase.session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=APIBase.POOL_SIZE, pool_maxsize=APIBase.POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                APIBase.session = session
+
+            return APIBase.session
+
+    def get_bucket(self, host):
+        with APIBase.session_lock:
+            if host not in APIBase.buckets:
+                APIBase.buckets[host] = TokenBucket(self.RATE_LIMIT, self.RATE_LIMIT_BURST)
+            return APIBase.buckets[host]
+
+    def _add_metrics(host, **values):
+        with APIBase.metrics_lock:
+            if host not in APIBase.metrics:
+                APIBase.metrics[host] = {
+                        'requests': 0,
+                        'errors': 0,
+                        'cache_hits': 0,
+                        'cache_misses': 0,
+                        'latency_total': 0.0,
+                        'latency_max': 0.0,
+                        'throttled': 0,
+                        'throttled_time': 0.0,
+                        'ratelimit_remaining': None,
+                        }
+
+            host_metrics = APIBase.metrics[host]
+            for key, value in values.items():
+                if key == 'latency':
+                    host_metrics['latency_total'] += value
+                    host_metrics['latency_max'] = max(host_metrics['latency_max'], value)
+                elif key == 'ratelimit_remaining':
+                    host_metrics[key] = value
+                else:
+                    host_metrics[key] += value
+
+    def get_metrics():
+        """ Returns a dictionary of host -> metrics """
+        with APIBase.metrics_lock:
+            metrics = {host: dict(host_metrics) for host, host_metrics in APIBase.metrics.items()}
+
+        for host_metrics in metrics.values():
+            num_requests = host_metrics['requests']
+            host_metrics['latency_avg'] = host_metrics['latency_total'] / num_requests if num_requests > 0 else 0.0
+
+        return metrics
+
+    def collect_metrics():
+        """ Metrics collector for MetricsManager """
+        metrics = APIBase.get_metrics()
+
+        def samples(key):
+            return [({'host': host}, host_metrics[key]) for host, host_metrics in metrics.items()]
+
+        cache_samples = []
+        for host, host_metrics in metrics.items():
+            cache_samples.append(({'host': host, 'result': 'hit'}, host_metrics['cache_hits']))
+            cache_samples.append(({'host': host, 'result': 'miss'}, host_metrics['cache_misses']))
+
+        return [
+                ('pajbot_api_requests_total', 'counter', 'Number of HTTP requests sent to each API host', samples('requests')),
+                ('pajbot_api_errors_total', 'counter', 'Number of failed HTTP requests to each API host', samples('errors')),
+                ('pajbot_api_request_seconds_total', 'counter', 'Time spent waiting for each API host', samples('latency_total')),
+                ('pajbot_api_throttled_seconds_total', 'counter', 'Time spent waiting for the client-side rate limit of each API host', samples('throttled_time')),
+                ('pajbot_api_cache_requests_total', 'counter', 'Number of cached GET requests to each API host', cache_samples),
+                ]
+
+    def _update_rate_limit(self, host, response):
+        bucket = self.get_bucket(host)
+
+        remaining = response.headers.get('Ratelimit-Remaining', None)
+        if remaining is not None:
+            try:
+                remaining = int(remaining)
+                APIBase._add_metrics(host, ratelimit_remaining=remaining)
+                if remaining <= 0:
+                    reset = float(response.headers.get('Ratelimit-Reset', 0))
+                    bucket.block_for(max(1, reset - time.time()))
+            except ValueError:
+                pass
+
+        if response.status_code == 429:
+            try:
+                bucket.block_for(float(response.headers.get('Retry-After', 1)))
+            except ValueError:
+                bucket.block_for(1)
+
+    def _request(self, method, url, headers={}, data=None):
+        """ Returns a requests.Response object.
+        Raises urllib.error.HTTPError if the server responded with an HTTP error """
+        host = urllib.parse.urlsplit(url).netloc
+
+        throttled_time = self.get_bucket(host).acquire()
+        if throttled_time > 0:
+            APIBase._add_metrics(host, throttled=1, throttled_time=throttled_time)
+
+        start_time = time.monotonic()
         try:
-            req = urllib.request.Request(url, None, headers)
-            response = urllib.request.urlopen(req, timeout=30)
+            response = APIBase.get_session().request(method, url, headers=headers, data=data, timeout=self.TIMEOUT)
+        except:
+            APIBase._add_metrics(host, requests=1, errors=1, latency=time.monotonic() - start_time)
+            raise
+
+        self._update_rate_limit(host, response)
+
+        if response.status_code >= 400:
+            APIBase._add_metrics(host, requests=1, errors=1, latency=time.monotonic() - start_time)
+            raise urllib.error.HTTPError(url, response.status_code, response.reason, response.headers, io.BytesIO(response.content))
+
+        APIBase._add_metrics(host, requests=1, latency=time.monotonic() - start_time)
+        return response
+
+    def _get(self, url, headers={}, cache_ttl=None):
+        if cache_ttl:
+            cache_key = (url, tuple(sorted(headers.items())))
+            data = APIBase.cache.get(cache_key)
+            host = urllib.parse.urlsplit(url).netloc
+            if data is not None:
+                APIBase._add_metrics(host, cache_hits=1)
+                return data
+            APIBase._add_metrics(host, cache_misses=1)
+
+        try:
+            response = self._request('GET', url, headers)
         except urllib.error.HTTPError as e:
             # If strict is True, return the proper HTTP error. Otherwise
             if self.strict:
@@ -28,12 +258,15 @@ class APIBase:
             return None
 
         try:
-            return response.read().decode('utf-8')
+            data = response.content.decode('utf-8')
         except:
             log.exception('Unhandled exception in APIBase._get while reading response')
             return None
 
-        return None
+        if cache_ttl:
+            APIBase.cache.set(cache_key, data, cache_ttl)
+
+        return data
 
     def _get_json(self, url, headers={}):
         data = self._get(url, headers)
@@ -52,11 +285,11 @@ class APIBase:
     def get_url(self, endpoints=[], parameters={}, base=None):
         return (base or self.base_url) + '/'.join(endpoints) + ('' if len(parameters) == 0 else '?' + urllib.parse.urlencode(parameters))
 
-    def getraw(self, endpoints=[], parameters={}, base=None):
-        return self._get(self.get_url(endpoints, parameters, base=base), self.headers)
+    def getraw(self, endpoints=[], parameters={}, base=None, cache_ttl=None):
+        return self._get(self.get_url(endpoints, parameters, base=base), self.headers, cache_ttl=cache_ttl)
 
-    def get(self, endpoints, parameters={}, base=None):
-        data = self.getraw(endpoints, parameters, base=base)
+    def get(self, endpoints, parameters={}, base=None, cache_ttl=None):
+        data = self.getraw(endpoints, parameters, base=base, cache_ttl=cache_ttl)
 
         try:
             if data and type(data) is str:
@@ -81,9 +314,7 @@ class APIBase:
         method -- What method we should use for the request. (default: 'POST')
         """
         try:
-            encoded_data = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=encoded_data, headers=self.headers, method=method)
-            return urllib.request.urlopen(req, timeout=30)
+            return self._request(method, url, headers=self.headers, data=data)
         except urllib.error.HTTPError as e:
             # Irregular HTTP code
             if e.code in [422]:
@@ -103,7 +334,7 @@ class APIBase:
     def post(self, endpoints=[], parameters={}, data={}, base=None):
         try:
             response = self._req_with_data(self.get_url(endpoints, parameters, base=base), data, method='POST')
-            return response.read().decode('utf-8')
+            return response.content.decode('utf-8')
         except:
             log.exception('Unhandled exception caught in method `post`')
             return None
@@ -111,7 +342,7 @@ class APIBase:
     def put(self, endpoints=[], parameters={}, data={}, base=None):
         try:
             response = self._req_with_data(self.get_url(endpoints, parameters, base=base), data, method='PUT')
-            return response.read().decode('utf-8')
+            return response.content.decode('utf-8')
         except:
             log.exception('Unhandled exception caught in method `put`')
             return None
@@ -152,6 +383,9 @@ class StreamtipAPI(APIBase):
 
 
 class BTTVApi(APIBase):
+    # How long the emote lists are cached, in seconds
+    EMOTES_CACHE_TIME = 60
+
     def __init__(self, strict=True):
         APIBase.__init__(self, strict)
 
@@ -163,7 +397,7 @@ class BTTVApi(APIBase):
 
         emotes = []
         try:
-            data = self.get(['emotes'])
+            data = self.get(['emotes'], cache_ttl=self.EMOTES_CACHE_TIME)
 
             for emote in data['emotes']:
                 emotes.append({'emote_hash': emote['id'], 'code': emote['code']})
@@ -186,7 +420,7 @@ class BTTVApi(APIBase):
 
         emotes = []
         try:
-            data = self.get(['channels', channel])
+            data = self.get(['channels', channel], cache_ttl=self.EMOTES_CACHE_TIME)
 
             for emote in data['emotes']:
                 emotes.append({'emote_hash': emote['id'], 'code': emote['code']})
@@ -208,6 +442,11 @@ class BTTVApi(APIBase):
 
 
 class TwitchAPI(APIBase):
+    # How long responses are cached, in seconds
+    STATUS_CACHE_TIME = 10
+    CHATTERS_CACHE_TIME = 30
+    FOLLOW_RELATIONSHIP_CACHE_TIME = 5 * 60
+
     def __init__(self, client_id=None, oauth=None, strict=True):
         """
         Keyword arguments:
@@ -236,39 +475,47 @@ class TwitchAPI(APIBase):
         trimmed_str = datetime_str[:19]
         return datetime.datetime.strptime(trimmed_str, '%Y-%m-%dT%H:%M:%S')
 
-    def get_subscribers(self, streamer, limit=25, offset=0, attempt=0):
-        """Returns a list of subscribers within the limit+offset range.
+    def get_subscribers_page(self, streamer, limit=100, offset=0, attempts=3):
+        """Returns a tuple of (usernames, total number of subscribers) for one page of subscribers.
 
-        Arguments:
-        streamer -- the streamer whose subscriber we want to fetch.
+        Failed requests are retried with an exponential backoff.
+        If all attempts fail, the last error is raised.
+        """
 
-        Keyword arguments:
-        limit -- Maximum number of subscribers fetched. (default: 25)
-        offset - Offset for pagination. (default: 0)
+        for attempt in range(0, attempts):
+            try:
+                data = self.get(['channels', streamer, 'subscriptions'], {'limit': limit, 'offset': offset}, base=self.kraken_url)
+                return [u['user']['name'] for u in data['subscriptions']], data['_total']
+            except (urllib.error.HTTPError, requests.RequestException, KeyError, TypeError) as e:
+                if attempt == attempts - 1:
+                    raise
+                log.warning('Error while fetching subscribers at offset {0}, retrying: {1}'.format(offset, e))
+                time.sleep(2 ** attempt)
+
+    def get_all_subscribers(self, streamer, limit=100, max_workers=4):
+        """Returns a list of all subscribers of the given streamer.
+
+        The first page tells us how many subscribers there are, and the rest
+        of the pages are then fetched concurrently by up to `max_workers` threads.
+        Raises an exception if any page could not be fetched, since a partial
+        list would make us think the missing subscribers unsubscribed.
         """
 
-        if attempt > 2:
-            return False, False, True
-        try:
-            data = self.get(['channels', streamer, 'subscriptions'], {'limit': limit, 'offset': offset}, base=self.kraken_url)
-            if data:
-                return [u['user']['name'] for u in data['subscriptions']], False, False
-        except urllib.error.HTTPError as e:
-            # Non-standard HTTP Code returned.
-            log.warning('Non-standard HTTP Code returned while fetching subscribers: {0}'.format(e.code))
-            log.info(e)
-            log.info(e.fp.read())
-        except:
-            log.exception('Unhandled exception caught in TwitchAPI.get_subscribers')
+        subscribers, total = self.get_subscribers_page(streamer, limit, 0)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = executor.map(lambda offset: self.get_subscribers_page(streamer, limit, offset)[0], range(limit, total, limit))
+            for page in pages:
+                subscribers.extend(page)
 
-        return [], attempt + 1, False
+        return subscribers
 
     def get_chatters(self, streamer):
         """Returns a list of chatters in the stream."""
         chatters = []
 
         try:
-            data = self.get(['group', 'user', streamer, 'chatters'], base=self.tmi_url)
+            data = self.get(['group', 'user', streamer, 'chatters'], base=self.tmi_url, cache_ttl=self.CHATTERS_CACHE_TIME)
             ch = data['chatters']
 
             chatters = ch['moderators'] + ch['staff'] + ch['admins'] + ch['global_mods'] + ch['viewers']
@@ -307,7 +554,7 @@ class TwitchAPI(APIBase):
         data = None
 
         try:
-            data = self.get(['streams', streamer], base=self.kraken_url)
+            data = self.get(['streams', streamer], base=self.kraken_url, cache_ttl=self.STATUS_CACHE_TIME)
             stream_status['error'] = False
 
             stream_status['online'] = 'stream' in data and data['stream'] is not None
@@ -372,7 +619,7 @@ class TwitchAPI(APIBase):
         Returns False if `username` is not following `streamer`.
         Otherwise, return a datetime object.
 
-        This value is cached in Redis for 2 minutes.
+        This value is cached in Redis for 5 minutes.
         """
 
         # XXX TODO FIXME
@@ -387,12 +634,12 @@ class TwitchAPI(APIBase):
             try:
                 data = self.get(endpoints=['users', username, 'follows', 'channels', streamer], base=self.kraken_url)
                 created_at = data['created_at']
-                redis.setex(fr_key, time=120, value=created_at)
+                redis.setex(fr_key, time=self.FOLLOW_RELATIONSHIP_CACHE_TIME, value=created_at)
                 return TwitchAPI.parse_datetime(created_at)
             except ValueError:
                 raise
             except urllib.error.HTTPError:
-                redis.setex(fr_key, time=120, value='-1')
+                redis.setex(fr_key, time=self.FOLLOW_RELATIONSHIP_CACHE_TIME, value='-1')
                 return False
             except:
                 log.exception('Unhandled exception in get_follow_relationship')
@@ -1,7 +1,6 @@
 import argparse
 import datetime
 import logging
-import re
 import subprocess
 import sys
 import time
@@ -13,7 +12,11 @@ from pytz import timezone
 
 import pajbot.utils
 from pajbot.actions import ActionQueue
+from pajbot.apiwrappers import APIBase
 from pajbot.apiwrappers import TwitchAPI
+from pajbot.managers.backgroundmessage import BackgroundMessage
+from pajbot.managers.backgroundmessage import BackgroundMessageManager
+from pajbot.managers.channel import ChannelManager
 from pajbot.managers.command import CommandManager
 from pajbot.managers.db import DBManager
 from pajbot.managers.deck import DeckManager
@@ -23,6 +26,10 @@ from pajbot.managers.handler import HandlerManager
 from pajbot.managers.irc import MultiIRCManager
 from pajbot.managers.irc import SingleIRCManager
 from pajbot.managers.kvi import KVIManager
+from pajbot.managers.leaderboard import LeaderboardManager
+from pajbot.managers.metrics import MetricsManager
+from pajbot.managers.points import PointsManager
+from pajbot.managers.querystats import QueryStats
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.managers.time import TimeManager
@@ -31,17 +38,24 @@ from pajbot.managers.user import UserManager
 from pajbot.managers.websocket import WebSocketManager
 from pajbot.models.action import ActionParser
 from pajbot.models.banphrase import BanphraseManager
+from pajbot.models.message import MessageFeatures
 from pajbot.models.module import ModuleManager
 from pajbot.models.pleblist import PleblistManager
 from pajbot.models.sock import SocketManager
 from pajbot.models.stream import StreamManager
 from pajbot.models.timer import TimerManager
 from pajbot.streamhelper import StreamHelper
+from pajbot.tmi import Tags
+from pajbot.urls import find_urls
 from pajbot.utils import time_method
 from pajbot.utils import time_since
 
 log = logging.getLogger(__name__)
 
+MESSAGES_RECEIVED = MetricsManager.counter('pajbot_messages_received_total', 'Number of messages received from chat', ['type'])
+MESSAGES_SENT = MetricsManager.counter('pajbot_messages_sent_total', 'Number of messages sent to chat', ['type'])
+MESSAGE_DURATION = MetricsManager.histogram('pajbot_message_duration_seconds', 'Time spent handling a received message', ['type'])
+
 
 class Bot:
     """
@@ -51,7 +65,6 @@ class Bot:
     version = '2.8.2'
     date_fmt = '%H:%M'
     admin = None
-    url_regex_str = r'\(?(?:(http|https):\/\/)?(?:((?:[^\W\s]|\.|-|[:]{1})+)@{1})?((?:www.)?(?:[^\W\s]|\.|-)+[\.][^\W\s]{2,4}|localhost(?=\/)|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(\d*))?([\/]?[^\s\?]*[\/]{1})*(?:\/?([^\s\n\?\[\]\{\}\#]*(?:(?=\.)){1}|[^\s\n\?\[\]\{\}\.\#]*)?([\.]{1}[^\s\?\#]*)?)?(?:\?{1}([^\s\n\#\[\]]*))?([\#][^\s\n]*)?\)?'
 
     last_ping = datetime.datetime.now()
     last_pong = datetime.datetime.now()
@@ -106,31 +119,49 @@ class Bot:
             self.silent = True if 'silent' in config['flags'] and config['flags']['silent'] == '1' else self.silent
             self.dev = True if 'dev' in config['flags'] and config['flags']['dev'] == '1' else self.dev
 
-        DBManager.init(self.config['main']['db'])
+        self.init_storage()
+
+    def init_storage(self):
+        """ Connect to the database and redis """
+        DBManager.init(self.config['main']['db'], **DBManager.get_pool_options(self.config['main']))
 
         redis_options = {}
-        if 'redis' in config:
-            redis_options = config._sections['redis']
+        if 'redis' in self.config:
+            redis_options = self.config._sections['redis']
 
         RedisManager.init(**redis_options)
 
+    def upgrade_database(self):
+        """ Update the database scheme if necessary using alembic
+        In case of errors, i.e. if the database is out of sync or the alembic
+        binary can't be called, we will shut down the bot. """
+        pajbot.utils.alembic_upgrade()
+
+    def create_reactor(self):
+        return irc.client.Reactor(self.on_connect)
+
+    def create_irc_manager(self):
+        relay_host = self.config['main'].get('relay_host', None)
+        relay_password = self.config['main'].get('relay_password', None)
+        if relay_host is None or relay_password is None:
+            return MultiIRCManager(self)
+        else:
+            return SingleIRCManager(self)
+
     def __init__(self, config, args=None):
         # Load various configuration variables from the given config object
         # The config object that should be passed through should
         # come from pajbot.utils.load_config
         self.load_config(config)
 
-        # Update the database scheme if necessary using alembic
-        # In case of errors, i.e. if the database is out of sync or the alembic
-        # binary can't be called, we will shut down the bot.
-        pajbot.utils.alembic_upgrade()
+        self.upgrade_database()
 
         # Actions in this queue are run in a separate thread.
         # This means actions should NOT access any database-related stuff.
         self.action_queue = ActionQueue()
         self.action_queue.start()
 
-        self.reactor = irc.client.Reactor(self.on_connect)
+        self.reactor = self.create_reactor()
         self.start_time = datetime.datetime.now()
         ActionParser.bot = self
 
@@ -143,6 +174,8 @@ class Bot:
         ScheduleManager.init()
 
         self.users = UserManager()
+        PointsManager.init(checkpoint_interval=int(self.config['main'].get('points_checkpoint_interval', 60)))
+        LeaderboardManager.init()
         self.decks = DeckManager()
         self.module_manager = ModuleManager(self.socket_manager, bot=self).load()
         self.commands = CommandManager(
@@ -154,6 +187,7 @@ class Bot:
         self.timer_manager = TimerManager(self).load()
         self.kvi = KVIManager()
         self.emotes = EmoteManager(self)
+        self.background_messages = BackgroundMessageManager(self)
         self.twitter_manager = TwitterManager(self)
 
         HandlerManager.trigger('on_managers_loaded')
@@ -182,14 +216,9 @@ class Bot:
 
         self.parse_version()
 
-        relay_host = self.config['main'].get('relay_host', None)
-        relay_password = self.config['main'].get('relay_password', None)
-        if relay_host is None or relay_password is None:
-            self.irc = MultiIRCManager(self)
-        else:
-            self.irc = SingleIRCManager(self)
+        self.irc = self.create_irc_manager()
 
-        self.reactor.add_global_handler('all_events', self.irc._dispatcher, -10)
+        self.irc.add_dispatcher(self.reactor)
 
         twitch_client_id = None
         twitch_oauth = None
@@ -205,7 +234,6 @@ class Bot:
 
         self.data = {}
         self.data_cb = {}
-        self.url_regex = re.compile(self.url_regex_str, re.IGNORECASE)
 
         self.data['broadcaster'] = self.streamer
         self.data['version'] = self.version
@@ -228,6 +256,8 @@ class Bot:
 
         self.websocket_manager = WebSocketManager(self)
 
+        self.init_metrics()
+
         try:
             if self.config['twitchapi']['update_subscribers'] == '1':
                 self.execute_every(30 * 60,
@@ -240,63 +270,63 @@ class Bot:
         HandlerManager.add_handler('on_user_gain_tokens', self.on_user_gain_tokens)
         HandlerManager.add_handler('send_whisper', self.whisper)
 
+        # The pleblist queue belongs to the current stream
+        HandlerManager.add_handler('on_stream_start', PleblistManager.update_queue)
+        HandlerManager.add_handler('on_stream_stop', PleblistManager.update_queue)
+        self.socket_manager.add_handler('pleblist.update', self.on_pleblist_update)
+
     def on_connect(self, sock):
         return self.irc.on_connect(sock)
 
+    def init_metrics(self):
+        """ Register the metrics collectors, and start the metrics server if there's a [metrics] section """
+        MetricsManager.add_collector('bot', self.collect_metrics)
+        MetricsManager.add_collector('api', APIBase.collect_metrics)
+        if self.websocket_manager.server is not None:
+            MetricsManager.add_collector('websocket', self.websocket_manager.collect_metrics)
+
+        if 'metrics' in self.config and 'port' in self.config['metrics']:
+            try:
+                MetricsManager.start_http_server(int(self.config['metrics']['port']), host=self.config['metrics'].get('host', '127.0.0.1'))
+            except:
+                log.exception('Unable to start the metrics server')
+
+    def collect_metrics(self):
+        """ Metrics collector for MetricsManager """
+        return [
+                ('pajbot_action_queue_size', 'gauge', 'Number of actions waiting to be run', [
+                    ({'queue': 'action'}, self.action_queue.queue.qsize()),
+                    ({'queue': 'mainthread'}, self.mainthread_queue.queue.qsize()),
+                    ({'queue': 'background_messages'}, self.background_messages.queue.qsize()),
+                    ]),
+                ]
+
+    def on_pleblist_update(self, data, conn):
+        # The web interface changed the queue, load it now rather than on the next $(current_song)
+        PleblistManager.get_queue()
+
     def on_user_gain_tokens(self, user, tokens_gained):
         self.whisper(user.username, 'You finished todays quest! You have been awarded with {} tokens.'.format(tokens_gained))
 
     def update_subscribers_stage1(self):
-        limit = 100
-        offset = 0
-        subscribers = []
         log.info('Starting stage1 subscribers update')
 
         try:
-            retry_same = 0
-            while True:
-                log.debug('Beginning sub request {0} {1}'.format(limit, offset))
-                subs, retry_same, error = self.twitchapi.get_subscribers(self.streamer, limit, offset, 0 if retry_same is False else retry_same)
-                log.debug('got em!')
-
-                if error is True:
-                    log.error('Too many attempts, aborting')
-                    return False
-
-                if retry_same is False:
-                    offset += limit
-                    if len(subs) == 0:
-                        # We don't need to retry, and the last query finished propery
-                        # Break out of the loop and start fiddling with the subs!
-                        log.debug('Done!')
-                        break
-                    else:
-                        log.debug('Fetched {0} subs'.format(len(subs)))
-                        subscribers.extend(subs)
-
-                if retry_same is not False:
-                    # In case the next attempt is a retry, wait for 3 seconds
-                    log.debug('waiting for 3 seconds...')
-                    time.sleep(3)
-                    log.debug('waited enough!')
-            log.debug('Finished with the while True loop!')
+            subscribers = self.twitchapi.get_all_subscribers(self.streamer)
         except:
             log.exception('Caught an exception while trying to get subscribers')
             return
 
-        log.info('Ended stage1 subscribers update')
+        log.info('Ended stage1 subscribers update, got {0} subscribers'.format(len(subscribers)))
         if len(subscribers) > 0:
-            log.info('Got some subscribers, so we are pushing them to stage 2!')
             self.mainthread_queue.add(self.update_subscribers_stage2,
                                       args=[subscribers])
-            log.info('Pushed them now.')
 
     def update_subscribers_stage2(self, subscribers):
         self.kvi['active_subs'].set(len(subscribers) - 1)
 
-        self.users.reset_subs()
-
-        self.users.update_subs(subscribers)
+        added, removed = self.users.sync_subs(subscribers)
+        log.info('Synced subscribers: {0} new, {1} removed'.format(len(added), len(removed)))
 
     def start(self):
         """Start the IRC client."""
@@ -375,7 +405,10 @@ class Bot:
 
     def get_current_song_value(self, key, extra={}):
         if self.stream_manager.online:
-            current_song = PleblistManager.get_current_song(self.stream_manager.current_stream.id)
+            queue = PleblistManager.get_queue()
+            if queue.stream_id != self.stream_manager.current_stream.id:
+                return None
+            current_song = queue.current_song
             inner_keys = key.split('.')
             val = current_song
             for inner_key in inner_keys:
@@ -444,6 +477,7 @@ class Bot:
         if channel is None:
             channel = self.channel
 
+        MESSAGES_SENT.inc('privmsg')
         return self.irc.privmsg(message, channel, increase_message=increase_message)
 
     def c_uptime(self):
@@ -469,13 +503,13 @@ class Bot:
                 return 'No recorded stream FeelsBadMan '
 
     def execute_at(self, at, function, arguments=()):
-        self.reactor.execute_at(at, function, arguments)
+        self.reactor.execute_at(at, ChannelManager.wrap(function), arguments)
 
     def execute_delayed(self, delay, function, arguments=()):
-        self.reactor.execute_delayed(delay, function, arguments)
+        self.reactor.execute_delayed(delay, ChannelManager.wrap(function), arguments)
 
     def execute_every(self, period, function, arguments=()):
-        self.reactor.execute_every(period, function, arguments)
+        self.reactor.execute_every(period, ChannelManager.wrap(function), arguments)
 
     def _ban(self, username, reason=''):
         self.privmsg('.ban {0} {1}'.format(username, reason), increase_message=False)
@@ -520,6 +554,7 @@ class Bot:
 
         message = separator.join(messages)
 
+        MESSAGES_SENT.inc('whisper')
         return self.irc.whisper(username, message)
 
     def say(self, *messages, channel=None, separator='. '):
@@ -577,20 +612,20 @@ class Bot:
     def on_disconnect(self, chatconn, event):
         self.irc.on_disconnect(chatconn, event)
 
-    def parse_message(self, msg_raw, source, event, tags={}, whisper=False):
-        msg_lower = msg_raw.lower()
-
-        emote_tag = None
-
-        for tag in tags:
-            if tag['key'] == 'subscriber' and event.target == self.channel:
-                source.subscriber = tag['value'] == '1'
-            elif tag['key'] == 'emotes' and tag['value']:
-                emote_tag = tag['value']
-            elif tag['key'] == 'display-name' and tag['value']:
-                source.username_raw = tag['value']
-            elif tag['key'] == 'user-type':
-                source.moderator = tag['value'] == 'mod' or source.username == self.streamer
+    def parse_message(self, msg_raw, source, event, tags=None, whisper=False, features=None):
+        """ tags is the pajbot.tmi.Tags object of the event """
+        if tags is None:
+            tags = Tags()
+        if features is None:
+            features = MessageFeatures(msg_raw)
+
+        if 'subscriber' in tags and event.target == self.channel:
+            source.subscriber = tags['subscriber'] == '1'
+        display_name = tags.get('display-name')
+        if display_name:
+            source.username_raw = display_name
+        if 'user-type' in tags:
+            source.moderator = tags['user-type'] == 'mod' or source.username == self.streamer
 
         # source.num_lines += 1
 
@@ -606,29 +641,31 @@ class Bot:
         if source.timed_out is True:
             source.timed_out = False
 
-        # Parse emotes in the message
-        message_emotes = self.emotes.parse_message_twitch_emotes(source, msg_raw, emote_tag, whisper)
+        # Parse emotes in the message. They are counted in the background stage
+        message_emotes, new_user_tags = self.emotes.parse_emotes(msg_raw, tags.emotes)
+        features.emotes = message_emotes
 
-        urls = self.find_unique_urls(msg_raw)
+        urls = features.urls
 
         log.debug('{2}{0}: {1}'.format(source.username, msg_raw, '<w>' if whisper else ''))
 
+        # Moderation (banphrases, link checker, etc.) happens in the on_message handlers
         res = HandlerManager.trigger('on_message',
                 source, msg_raw, message_emotes, whisper, urls, event,
-                stop_on_false=True)
+                stop_on_false=True, features=features)
+
+        # Emote stats, last seen/last active and the on_message_background handlers
+        self.background_messages.add(BackgroundMessage(source, msg_raw, message_emotes, new_user_tags, whisper, urls, event, handled=res is not False, features=features))
+
         if res is False:
             return False
 
-        source.last_seen = datetime.datetime.now()
-        source.last_active = datetime.datetime.now()
-
         if source.ignored:
             return False
 
-        if msg_lower[:1] == '!':
-            msg_lower_parts = msg_lower.split(' ')
-            trigger = msg_lower_parts[0][1:]
-            msg_raw_parts = msg_raw.split(' ')
+        if msg_raw[:1] == '!':
+            trigger = features.lower_tokens[0][1:]
+            msg_raw_parts = features.tokens
             remaining_message = ' '.join(msg_raw_parts[1:]) if len(msg_raw_parts) > 1 else None
             if trigger in self.commands:
                 command = self.commands[trigger]
@@ -667,7 +704,8 @@ class Bot:
         # We use .lower() in case twitch ever starts sending non-lowercased usernames
         username = event.source.user.lower()
 
-        with self.users.get_user_context(username) as source:
+        MESSAGES_RECEIVED.inc('whisper')
+        with MESSAGE_DURATION.time('whisper'), QueryStats.context('whisper'), self.users.get_user_context(username) as source:
             self.parse_message(event.arguments[0], source, event, whisper=True, tags=event.tags)
 
     def on_ping(self, chatconn, event):
@@ -687,16 +725,15 @@ class Bot:
 
     def on_usernotice(self, chatconn, event):
         # We use .lower() in case twitch ever starts sending non-lowercased usernames
-        tags = {}
-        for d in event.tags:
-            tags[d['key']] = d['value']
+        tags = event.tags
 
         if 'login' not in tags:
             return
 
         username = tags['login']
 
-        with self.users.get_user_context(username) as source:
+        MESSAGES_RECEIVED.inc('usernotice')
+        with MESSAGE_DURATION.time('usernotice'), self.users.get_user_context(username) as source:
             msg = ''
             if len(event.arguments) > 0:
                 msg = event.arguments[0]
@@ -712,15 +749,18 @@ class Bot:
 
         username = event.source.user.lower()
 
+        MESSAGES_RECEIVED.inc(event.type)
+
         # We use .lower() in case twitch ever starts sending non-lowercased usernames
-        with self.users.get_user_context(username) as source:
+        with MESSAGE_DURATION.time(event.type), QueryStats.context('message'), self.users.get_user_context(username) as source:
+            features = MessageFeatures(event.arguments[0])
             res = HandlerManager.trigger('on_pubmsg',
                     source, event.arguments[0],
-                    stop_on_false=True)
+                    stop_on_false=True, features=features)
             if res is False:
                 return False
 
-            self.parse_message(event.arguments[0], source, event, tags=event.tags)
+            self.parse_message(event.arguments[0], source, event, tags=event.tags, features=features)
 
     @time_method
     def reload_all(self):
@@ -759,18 +799,30 @@ class Bot:
         self.execute_delayed(quit_delay, self.quit_bot)
 
     def quit_bot(self, **options):
+        self.shutdown()
+
+        try:
+            ScheduleManager.base_scheduler.shutdown(wait=False)
+        except:
+            log.exception('Error while shutting down the apscheduler')
+
+        self.irc.quit()
+
+        sys.exit(0)
+
+    def shutdown(self):
+        """ Save everything and say goodbye, without touching what might be shared with other channels """
+        if not self.background_messages.wait():
+            log.warning('Quitting with {} unhandled background messages'.format(self.background_messages.queue.qsize()))
+
         self.commit_all()
+        PointsManager.checkpoint()
         quit = '{nickname} {version} shutting down...'
         phrase_data = {
                 'nickname': self.nickname,
                 'version': self.version,
                 }
 
-        try:
-            ScheduleManager.base_scheduler.shutdown(wait=False)
-        except:
-            log.exception('Error while shutting down the apscheduler')
-
         try:
             self.say(quit.format(**phrase_data))
         except Exception:
@@ -778,9 +830,6 @@ class Bot:
 
         self.twitter_manager.quit()
         self.socket_manager.quit()
-        self.irc.quit()
-
-        sys.exit(0)
 
     def apply_filter(self, resp, filter):
         available_filters = {
@@ -799,8 +848,7 @@ class Bot:
         return resp
 
     def find_unique_urls(self, message):
-        from pajbot.modules.linkchecker import find_unique_urls
-        return find_unique_urls(self.url_regex, message)
+        return find_urls(message)
 
 
 def _filter_time_since_dt(var, args):
@@ -5,6 +5,7 @@ from sqlalchemy import func
 
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import DBManager
+from pajbot.managers.querystats import QueryStats
 from pajbot.models.user import User
 
 log = logging.getLogger(__name__)
@@ -532,6 +533,22 @@ class Dispatch:
         else:
             log.error('Eval cannot be used like that.')
 
+    def dbstats(bot, source, message, event, args):
+        """ Whisper the query shapes with the highest total time, and the average
+        amount of SQL statements run for each request context """
+        num = 3
+        if message and message.strip().isdigit():
+            num = min(int(message.strip()), 10)
+
+        report = QueryStats.get_report(num)
+        for i, shape in enumerate(report['shapes']):
+            bot.whisper(source.username, '#{0} {1:.2f}s total, {2} runs, {3:.3f}s max: {4}'.format(
+                i + 1, shape['total_time'], shape['count'], shape['max_time'], shape['shape'][:300]))
+
+        contexts = ['{0}: {1:.1f} statements/{2:.1f}ms avg'.format(name, stats['num_statements'] / stats['count'], stats['total_time'] * 1000 / stats['count'])
+                for name, stats in sorted(report['contexts'].items())]
+        bot.whisper(source.username, ', '.join(contexts) if len(contexts) > 0 else 'No SQL statements recorded yet')
+
     def check_sub(bot, source, message, event, args):
         if message:
             username = message.split(' ')[0].strip().lower()
@@ -0,0 +1,136 @@
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from pajbot.managers.channel import ChannelManager
+from pajbot.managers.handler import HandlerManager
+from pajbot.managers.metrics import MetricsManager
+from pajbot.managers.redis import RedisManager
+from pajbot.streamhelper import StreamHelper
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = MetricsManager.histogram('pajbot_background_batch_size', 'Number of messages handled in each background batch',
+        buckets=(1, 2, 5, 10, 25, 50, 100))
+DROPPED_MESSAGES = MetricsManager.counter('pajbot_background_messages_dropped_total', 'Number of messages whose side effects were dropped because the background queue was full')
+
+
+class BackgroundMessage:
+    """ Everything the background stage needs to know about a message that has already been moderated """
+
+    __slots__ = ('source', 'message', 'emotes', 'new_user_tags', 'whisper', 'urls', 'event', 'handled', 'features', 'timestamp')
+
+    def __init__(self, source, message, emotes, new_user_tags, whisper, urls, event, handled=True, features=None):
+        self.source = source
+        self.message = message
+        self.emotes = emotes
+        self.new_user_tags = new_user_tags
+        self.whisper = whisper
+        self.urls = urls
+        self.event = event
+
+        # False if one of the on_message handlers stopped the message (i.e. it was timed out)
+        self.handled = handled
+        self.features = features
+
+        self.timestamp = datetime.datetime.now().timestamp()
+
+
+class BackgroundMessageManager:
+    """
+    The side effects of a chat message that nobody is waiting for (emote counting,
+    last seen/last active bookkeeping and the on_message_background handlers, i.e.
+    quest progress, emote combos and websocket emits) are run here, in a separate thread,
+    so moderation and commands on the IRC thread don't have to wait for them.
+
+    Messages are handled in order, in batches of up to MAX_BATCH_SIZE messages.
+    All redis writes of a batch are sent in a single pipeline, with the emote counts
+    and last seen timestamps of the batch merged together.
+
+    The queue is bounded: if the background thread can't keep up, the side effects of
+    new messages are dropped instead of slowing down the IRC thread.
+    """
+
+    MAX_QUEUE_SIZE = 5000
+    MAX_BATCH_SIZE = 100
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.queue = queue.Queue(maxsize=self.MAX_QUEUE_SIZE)
+
+        self.thread = threading.Thread(target=ChannelManager.wrap(self.run), name='BackgroundMessageThread')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            DROPPED_MESSAGES.inc()
+            return
+
+        if message.handled and message.source.redis_loaded:
+            # last_seen and last_active are written to redis with the rest of the batch,
+            # so update the cached values now for anyone who reads them before then
+            message.source.values['last_seen'] = message.timestamp
+            message.source.values['last_active'] = message.timestamp
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.MAX_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.handle_batch(batch)
+            except:
+                log.exception('Unhandled exception while handling background messages')
+            finally:
+                for message in batch:
+                    self.queue.task_done()
+
+    def handle_batch(self, batch):
+        BATCH_SIZE.observe(len(batch))
+
+        emote_counts = {}
+        last_seen = {}
+        for message in batch:
+            if not message.whisper:
+                for emote in message.emotes:
+                    emote_counts[emote['code']] = emote_counts.get(emote['code'], 0) + emote['count']
+
+            if message.handled:
+                last_seen[message.source.username] = message.timestamp
+
+        streamer = StreamHelper.get_streamer()
+        with RedisManager.pipeline_context() as pipeline:
+            self.bot.emotes.count_emotes(emote_counts, pipeline)
+
+            for message in batch:
+                self.bot.emotes.add_user_tags(message.source, message.new_user_tags, pipeline)
+
+            if len(last_seen) > 0:
+                pipeline.hmset('{streamer}:users:last_seen'.format(streamer=streamer), last_seen)
+                pipeline.hmset('{streamer}:users:last_active'.format(streamer=streamer), last_seen)
+
+        for message in batch:
+            if message.handled:
+                HandlerManager.trigger('on_message_background',
+                        message.source, message.message, message.emotes, message.whisper, message.urls, message.event,
+                        stop_on_false=False, features=message.features)
+
+    def wait(self, timeout=5):
+        """ Wait until every queued message has been handled, or the timeout runs out.
+        Returns True if the queue was drained """
+        end_time = time.monotonic() + timeout
+        while self.queue.unfinished_tasks > 0:
+            if time.monotonic() >= end_time:
+                return False
+            time.sleep(0.01)
+
+        return True
@@ -0,0 +1,68 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class Channel:
+    """
+    The state of one channel in a process that serves several channels, see pajbot.multichannel.
+
+    The managers that keep their state in class attributes (StreamHelper, HandlerManager,
+    DBManager, UserManager, ActionParser) keep it here instead while a channel is active.
+    """
+
+    def __init__(self, streamer):
+        self.streamer = streamer
+        self.bot = None
+        self.stream_manager = None
+
+        # event -> list of handlers, see HandlerManager
+        self.handlers = None
+
+        # See DBManager.init
+        self.engine = None
+        self.Session = None
+        self.ScopedSession = None
+
+    def __repr__(self):
+        return 'Channel({!r})'.format(self.streamer)
+
+
+class ChannelManager:
+    """
+    Keeps track of which channel the current thread is working for.
+
+    When no channel is active (i.e. when the bot only serves one channel, or in the web interface)
+    everything uses the class attributes of the managers, like it always has.
+
+    Code that runs something later or in another thread (the reactor, the scheduler, the action queues)
+    wraps the function with ChannelManager.wrap, so it runs for the same channel it was scheduled from.
+    """
+
+    local = threading.local()
+
+    def current():
+        """ Returns the active Channel, or None """
+        return getattr(ChannelManager.local, 'channel', None)
+
+    @contextmanager
+    def context(channel):
+        previous = ChannelManager.current()
+        ChannelManager.local.channel = channel
+        try:
+            yield channel
+        finally:
+            ChannelManager.local.channel = previous
+
+    def wrap(f):
+        """ Returns a function that runs f for the channel that's active right now """
+        channel = ChannelManager.current()
+        if channel is None:
+            return f
+
+        def wrapped(*args, **kwargs):
+            with ChannelManager.context(channel):
+                return f(*args, **kwargs)
+        return wrapped
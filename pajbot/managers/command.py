@@ -5,10 +5,12 @@ from collections import UserDict
 from sqlalchemy.orm import joinedload
 
 from pajbot.managers.db import DBManager
+from pajbot.managers.redis import RedisManager
 from pajbot.models.command import Command
 from pajbot.models.command import CommandData
 from pajbot.models.command import CommandExample
 from pajbot.models.command import parse_command_for_web
+from pajbot.streamhelper import StreamHelper
 from pajbot.utils import find
 
 log = logging.getLogger(__name__)
@@ -84,6 +86,21 @@ class CommandManager(UserDict):
     def __del__(self):
         self.db_session.close()
 
+    def get_version_key():
+        return '{streamer}:commands:version'.format(streamer=StreamHelper.get_streamer())
+
+    def publish_version(self):
+        """ Bump the version of the command list, which tells the web interface
+        that its snapshot of the command list is outdated.
+        Only the bots CommandManager publishes versions. """
+        if self.bot is None:
+            return
+
+        try:
+            RedisManager.get().incr(CommandManager.get_version_key())
+        except:
+            log.exception('Unable to publish new command list version')
+
     def commit(self):
         self.db_session.commit()
 
@@ -245,6 +262,9 @@ class CommandManager(UserDict):
         self.internal_commands['eval'] = Command.dispatch_command('eval',
                 level=2000,
                 description='Run a raw python command. Debug mode only')
+        self.internal_commands['dbstats'] = Command.dispatch_command('dbstats',
+                level=2000,
+                description='Whisper the SQL queries with the highest total time, and how many statements each request runs on average')
 
         return self.internal_commands
 
@@ -274,6 +294,7 @@ class CommandManager(UserDict):
         command_to_edit.data.set(**options)
         DBManager.session_add_expunge(command_to_edit)
         self.commit()
+        self.publish_version()
 
     def remove_command_aliases(self, command):
         aliases = command.command.split('|')
@@ -359,6 +380,8 @@ class CommandManager(UserDict):
             for enabled_module in self.module_manager.modules:
                 merge_commands(enabled_module.commands, self.data)
 
+        self.publish_version()
+
     def load(self, **options):
         self.load_internal_commands(**options)
         self.load_db_commands(**options)
@@ -8,6 +8,7 @@ from irc.client import InvalidCharacters
 from irc.client import MessageTooLong
 from irc.client import ServerNotConnectedError
 
+from pajbot.tmi import parse_line
 from pajbot.utils import find
 
 log = logging.getLogger('pajbot')
@@ -45,12 +46,27 @@ class CustomServerConnection(irc.client.ServerConnection):
             # Ouch!
             self.disconnect('Connection reset by peer.')
 
+    def _process_line(self, line):
+        """
+        Chat messages, whispers and usernotices are parsed by pajbot.tmi.parse_line,
+        so their tags are only parsed and unescaped when they're used.
+        Everything else is left to irc.client
+        """
+        if self.real_server_name:
+            event = parse_line(line)
+            if event is not None:
+                self._handle_event(irc.client.Event('all_raw_messages', self.get_server_name(), None, [line]))
+                self._handle_event(event)
+                return
+
+        super()._process_line(line)
+
 
 class Connection:
     def __init__(self, conn):
         self.conn = conn
         self.num_msgs_sent = 0
-        self.in_channel = False
+        self.joined_channels = set()
 
         return
 
@@ -59,11 +75,16 @@ class Connection:
 
 
 class ConnectionManager:
-    def __init__(self, reactor, bot, message_limit, streamer, backup_conns=2):
+    def __init__(self, reactor, bot, message_limit, streamer, backup_conns=2, chat_server=None):
+        """ chat_server can be set to a host:port to always connect to, instead of asking Twitch for a server """
         self.backup_conns_number = backup_conns
+        self.chat_server = chat_server
         self.streamer = streamer
         self.channel = '#' + self.streamer
 
+        # Every channel the main connection should be in, see add_channel
+        self.channels = [self.channel]
+
         self.reactor = reactor
         self.bot = bot
         self.message_limit = message_limit
@@ -126,14 +147,20 @@ class ConnectionManager:
         self.get_main_conn()
         self.maintenance_lock = False
 
+    def add_channel(self, channel):
+        """ Join another channel with the same connections """
+        if channel not in self.channels:
+            self.channels.append(channel)
+
     def get_main_conn(self):
         for connection in self.connlist:
             if connection.conn.is_connected():
-                if not connection.in_channel:
-                    if irc.client.is_channel(self.channel):
-                        connection.conn.join(self.channel)
-                        log.debug('Joined channel')
-                        connection.in_channel = True
+                if len(connection.joined_channels) < len(self.channels):
+                    for channel in self.channels:
+                        if channel not in connection.joined_channels and irc.client.is_channel(channel):
+                            connection.conn.join(channel)
+                            log.debug('Joined channel {}'.format(channel))
+                        connection.joined_channels.add(channel)
 
                 return connection.conn
 
@@ -141,6 +168,10 @@ class ConnectionManager:
         return self.get_main_conn()
 
     def get_chat_server(self, streamer):
+        if self.chat_server is not None:
+            ip, port = self.chat_server.split(':')
+            return ip, int(port)
+
         data = None
         try:
             data = self.bot.twitchapi.get(['channels', streamer, 'chat_properties'])
@@ -6,6 +6,10 @@ from sqlalchemy import inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from pajbot.managers.channel import ChannelManager
+from pajbot.managers.querystats import QueryStats
 
 Base = declarative_base()
 
@@ -13,10 +17,46 @@ log = logging.getLogger('pajbot')
 
 
 class DBManager:
-    def init(url):
-        DBManager.engine = create_engine(url)
-        DBManager.Session = sessionmaker(bind=DBManager.engine, autoflush=False)
-        DBManager.ScopedSession = scoped_session(sessionmaker(bind=DBManager.engine))
+    def init(url, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=3600, pool_pre_ping=True, slow_query_threshold=None):
+        options = {
+                'pool_recycle': pool_recycle,
+                'pool_pre_ping': pool_pre_ping,
+                }
+        if url == 'sqlite://':
+            # An in-memory database only exists within its connection, so every thread has to share the same one
+            options['poolclass'] = StaticPool
+            options['connect_args'] = {'check_same_thread': False}
+        elif not url.startswith('sqlite'):
+            # sqlite uses a single connection per thread, which can't be sized
+            options['pool_size'] = pool_size
+            options['max_overflow'] = max_overflow
+            options['pool_timeout'] = pool_timeout
+
+        # Every channel has its own database, see ChannelManager
+        target = ChannelManager.current() or DBManager
+
+        target.engine = create_engine(url, **options)
+        QueryStats.register(target.engine, slow_query_threshold=slow_query_threshold)
+        target.Session = sessionmaker(bind=target.engine, autoflush=False)
+        target.ScopedSession = scoped_session(sessionmaker(bind=target.engine))
+
+    def get_engine():
+        channel = ChannelManager.current()
+        if channel is not None and channel.engine is not None:
+            return channel.engine
+        return DBManager.engine
+
+    def get_pool_options(config):
+        """ Returns the keyword arguments for DBManager.init from the [main] section of the config """
+        options = {}
+        for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+            if 'db_' + key in config:
+                options[key] = int(config['db_' + key])
+        if 'db_pool_pre_ping' in config:
+            options['pool_pre_ping'] = config['db_pool_pre_ping'] == '1'
+        if 'slow_query_threshold' in config:
+            options['slow_query_threshold'] = float(config['slow_query_threshold'])
+        return options
 
     def create_session(**options):
         """
@@ -24,7 +64,10 @@ class DBManager:
         expire_on_commit=False
         """
 
+        channel = ChannelManager.current()
         try:
+            if channel is not None and channel.Session is not None:
+                return channel.Session(**options)
             return DBManager.Session(**options)
         except:
             log.exception('Unhandled exception while creating a session')
@@ -37,7 +80,10 @@ class DBManager:
         expire_on_commit=False
         """
 
+        channel = ChannelManager.current()
         try:
+            if channel is not None and channel.ScopedSession is not None:
+                return channel.ScopedSession(**options)
             return DBManager.ScopedSession(**options)
         except:
             log.exception('Unhandled exception while creating a scoped session')
@@ -3,6 +3,7 @@ import json
 import logging
 import os
 import re
+import time
 
 import requests
 
@@ -10,11 +11,20 @@ from pajbot.apiwrappers import APIBase
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.streamhelper import StreamHelper
+from pajbot.tmi import parse_emotes_tag
 
 log = logging.getLogger(__name__)
 
 
 class BTTVEmoteManager:
+    # (code, hash) -> emote, shared by every channel served by this process
+    emotes = {}
+
+    # Global emotes fetched within the last GLOBAL_EMOTES_TTL seconds are reused
+    GLOBAL_EMOTES_TTL = 60 * 60
+    global_emotes_data = None
+    global_emotes_updated_at = 0
+
     def __init__(self):
         from pajbot.apiwrappers import BTTVApi
         self.bttv_api = BTTVApi()
@@ -36,15 +46,26 @@ class BTTVEmoteManager:
             self.all_emotes.append(self.build_emote(emote_code, emote_hash))
 
     def build_emote(self, emote_code, emote_hash):
-        return {
-                'code': emote_code,
-                'emote_hash': emote_hash,
-                'regex': re.compile('(?<![^ ]){0}(?![^ ])'.format(re.escape(emote_code))),
-                }
+        key = (emote_code, emote_hash)
+        emote = BTTVEmoteManager.emotes.get(key, None)
+        if emote is None:
+            emote = BTTVEmoteManager.emotes[key] = {
+                    'code': emote_code,
+                    'emote_hash': emote_hash,
+                    'regex': re.compile('(?<![^ ]){0}(?![^ ])'.format(re.escape(emote_code))),
+                    }
+        return emote
+
+    def get_global_emotes(self):
+        now = time.time()
+        if BTTVEmoteManager.global_emotes_data is None or now - BTTVEmoteManager.global_emotes_updated_at > self.GLOBAL_EMOTES_TTL:
+            BTTVEmoteManager.global_emotes_data = self.bttv_api.get_global_emotes()
+            BTTVEmoteManager.global_emotes_updated_at = now
+        return BTTVEmoteManager.global_emotes_data
 
     def update_emotes(self):
         log.debug('Updating BTTV Emotes...')
-        global_emotes = self.bttv_api.get_global_emotes()
+        global_emotes = self.get_global_emotes()
         channel_emotes = self.bttv_api.get_channel_emotes(StreamHelper.get_streamer())
 
         self.global_emotes = [emote['code'] for emote in global_emotes]
@@ -70,13 +91,19 @@ class BTTVEmoteManager:
 
 
 class EmoteManager:
+    # Twitch emotes are the same for every channel, so they're only loaded and updated once per process
+    subemotes = None
+
     def __init__(self, bot):
         # this should probably not even be a dictionary
         self.bot = bot
         self.streamer = bot.streamer
         self.bttv_emote_manager = BTTVEmoteManager()
-        redis = RedisManager.get()
-        self.subemotes = redis.hgetall('global:emotes:twitch_subemotes')
+
+        load_subemotes = EmoteManager.subemotes is None
+        if load_subemotes:
+            redis = RedisManager.get()
+            EmoteManager.subemotes = redis.hgetall('global:emotes:twitch_subemotes')
 
         # Emote current EPM
         self.epm = {}
@@ -86,7 +113,8 @@ class EmoteManager:
             ScheduleManager.execute_every(60 * 60 * 2, self.bttv_emote_manager.update_emotes)
 
             # Update Twitch emotes every 3 hours
-            ScheduleManager.execute_every(60 * 60 * 3, self.update_emotes)
+            if load_subemotes:
+                ScheduleManager.execute_every(60 * 60 * 3, self.update_emotes)
         except:
             pass
 
@@ -152,7 +180,7 @@ class EmoteManager:
             pipeline.hmset('global:emotes:twitch', twitch_emotes)
             pipeline.hmset('global:emotes:twitch_subemotes', twitch_subemotes)
 
-        self.subemotes = twitch_subemotes
+        EmoteManager.subemotes = twitch_subemotes
 
     def get_global_emotes(self, force=False):
         if len(self.global_emotes) > 0 or force is True:
@@ -180,23 +208,38 @@ class EmoteManager:
         return list(set(emotes_full_list) - set(emotes_remove_list))
 
     def parse_message_twitch_emotes(self, source, message, tag, whisper):
+        """ Parse the emotes in the message, and update the emote stats and sub emote tags right away """
+        message_emotes, new_user_tags = self.parse_emotes(message, tag)
+
+        if len(message_emotes) > 0 or len(new_user_tags) > 0:
+            with RedisManager.pipeline_context() as pipeline:
+                if not whisper:
+                    emote_counts = {}
+                    for emote in message_emotes:
+                        emote_counts[emote['code']] = emote_counts.get(emote['code'], 0) + emote['count']
+                    self.count_emotes(emote_counts, pipeline)
+
+                self.add_user_tags(source, new_user_tags, pipeline)
+
+        return message_emotes
+
+    def parse_emotes(self, message, tag):
+        """ Returns a tuple of (message_emotes, new_user_tags), without touching redis.
+        tag is the value of the emotes tag, either raw or already parsed with pajbot.tmi.parse_emotes_tag.
+        new_user_tags are the sub tags the user should get for using sub emotes """
         message_emotes = []
         new_user_tags = []
 
         # Twitch Emotes
+        if isinstance(tag, str):
+            tag = parse_emotes_tag(tag)
         if tag:
-            emote_data = tag.split('/')
-            for emote in emote_data:
+            for emote_id, emote_ranges in tag:
                 try:
-                    emote_id, emote_occurrences = emote.split(':')
-                    emote_indices = emote_occurrences.split(',')
-
                     # figure out how many times the emote occured in the message
-                    emote_count = len(emote_indices)
+                    emote_count = len(emote_ranges)
 
-                    first_index, last_index = emote_indices[0].split('-')
-                    first_index = int(first_index)
-                    last_index = int(last_index)
+                    first_index, last_index = emote_ranges[0]
                     emote_code = message[first_index:last_index + 1]
                     if emote_code[0] == ':':
                         emote_code = emote_code.upper()
@@ -212,8 +255,8 @@ class EmoteManager:
                     if sub:
                         new_user_tags.append('{sub}_sub'.format(sub=sub))
                 except:
-                    log.exception('Exception caught while splitting emote data')
-                    log.error('Emote data: {}'.format(emote_data))
+                    log.exception('Exception caught while parsing emote data')
+                    log.error('Emote data: {}'.format(tag))
                     log.error('Message: {}'.format(message))
 
         # BTTV Emotes
@@ -235,21 +278,23 @@ class EmoteManager:
                     'count': num,
                     })
 
-        if len(message_emotes) > 0 or len(new_user_tags) > 0:
-            streamer = StreamHelper.get_streamer()
-            with RedisManager.pipeline_context() as pipeline:
-                if not whisper:
-                    for emote in message_emotes:
-                        pipeline.zincrby('{streamer}:emotes:count'.format(streamer=streamer), emote['code'], emote['count'])
-                        self.epm_incr(emote['code'], emote['count'])
+        return message_emotes, new_user_tags
 
-                user_tags = source.get_tags()
+    def count_emotes(self, emote_counts, pipeline):
+        """ emote_counts is a dictionary of emote code -> how many times it was used """
+        key = '{streamer}:emotes:count'.format(streamer=StreamHelper.get_streamer())
+        for code, count in emote_counts.items():
+            pipeline.zincrby(key, code, count)
+            self.epm_incr(code, count)
 
-                for tag in new_user_tags:
-                    user_tags[tag] = (datetime.datetime.now() + datetime.timedelta(days=15)).timestamp()
-                source.set_tags(user_tags, redis=pipeline)
+    def add_user_tags(self, source, new_user_tags, pipeline):
+        if len(new_user_tags) == 0:
+            return
 
-        return message_emotes
+        user_tags = source.get_tags()
+        for tag in new_user_tags:
+            user_tags[tag] = (datetime.datetime.now() + datetime.timedelta(days=15)).timestamp()
+        source.set_tags(user_tags, redis=pipeline)
 
     def epm_incr(self, code, count):
         if code in self.epm:
@@ -1,24 +1,41 @@
+import inspect
 import logging
 import operator
 
+from pajbot.managers.channel import ChannelManager
+from pajbot.managers.metrics import MetricsManager
 from pajbot.utils import find
 
 log = logging.getLogger('pajbot')
 
+HANDLER_DURATION = MetricsManager.histogram('pajbot_handler_duration_seconds', 'Time spent running all handlers of an event', ['event'])
+
 
 class HandlerManager:
     handlers = {}
 
     @staticmethod
     def init_handlers():
-        HandlerManager.handlers = {}
+        channel = ChannelManager.current()
+        if channel is not None:
+            channel.handlers = {}
+        else:
+            HandlerManager.handlers = {}
+
+        # The message events pass a MessageFeatures object (see pajbot.models.message)
+        # to every handler that takes a `features` keyword argument.
 
-        # on_pubmsg(source, message)
+        # on_pubmsg(source, message, features=None)
         HandlerManager.create_handler('on_pubmsg')
 
-        # on_message(source, message, emotes, whisper, urls, event)
+        # on_message(source, message, emotes, whisper, urls, event, features=None)
         HandlerManager.create_handler('on_message')
 
+        # on_message_background(source, message, emotes, whisper, urls, event, features=None)
+        # Triggered from the background message thread for every message that made it through on_message.
+        # Meant for side effects that don't need to happen before the next message is read, see BackgroundMessageManager
+        HandlerManager.create_handler('on_message_background')
+
         # on_usernotice(source, message, tags)
         HandlerManager.create_handler('on_usernotice')
 
@@ -40,6 +57,9 @@ class HandlerManager:
         # on_multiraffle_win(winners, points_per_user)
         HandlerManager.create_handler('on_multiraffle_win')
 
+        # on_bulk_add_points(user_points)
+        HandlerManager.create_handler('on_bulk_add_points')
+
         # on_roulette_finish(user, points)
         HandlerManager.create_handler('on_roulette_finish')
 
@@ -67,14 +87,31 @@ class HandlerManager:
         # send_whisper(user, message)
         HandlerManager.create_handler('send_whisper')
 
+    def get_handlers():
+        """ Returns the handlers of the active channel, see ChannelManager """
+        channel = ChannelManager.current()
+        if channel is not None and channel.handlers is not None:
+            return channel.handlers
+        return HandlerManager.handlers
+
     def create_handler(event):
         """ Create an empty list for the given event """
-        HandlerManager.handlers[event] = []
+        HandlerManager.get_handlers()[event] = []
+
+    def accepts_features(method):
+        """ Returns True if the method can be called with a features keyword argument """
+        try:
+            parameters = inspect.signature(method).parameters
+        except (TypeError, ValueError):
+            return False
+
+        return 'features' in parameters or any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values())
 
     def add_handler(event, method, priority=0):
         try:
-            HandlerManager.handlers[event].append((method, priority))
-            HandlerManager.handlers[event].sort(key=operator.itemgetter(1), reverse=True)
+            handlers = HandlerManager.get_handlers()[event]
+            handlers.append((method, priority, HandlerManager.accepts_features(method)))
+            handlers.sort(key=operator.itemgetter(1), reverse=True)
         except KeyError:
             # No handlers for this event found
             log.error('add_handler No handler for {} found.'.format(event))
@@ -85,25 +122,32 @@ class HandlerManager:
     def remove_handler(event, method):
         handler = None
         try:
-            handler = find(lambda h: HandlerManager.method_matches(h, method), HandlerManager.handlers[event])
+            handlers = HandlerManager.get_handlers()[event]
+            handler = find(lambda h: HandlerManager.method_matches(h, method), handlers)
             if handler is not None:
-                HandlerManager.handlers[event].remove(handler)
+                handlers.remove(handler)
         except KeyError:
             # No handlers for this event found
             log.error('remove_handler No handler for {} found.'.format(event))
 
-    def trigger(event, *arguments, stop_on_false=True):
-        if event not in HandlerManager.handlers:
+    def trigger(event, *arguments, stop_on_false=True, features=None):
+        handlers = HandlerManager.get_handlers()
+        if event not in handlers:
             log.error('No handler set for event {}'.format(event))
             return False
 
-        for handler, priority in HandlerManager.handlers[event]:
-            res = None
-            try:
-                res = handler(*arguments)
-            except:
-                log.exception('Unhandled exception from {} in {}'.format(handler, event))
-
-            if res is False and stop_on_false is True:
-                # Abort if handler returns false and stop_on_false is enabled
-                return False
+        with HANDLER_DURATION.time(event):
+            # Handlers can be added or removed from another thread while we're iterating
+            for handler, priority, accepts_features in list(handlers[event]):
+                res = None
+                try:
+                    if accepts_features and features is not None:
+                        res = handler(*arguments, features=features)
+                    else:
+                        res = handler(*arguments)
+                except:
+                    log.exception('Unhandled exception from {} in {}'.format(handler, event))
+
+                if res is False and stop_on_false is True:
+                    # Abort if handler returns false and stop_on_false is enabled
+                    return False
@@ -0,0 +1,105 @@
+import datetime
+import logging
+
+from sqlalchemy import func
+
+from pajbot.managers.db import DBManager
+from pajbot.managers.redis import RedisManager
+from pajbot.streamhelper import StreamHelper
+from pajbot.utils import time_method
+
+log = logging.getLogger(__name__)
+
+# KEYS[1] = highlight count hash, KEYS[2] = key that is set once the index has been built
+# ARGV[1] = day (YYYY-MM-DD), ARGV[2] = delta
+# Returns the new count for the day, or nil if the index has not been built yet
+SCRIPT_ADD_HIGHLIGHTS = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return nil
+end
+local new_value = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if new_value <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return new_value
+"""
+
+RedisManager.register_script('highlights.add', SCRIPT_ADD_HIGHLIGHTS)
+
+
+class HighlightManager:
+    """
+    Keeps an index of how many highlights were created on each day, so the
+    highlight calendar doesn't have to go through every highlight ever created.
+
+    The index is a redis hash of YYYY-MM-DD -> number of highlights, which is
+    updated by the StreamManager whenever a highlight is created or removed.
+    If the index does not exist yet, it's built with a single GROUP BY query.
+    """
+
+    DATE_FORMAT = '%Y-%m-%d'
+
+    def get_key():
+        return '{streamer}:highlights:days'.format(streamer=StreamHelper.get_streamer())
+
+    def get_built_key():
+        return '{streamer}:highlights:days_built'.format(streamer=StreamHelper.get_streamer())
+
+    def on_highlight_added(created_at, redis=None):
+        return HighlightManager._add(created_at, 1, redis=redis)
+
+    def on_highlight_removed(created_at, redis=None):
+        return HighlightManager._add(created_at, -1, redis=redis)
+
+    def _add(created_at, amount, redis=None):
+        # If the index has not been built yet, it's built from the database the next time it's read
+        keys = [HighlightManager.get_key(), HighlightManager.get_built_key()]
+        args = [created_at.strftime(HighlightManager.DATE_FORMAT), amount]
+        return RedisManager.run_script('highlights.add', keys=keys, args=args, client=redis)
+
+    def get_highlight_counts(redis=None):
+        """ Returns a dictionary of date -> number of highlights created on that date """
+        if redis is None:
+            redis = RedisManager.get()
+
+        with redis.pipeline() as pipeline:
+            pipeline.exists(HighlightManager.get_built_key())
+            pipeline.hgetall(HighlightManager.get_key())
+            built, counts = pipeline.execute()
+
+        if not built:
+            counts = HighlightManager.rebuild()
+
+        return {datetime.datetime.strptime(day, HighlightManager.DATE_FORMAT).date(): int(count) for day, count in counts.items()}
+
+    def get_dates_with_highlights(redis=None):
+        return sorted(HighlightManager.get_highlight_counts(redis=redis).keys())
+
+    @time_method
+    def rebuild():
+        """ Rebuild the index from the database.
+        Returns the new index as a dictionary of YYYY-MM-DD -> number of highlights """
+        from pajbot.models.stream import StreamChunkHighlight
+
+        redis = RedisManager.get()
+
+        log.info('Rebuilding highlight calendar')
+
+        with DBManager.create_session_scope() as db_session:
+            day = func.date(StreamChunkHighlight.created_at)
+            query = db_session.query(day, func.count(StreamChunkHighlight.id)).group_by(day)
+            counts = {}
+            for date, count in query:
+                if isinstance(date, str):
+                    # Some database backends (i.e. sqlite) return the date as a string
+                    date = datetime.datetime.strptime(date, HighlightManager.DATE_FORMAT)
+                counts[date.strftime(HighlightManager.DATE_FORMAT)] = count
+
+        with redis.pipeline() as pipeline:
+            pipeline.delete(HighlightManager.get_key())
+            if len(counts) > 0:
+                pipeline.hmset(HighlightManager.get_key(), counts)
+            pipeline.set(HighlightManager.get_built_key(), 1)
+            pipeline.execute()
+
+        return counts
@@ -1,8 +1,10 @@
 import logging
 
 from pajbot.managers.connection import ConnectionManager
+from pajbot.managers.metrics import MetricsManager
 from pajbot.managers.singleconnection import SingleConnectionManager
 from pajbot.managers.whisperconnection import WhisperConnectionManager
+from pajbot.tmi import Tags
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +19,12 @@ def do_nothing(c, e):
     pass
 
 
+def ensure_tags(event):
+    """ Events that were parsed by irc.client have a list of tags, the bot expects a Tags object """
+    if not isinstance(event.tags, Tags):
+        event.tags = Tags.from_list(event.tags)
+
+
 class IRCManager:
     def __init__(self, bot):
         self.bot = bot
@@ -46,6 +54,12 @@ class IRCManager:
     def _dispatcher(self, connection, event):
         log.warn('Missing implementation of IRCManager::_dispatcher()')
 
+    def add_dispatcher(self, reactor):
+        reactor.add_global_handler('all_events', self._dispatcher, -10)
+
+    def add_channel(self, channel):
+        log.warn('Missing implementation of IRCManager::add_channel()')
+
     def on_welcome(self, chatconn, event):
         pass
 
@@ -72,6 +86,8 @@ class SingleIRCManager(IRCManager):
 
     def _dispatcher(self, connection, event):
         method = getattr(self.bot, 'on_' + event.type, do_nothing)
+        if method is not do_nothing:
+            ensure_tags(event)
         method(connection, event)
 
     def start(self):
@@ -102,19 +118,45 @@ class MultiIRCManager(IRCManager):
     def __init__(self, bot):
         super().__init__(bot)
 
-        self.connection_manager = ConnectionManager(self.bot.reactor, self.bot, TMI.message_limit, streamer=self.bot.streamer)
+        # Used to connect to a local chat server instead of Twitch, see pajbot.scripts.fake_tmi
+        chat_server = self.bot.config['main'].get('irc_server', None)
+
+        self.connection_manager = ConnectionManager(self.bot.reactor, self.bot, TMI.message_limit, streamer=self.bot.streamer, chat_server=chat_server)
         chub = self.bot.config['main'].get('control_hub', None)
         if chub is not None:
-            self.control_hub = ConnectionManager(self.bot.reactor, self.bot, TMI.message_limit, streamer=chub, backup_conns=1)
+            self.control_hub = ConnectionManager(self.bot.reactor, self.bot, TMI.message_limit, streamer=chub, backup_conns=1, chat_server=chat_server)
         else:
             self.control_hub = None
 
         # XXX
         self.bot.execute_every(30, lambda: self.connection_manager.get_main_conn().ping('tmi.twitch.tv'))
 
-        self.whisper_manager = WhisperConnectionManager(self.bot.reactor, self, self.bot.streamer, TMI.whispers_message_limit, TMI.whispers_limit_interval)
+        self.whisper_manager = WhisperConnectionManager(self.bot.reactor, self, self.bot.streamer, TMI.whispers_message_limit, TMI.whispers_limit_interval, chat_server=chat_server)
         self.whisper_manager.start(accounts=[{'username': self.username, 'oauth': self.password, 'can_send_whispers': self.bot.config.getboolean('main', 'add_self_as_whisper_account')}])
 
+        MetricsManager.add_collector('irc', self.collect_metrics)
+
+    def collect_metrics(self):
+        """ Metrics collector for MetricsManager """
+        managers = [('chat', self.connection_manager), ('whisper', self.whisper_manager)]
+        if self.control_hub is not None:
+            managers.append(('control_hub', self.control_hub))
+
+        connection_samples = []
+        for name, manager in managers:
+            connlist = list(manager.connlist)
+            num_connected = len([connection for connection in connlist if connection is not None and connection.conn.is_connected()])
+            connection_samples.append(({'manager': name, 'state': 'connected'}, num_connected))
+            connection_samples.append(({'manager': name, 'state': 'disconnected'}, len(connlist) - num_connected))
+
+        return [
+                ('pajbot_irc_connections', 'gauge', 'Number of IRC connections in each connection manager', connection_samples),
+                ('pajbot_whisper_backlog', 'gauge', 'Number of whispers waiting to be sent', [({}, self.whisper_manager.whispers.qsize())]),
+                ]
+
+    def add_channel(self, channel):
+        self.connection_manager.add_channel(channel)
+
     def whisper(self, username, message):
         if self.whisper_manager:
             self.whisper_manager.whisper(username, message)
@@ -132,6 +174,8 @@ class MultiIRCManager(IRCManager):
     def _dispatcher(self, connection, event):
         if connection == self.connection_manager.get_main_conn() or connection in self.whisper_manager or (self.control_hub is not None and connection == self.control_hub.get_main_conn()):
             method = getattr(self.bot, 'on_' + event.type, do_nothing)
+            if method is not do_nothing:
+                ensure_tags(event)
             method(connection, event)
 
     def privmsg(self, message, channel, increase_message=True):
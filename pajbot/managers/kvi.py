@@ -30,15 +30,18 @@ class KVIData:
 
         return value
 
+    def add(self, amount, redis=None):
+        """ Atomically add `amount` to the value. Returns the new value """
+        if redis is None:
+            redis = RedisManager.get()
+
+        return redis.hincrby(self.key, self.id, amount)
+
     def inc(self):
-        redis = RedisManager.get()
-        old_value = self.get(redis=redis)
-        self.set(old_value + 1, redis=redis)
+        return self.add(1)
 
     def dec(self):
-        redis = RedisManager.get()
-        old_value = self.get(redis=redis)
-        self.set(old_value - 1, redis=redis)
+        return self.add(-1)
 
     def __str__(self):
         return str(self.get())
@@ -0,0 +1,155 @@
+import logging
+
+from pajbot.managers.db import DBManager
+from pajbot.managers.redis import RedisManager
+from pajbot.streamhelper import StreamHelper
+from pajbot.utils import time_method
+
+log = logging.getLogger(__name__)
+
+
+class LeaderboardManager:
+    """
+    Keeps precomputed leaderboards in redis sorted sets, so reading the
+    top X users of something is a single ZREVRANGE instead of an ORDER BY
+    over a whole table.
+
+    The watch time boards are keyed by username and are incremented
+    by the chatters module whenever it hands out minutes.
+    The duel boards are keyed by user ID and are updated by the
+    DuelManager whenever a users duel stats change.
+
+    Boards that have never been built are rebuilt from the database
+    when the bot starts (see LeaderboardManager.init).
+    """
+
+    # Boards keyed by username
+    WATCHTIME_BOARDS = [
+            'minutes_in_chat_online',
+            'minutes_in_chat_offline',
+            ]
+
+    # Boards keyed by user ID
+    DUEL_BOARDS = [
+            'duels_won',
+            'duels_lost',
+            'duel_profit',
+            'duel_winrate',
+            'duel_winrate_bottom',
+            ]
+
+    # How many duels a user needs to have won (or lost) before he shows up
+    # on the top (or bottom) winrate board
+    MIN_DUELS_FOR_WINRATE = 5
+
+    def get_key(board):
+        return '{streamer}:leaderboards:{board}'.format(streamer=StreamHelper.get_streamer(), board=board)
+
+    def get_built_key():
+        return '{streamer}:leaderboards:built'.format(streamer=StreamHelper.get_streamer())
+
+    def init():
+        """ Build any boards that have not been built yet """
+        redis = RedisManager.get()
+        built_boards = redis.smembers(LeaderboardManager.get_built_key())
+
+        if any(board not in built_boards for board in LeaderboardManager.WATCHTIME_BOARDS):
+            LeaderboardManager.rebuild_watchtime()
+
+        if any(board not in built_boards for board in LeaderboardManager.DUEL_BOARDS):
+            LeaderboardManager.rebuild_duel_stats()
+
+    def add_minutes(pipeline, usernames, minutes, online):
+        """ Increment the watch time of the given users.
+        Meant to be called with the same redis pipeline that is used to
+        save the rest of the chatters data. """
+        key = LeaderboardManager.get_key('minutes_in_chat_online' if online else 'minutes_in_chat_offline')
+        for username in usernames:
+            pipeline.zincrby(key, username, minutes)
+
+    def update_duel_stats(user_duel_stats, redis=None):
+        """ Write the current values of a UserDuelStats object to the duel boards """
+        if redis is None:
+            redis = RedisManager.get()
+
+        with redis.pipeline() as pipeline:
+            LeaderboardManager._queue_duel_stats(pipeline, user_duel_stats)
+            pipeline.execute()
+
+    def _queue_duel_stats(pipeline, user_duel_stats):
+        user_id = user_duel_stats.user_id
+        pipeline.zadd(LeaderboardManager.get_key('duels_won'), user_id, user_duel_stats.duels_won)
+        pipeline.zadd(LeaderboardManager.get_key('duels_lost'), user_id, user_duel_stats.duels_lost)
+        pipeline.zadd(LeaderboardManager.get_key('duel_profit'), user_id, user_duel_stats.profit)
+
+        if user_duel_stats.duels_total > 0:
+            winrate = user_duel_stats.duels_won * 100 / user_duel_stats.duels_total
+        else:
+            winrate = 0
+
+        for board, num_duels in (('duel_winrate', user_duel_stats.duels_won), ('duel_winrate_bottom', user_duel_stats.duels_lost)):
+            key = LeaderboardManager.get_key(board)
+            if num_duels >= LeaderboardManager.MIN_DUELS_FOR_WINRATE:
+                pipeline.zadd(key, user_id, winrate)
+            else:
+                pipeline.zrem(key, user_id)
+
+    def get_top(board, num, reverse=False, score_cast_func=int, redis=None):
+        """ Returns a list of (member, score) tuples for the top `num` entries of the given board.
+        If reverse is True, the bottom `num` entries are returned instead. """
+        if redis is None:
+            redis = RedisManager.get()
+
+        key = LeaderboardManager.get_key(board)
+        if reverse:
+            return redis.zrange(key, 0, num - 1, withscores=True, score_cast_func=score_cast_func)
+        return redis.zrevrange(key, 0, num - 1, withscores=True, score_cast_func=score_cast_func)
+
+    def get_top_users(board, num, redis=None):
+        """ Same as get_top, but for the boards keyed by username.
+        Returns a list of (username_raw, score) tuples """
+        if redis is None:
+            redis = RedisManager.get()
+
+        top = LeaderboardManager.get_top(board, num, redis=redis)
+        if len(top) == 0:
+            return []
+
+        usernames = [username for username, score in top]
+        usernames_raw = redis.hmget('{streamer}:users:username_raw'.format(streamer=StreamHelper.get_streamer()), usernames)
+        return [(username_raw or username, score) for (username, score), username_raw in zip(top, usernames_raw)]
+
+    @time_method
+    def rebuild_watchtime():
+        from pajbot.models.user import User
+
+        log.info('Rebuilding watch time leaderboards')
+
+        key_online = LeaderboardManager.get_key('minutes_in_chat_online')
+        key_offline = LeaderboardManager.get_key('minutes_in_chat_offline')
+
+        with DBManager.create_session_scope() as db_session:
+            query = db_session.query(User.username, User.minutes_in_chat_online, User.minutes_in_chat_offline).\
+                    filter((User.minutes_in_chat_online > 0) | (User.minutes_in_chat_offline > 0))
+
+            with RedisManager.pipeline_context() as pipeline:
+                pipeline.delete(key_online, key_offline)
+                for username, minutes_online, minutes_offline in query:
+                    if minutes_online > 0:
+                        pipeline.zadd(key_online, username, minutes_online)
+                    if minutes_offline > 0:
+                        pipeline.zadd(key_offline, username, minutes_offline)
+                pipeline.sadd(LeaderboardManager.get_built_key(), *LeaderboardManager.WATCHTIME_BOARDS)
+
+    @time_method
+    def rebuild_duel_stats():
+        from pajbot.models.duel import UserDuelStats
+
+        log.info('Rebuilding duel leaderboards')
+
+        with DBManager.create_session_scope() as db_session:
+            with RedisManager.pipeline_context() as pipeline:
+                pipeline.delete(*[LeaderboardManager.get_key(board) for board in LeaderboardManager.DUEL_BOARDS])
+                for user_duel_stats in db_session.query(UserDuelStats):
+                    LeaderboardManager._queue_duel_stats(pipeline, user_duel_stats)
+                pipeline.sadd(LeaderboardManager.get_built_key(), *LeaderboardManager.DUEL_BOARDS)
@@ -0,0 +1,268 @@
+import bisect
+import http.server
+import logging
+import socketserver
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labelnames, labels):
+    if len(labelnames) == 0:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, escape_label_value(value)) for name, value in zip(labelnames, labels)) + '}'
+
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ A metric with a fixed set of label names.
+    Label values are passed positionally, in the same order as labelnames """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+        # label values -> value
+        self.values = {}
+
+    def get(self, *labels):
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def get_samples(self):
+        """ Returns a list of (name, labelnames, labels, value) tuples """
+        with self.lock:
+            return [(self.name, self.labelnames, labels, value) for labels, value in self.values.items()]
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        """ Each value is [count per bucket (the last one being +Inf), sum] """
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            values = self.values.get(labels, None)
+            if values is None:
+                values = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[i] += 1
+            values[-1] += value
+
+    def get(self, *labels):
+        """ Returns the (count, sum) of all observed values """
+        with self.lock:
+            values = self.values.get(labels, None)
+            if values is None:
+                return 0, 0.0
+            return sum(values[:-1]), values[-1]
+
+    def get_samples(self):
+        with self.lock:
+            values = [(labels, list(value)) for labels, value in self.values.items()]
+
+        labelnames = self.labelnames + ('le', )
+        samples = []
+        for labels, value in values:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float('inf'), ), value[:-1]):
+                cumulative += count
+                samples.append((self.name + '_bucket', labelnames, labels + (format_value(upper_bound), ), cumulative))
+            samples.append((self.name + '_count', self.labelnames, labels, cumulative))
+            samples.append((self.name + '_sum', self.labelnames, labels, value[-1]))
+
+        return samples
+
+    def time(self, *labels):
+        """ Returns a context manager that observes how long its body took to run """
+        return HistogramTimer(self, labels)
+
+
+class HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start_time, *self.labels)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        try:
+            payload = MetricsManager.render().encode('utf-8')
+        except:
+            log.exception('Unhandled exception while rendering metrics')
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MetricsManager:
+    """
+    Registry of the counters, gauges and histograms of the bot process.
+
+    Metrics are created once (usually at import time) with MetricsManager.counter,
+    MetricsManager.gauge and MetricsManager.histogram, and updated in place.
+    Updating a metric only takes a lock and a dictionary lookup, so they can be left on in production.
+
+    Values that already exist somewhere else (queue sizes, connection counts, other stats classes)
+    are read when the metrics are rendered, through collectors registered with MetricsManager.add_collector.
+    A collector returns a list of (name, type, documentation, samples) tuples,
+    where samples is a list of ({label: value}, value) tuples.
+
+    Everything is served in the Prometheus text format, see MetricsManager.start_http_server.
+    """
+
+    lock = threading.Lock()
+
+    # name -> Metric
+    metrics = {}
+
+    # name -> collector
+    collectors = {}
+
+    server = None
+
+    def _get_or_create(metric_class, name, *args, **kwargs):
+        with MetricsManager.lock:
+            metric = MetricsManager.metrics.get(name, None)
+            if metric is None:
+                metric = MetricsManager.metrics[name] = metric_class(name, *args, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError('Metric {} is already registered as a {}'.format(name, metric.TYPE))
+            return metric
+
+    def counter(name, documentation, labelnames=()):
+        return MetricsManager._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(name, documentation, labelnames=()):
+        return MetricsManager._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return MetricsManager._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(name, collector):
+        """ Registering a collector with the same name again replaces the old one """
+        with MetricsManager.lock:
+            MetricsManager.collectors[name] = collector
+
+    def remove_collector(name):
+        with MetricsManager.lock:
+            MetricsManager.collectors.pop(name, None)
+
+    def render():
+        """ Returns all metrics in the Prometheus text exposition format """
+        with MetricsManager.lock:
+            metrics = sorted(MetricsManager.metrics.values(), key=lambda metric: metric.name)
+            collectors = list(MetricsManager.collectors.items())
+
+        lines = []
+        for metric in metrics:
+            samples = metric.get_samples()
+            if len(samples) == 0:
+                continue
+
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.TYPE))
+            for name, labelnames, labels, value in samples:
+                lines.append('{0}{1} {2}'.format(name, format_labels(labelnames, labels), format_value(value)))
+
+        for collector_name, collector in collectors:
+            try:
+                collected = collector()
+            except:
+                log.exception('Unhandled exception in metrics collector {}'.format(collector_name))
+                continue
+
+            for name, metric_type, documentation, samples in collected:
+                lines.append('# HELP {0} {1}'.format(name, documentation))
+                lines.append('# TYPE {0} {1}'.format(name, metric_type))
+                for labels, value in samples:
+                    lines.append('{0}{1} {2}'.format(name, format_labels(tuple(labels.keys()), tuple(labels.values())), format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(port, host='127.0.0.1'):
+        """ Serve the metrics on http://host:port/metrics from a separate thread """
+        MetricsManager.server = MetricsServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=MetricsManager.server.serve_forever, name='MetricsServerThread')
+        thread.daemon = True
+        thread.start()
+        log.info('Serving metrics on http://{0}:{1}/metrics'.format(host, MetricsManager.server.server_address[1]))
+
+    def reset():
+        """ Reset the values of all metrics, the metrics themselves stay registered """
+        with MetricsManager.lock:
+            metrics = list(MetricsManager.metrics.values())
+
+        for metric in metrics:
+            metric.reset()
@@ -0,0 +1,268 @@
+import logging
+import time
+
+from sqlalchemy import case
+
+from pajbot.managers.db import DBManager
+from pajbot.managers.redis import RedisManager
+from pajbot.managers.schedule import ScheduleManager
+from pajbot.streamhelper import StreamHelper
+from pajbot.utils import time_method
+
+log = logging.getLogger(__name__)
+
+# KEYS[1] = points hash, KEYS[2] = dirty set, KEYS[3] = change log
+# ARGV[1] = username, ARGV[2] = delta, ARGV[3] = timestamp, ARGV[4] = max log length
+# ARGV[5] = (optional) value to seed the ledger with if the user is not in it yet
+# Returns the new amount of points, or nil if the user is not in the ledger
+SCRIPT_ADD_POINTS = """
+if ARGV[5] then
+    redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[5])
+elseif redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return nil
+end
+local new_value = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('RPUSH', KEYS[3], ARGV[3] .. ' ' .. ARGV[1] .. ' ' .. ARGV[2] .. ' ' .. new_value)
+redis.call('LTRIM', KEYS[3], -tonumber(ARGV[4]), -1)
+return new_value
+"""
+
+# Same keys and arguments as SCRIPT_ADD_POINTS, except ARGV[2] is the amount to spend
+# Returns {1, new_value} if the points were spent, {0, current_value} if the user
+# could not afford it, or nil if the user is not in the ledger
+SCRIPT_SPEND_POINTS = """
+local current_value = redis.call('HGET', KEYS[1], ARGV[1])
+if not current_value then
+    return nil
+end
+current_value = tonumber(current_value)
+if current_value < tonumber(ARGV[2]) then
+    return {0, current_value}
+end
+local new_value = redis.call('HINCRBY', KEYS[1], ARGV[1], -tonumber(ARGV[2]))
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('RPUSH', KEYS[3], ARGV[3] .. ' ' .. ARGV[1] .. ' -' .. ARGV[2] .. ' ' .. new_value)
+redis.call('LTRIM', KEYS[3], -tonumber(ARGV[4]), -1)
+return {1, new_value}
+"""
+
+RedisManager.register_script('points.add', SCRIPT_ADD_POINTS)
+RedisManager.register_script('points.spend', SCRIPT_SPEND_POINTS)
+
+
+class PointsManager:
+    """
+    Redis is the authoritative store for a users points.
+
+    Users are lazily added to the ledger (a redis hash) the first time
+    their points are read, with the value currently stored in SQL.
+    Every change is applied atomically with HINCRBY, the username is
+    flagged as dirty, and the change is appended to a capped change log
+    in the form "timestamp username delta new_value".
+
+    Dirty users are written back to tb_user.points in bulk every
+    `checkpoint_interval` seconds and when the bot shuts down.
+    Everything that reads tb_user.points directly (points_rank, the top
+    points list, the /points/ page) can be up to `checkpoint_interval`
+    seconds behind the ledger.
+    """
+
+    MAX_LOG_LENGTH = 100000
+    CHECKPOINT_CHUNK_SIZE = 500
+
+    def init(checkpoint_interval=60):
+        ScheduleManager.execute_every(checkpoint_interval, PointsManager.checkpoint)
+
+    def get_points_key():
+        return '{streamer}:users:points'.format(streamer=StreamHelper.get_streamer())
+
+    def get_dirty_key():
+        return '{streamer}:points:dirty'.format(streamer=StreamHelper.get_streamer())
+
+    def get_processing_key():
+        return '{streamer}:points:checkpointing'.format(streamer=StreamHelper.get_streamer())
+
+    def get_log_key():
+        return '{streamer}:points:log'.format(streamer=StreamHelper.get_streamer())
+
+    def _get_keys():
+        return [PointsManager.get_points_key(), PointsManager.get_dirty_key(), PointsManager.get_log_key()]
+
+    def get_points(username, redis=None):
+        """ Returns the users points, or None if the user is not in the ledger yet """
+        if redis is None:
+            redis = RedisManager.get()
+
+        value = redis.hget(PointsManager.get_points_key(), username)
+        if value is None:
+            return None
+        return int(value)
+
+    def seed_points(username, points, redis=None):
+        """ Add the user to the ledger with the given amount of points, unless he's already in it.
+        Returns the amount of points the user has in the ledger """
+        if redis is None:
+            redis = RedisManager.get()
+
+        key = PointsManager.get_points_key()
+        with redis.pipeline() as pipeline:
+            pipeline.hsetnx(key, username, points)
+            pipeline.hget(key, username)
+            _, value = pipeline.execute()
+
+        return int(value)
+
+    def add_points(username, delta, seed=None, redis=None):
+        """ Atomically add `delta` points to the user.
+        If `seed` is set, the user is added to the ledger with that value first if he's not already in it.
+        Returns the users new amount of points, or None if the user was not in the ledger.
+        If a pipeline is passed through, the result can be found in the pipelines execute() result instead """
+        if redis is None:
+            redis = RedisManager.get()
+
+        args = [username, delta, int(time.time()), PointsManager.MAX_LOG_LENGTH]
+        if seed is not None:
+            args.append(seed)
+
+        return RedisManager.run_script('points.add', keys=PointsManager._get_keys(), args=args, client=redis)
+
+    def bulk_add_points(deltas, redis=None):
+        """ Atomically add points to many users in one round-trip.
+        deltas is a dictionary of username -> amount of points to add.
+        Users that are not in the ledger yet are added with their SQL value, which is
+        loaded for all of them in a single query.
+        Returns a dictionary of username -> new amount of points """
+        from pajbot.models.user import User
+
+        if redis is None:
+            redis = RedisManager.get()
+
+        if len(deltas) == 0:
+            return {}
+
+        usernames = list(deltas.keys())
+        with redis.pipeline() as pipeline:
+            for username in usernames:
+                PointsManager.add_points(username, deltas[username], redis=pipeline)
+            new_values = dict(zip(usernames, pipeline.execute()))
+
+        missing = [username for username, value in new_values.items() if value is None]
+        if len(missing) > 0:
+            with DBManager.create_session_scope() as db_session:
+                seeds = dict(db_session.query(User.username, User.points).filter(User.username.in_(missing)))
+                for username in missing:
+                    if username not in seeds:
+                        db_session.add(User(username))
+
+            with redis.pipeline() as pipeline:
+                for username in missing:
+                    PointsManager.add_points(username, deltas[username], seed=seeds.get(username, 0), redis=pipeline)
+                new_values.update(zip(missing, pipeline.execute()))
+
+        return {username: int(value) for username, value in new_values.items()}
+
+    def spend_points(username, points_to_spend, redis=None):
+        """ Atomically remove `points_to_spend` points from the user if he can afford it.
+        Returns a tuple of (spent, new_value), or None if the user was not in the ledger """
+        if redis is None:
+            redis = RedisManager.get()
+
+        args = [username, points_to_spend, int(time.time()), PointsManager.MAX_LOG_LENGTH]
+        res = RedisManager.run_script('points.spend', keys=PointsManager._get_keys(), args=args, client=redis)
+        if res is None:
+            return None
+
+        return (res[0] == 1, int(res[1]))
+
+    def get_log(num=100, redis=None):
+        """ Returns the `num` most recent entries of the change log, oldest first """
+        if redis is None:
+            redis = RedisManager.get()
+
+        return redis.lrange(PointsManager.get_log_key(), -num, -1)
+
+    @time_method
+    def checkpoint():
+        """ Write the points of all users that have changed since the last checkpoint to SQL.
+        Returns how many users were written """
+        from pajbot.models.user import User
+
+        redis = RedisManager.get()
+        dirty_key = PointsManager.get_dirty_key()
+        processing_key = PointsManager.get_processing_key()
+
+        try:
+            # Move the dirty set out of the way so changes made during the checkpoint end up in a fresh set.
+            # A processing set left behind by a failed checkpoint is merged in.
+            with redis.pipeline() as pipeline:
+                pipeline.sunionstore(processing_key, processing_key, dirty_key)
+                pipeline.delete(dirty_key)
+                pipeline.smembers(processing_key)
+                _, _, usernames = pipeline.execute()
+
+            if len(usernames) == 0:
+                return 0
+
+            usernames = list(usernames)
+            values = redis.hmget(PointsManager.get_points_key(), usernames)
+            points = {username: int(value) for username, value in zip(usernames, values) if value is not None}
+            usernames = list(points.keys())
+            missing = []
+
+            with DBManager.create_session_scope() as db_session:
+                for i in range(0, len(usernames), PointsManager.CHECKPOINT_CHUNK_SIZE):
+                    chunk_usernames = usernames[i:i + PointsManager.CHECKPOINT_CHUNK_SIZE]
+                    existing = {username for (username, ) in db_session.query(User.username).filter(User.username.in_(chunk_usernames))}
+                    missing.extend(username for username in chunk_usernames if username not in existing)
+                    if len(existing) == 0:
+                        continue
+
+                    chunk = {username: points[username] for username in existing}
+                    db_session.query(User).filter(User.username.in_(chunk.keys())).\
+                            update({User.points: case(chunk, value=User.username)}, synchronize_session=False)
+
+            with redis.pipeline() as pipeline:
+                pipeline.delete(processing_key)
+                if len(missing) > 0:
+                    # Keep them dirty, so their points are written once they have a row
+                    pipeline.sadd(dirty_key, *missing)
+                pipeline.execute()
+
+            if len(missing) > 0:
+                log.warning('Unable to checkpoint the points of {} users without a row in tb_user: {}'.format(len(missing), ', '.join(missing[:10])))
+
+            num_written = len(usernames) - len(missing)
+            log.debug('Checkpointed points for {} users'.format(num_written))
+            return num_written
+        except:
+            log.exception('Unhandled exception while checkpointing points')
+            return 0
+
+    @time_method
+    def reconcile(fix=False):
+        """ Compare the ledger with the points stored in SQL.
+        Users with a pending checkpoint are skipped.
+        Returns a list of (username, ledger_points, sql_points) tuples for every mismatch.
+        If fix is True, the mismatching users are flagged as dirty so the next checkpoint overwrites SQL """
+        from pajbot.models.user import User
+
+        redis = RedisManager.get()
+        ledger = {username: int(value) for username, value in redis.hgetall(PointsManager.get_points_key()).items()}
+        pending = redis.sunion(PointsManager.get_dirty_key(), PointsManager.get_processing_key())
+
+        usernames = [username for username in ledger if username not in pending]
+        mismatches = []
+
+        with DBManager.create_session_scope() as db_session:
+            for i in range(0, len(usernames), PointsManager.CHECKPOINT_CHUNK_SIZE):
+                chunk = usernames[i:i + PointsManager.CHECKPOINT_CHUNK_SIZE]
+                sql_points = dict(db_session.query(User.username, User.points).filter(User.username.in_(chunk)))
+                for username in chunk:
+                    if sql_points.get(username, None) != ledger[username]:
+                        mismatches.append((username, ledger[username], sql_points.get(username, None)))
+
+        if fix and len(mismatches) > 0:
+            redis.sadd(PointsManager.get_dirty_key(), *[username for username, _, _ in mismatches])
+
+        return mismatches
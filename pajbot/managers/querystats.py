@@ -0,0 +1,178 @@
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from pajbot.managers.metrics import MetricsManager
+
+log = logging.getLogger(__name__)
+
+SQL_STATEMENT_DURATION = MetricsManager.histogram('pajbot_sql_statement_seconds', 'Time spent running SQL statements')
+
+
+class QueryContext:
+    """ Statements and time spent in SQL during a single request context """
+
+    def __init__(self, name):
+        self.name = name
+        self.num_statements = 0
+        self.total_time = 0.0
+
+
+class QueryStats:
+    """
+    Counts SQL statements and the time spent running them, using SQLAlchemy's
+    cursor execute events.
+
+    Statements are attributed to every request context (chat message, command,
+    web request, scheduled job) that is currently active on the thread.
+    When a context ends, the number of statements and the time spent are added
+    to that contexts histograms.
+
+    Statements are also grouped by their "shape" (the statement with all literal
+    lists and whitespace collapsed), so we can find which queries cost the most in total.
+    """
+
+    # Upper bounds of the histogram buckets, the last bucket catches everything above
+    STATEMENT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+    TIME_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0]
+
+    MAX_SHAPES = 1000
+
+    slow_query_threshold = 0.5
+
+    lock = threading.Lock()
+    local = threading.local()
+
+    # shape -> {'count', 'total_time', 'max_time'}
+    shapes = {}
+
+    # context name -> {'count', 'num_statements', 'total_time', 'statements_histogram', 'time_histogram'}
+    contexts = {}
+
+    re_in_list = re.compile(r'\(\s*(?:%s|\?|:\w+)(?:\s*,\s*(?:%s|\?|:\w+))*\s*\)')
+    re_whitespace = re.compile(r'\s+')
+
+    def register(engine, slow_query_threshold=None):
+        if slow_query_threshold is not None:
+            QueryStats.slow_query_threshold = slow_query_threshold
+
+        event.listen(engine, 'before_cursor_execute', QueryStats.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', QueryStats.after_cursor_execute)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.time() - conn.info['query_start_time'].pop()
+        SQL_STATEMENT_DURATION.observe(duration)
+
+        for query_context in QueryStats._get_stack():
+            query_context.num_statements += 1
+            query_context.total_time += duration
+
+        shape = QueryStats.get_shape(statement)
+        with QueryStats.lock:
+            if shape in QueryStats.shapes:
+                stats = QueryStats.shapes[shape]
+            elif len(QueryStats.shapes) < QueryStats.MAX_SHAPES:
+                stats = QueryStats.shapes[shape] = {'count': 0, 'total_time': 0.0, 'max_time': 0.0}
+            else:
+                stats = None
+
+            if stats is not None:
+                stats['count'] += 1
+                stats['total_time'] += duration
+                stats['max_time'] = max(stats['max_time'], duration)
+
+        if duration >= QueryStats.slow_query_threshold:
+            log.warning('Slow query ({0:.3f}s): {1}'.format(duration, shape))
+
+    def get_shape(statement):
+        shape = QueryStats.re_whitespace.sub(' ', statement).strip()
+        return QueryStats.re_in_list.sub('(...)', shape)
+
+    def _get_stack():
+        stack = getattr(QueryStats.local, 'stack', None)
+        if stack is None:
+            stack = QueryStats.local.stack = []
+        return stack
+
+    def begin(name):
+        QueryStats._get_stack().append(QueryContext(name))
+
+    def end():
+        stack = QueryStats._get_stack()
+        if len(stack) == 0:
+            return
+
+        query_context = stack.pop()
+        with QueryStats.lock:
+            stats = QueryStats.contexts.get(query_context.name, None)
+            if stats is None:
+                stats = QueryStats.contexts[query_context.name] = {
+                        'count': 0,
+                        'num_statements': 0,
+                        'total_time': 0.0,
+                        'statements_histogram': [0] * (len(QueryStats.STATEMENT_BUCKETS) + 1),
+                        'time_histogram': [0] * (len(QueryStats.TIME_BUCKETS) + 1),
+                        }
+
+            stats['count'] += 1
+            stats['num_statements'] += query_context.num_statements
+            stats['total_time'] += query_context.total_time
+            stats['statements_histogram'][QueryStats._get_bucket(QueryStats.STATEMENT_BUCKETS, query_context.num_statements)] += 1
+            stats['time_histogram'][QueryStats._get_bucket(QueryStats.TIME_BUCKETS, query_context.total_time)] += 1
+
+    def _get_bucket(buckets, value):
+        for i, upper_bound in enumerate(buckets):
+            if value <= upper_bound:
+                return i
+        return len(buckets)
+
+    @contextmanager
+    def context(name):
+        QueryStats.begin(name)
+        try:
+            yield
+        finally:
+            QueryStats.end()
+
+    def wrap(name, f):
+        """ Returns a function that runs f inside of a query context """
+        def wrapped(*args, **kwargs):
+            with QueryStats.context(name):
+                return f(*args, **kwargs)
+        return wrapped
+
+    def get_top_shapes(num=10):
+        """ Returns a list of (shape, stats) tuples of the query shapes with the highest total time """
+        with QueryStats.lock:
+            shapes = [(shape, dict(stats)) for shape, stats in QueryStats.shapes.items()]
+
+        shapes.sort(key=lambda shape: shape[1]['total_time'], reverse=True)
+        return shapes[:num]
+
+    def get_report(num=10):
+        with QueryStats.lock:
+            contexts = {}
+            for name, stats in QueryStats.contexts.items():
+                contexts[name] = dict(stats)
+                contexts[name]['statements_histogram'] = dict(zip(QueryStats._get_bucket_labels(QueryStats.STATEMENT_BUCKETS), stats['statements_histogram']))
+                contexts[name]['time_histogram'] = dict(zip(QueryStats._get_bucket_labels(QueryStats.TIME_BUCKETS), stats['time_histogram']))
+
+        return {
+                'shapes': [dict(shape=shape, **stats) for shape, stats in QueryStats.get_top_shapes(num)],
+                'contexts': contexts,
+                }
+
+    def _get_bucket_labels(buckets):
+        return ['<={}'.format(upper_bound) for upper_bound in buckets] + ['>{}'.format(buckets[-1])]
+
+    def reset():
+        with QueryStats.lock:
+            QueryStats.shapes = {}
+            QueryStats.contexts = {}
@@ -1,30 +1,181 @@
 import logging
+import os
+import sys
+import threading
+import time
 from contextlib import contextmanager
 
 import redis
 
+from pajbot.managers.metrics import MetricsManager
+
 log = logging.getLogger(__name__)
 
+REDIS_COMMANDS = MetricsManager.counter('pajbot_redis_commands_total', 'Number of commands sent to redis')
+REDIS_ROUND_TRIP_DURATION = MetricsManager.histogram('pajbot_redis_round_trip_seconds', 'Time spent waiting for redis, per round-trip (a single command or a pipeline)')
+
+REDIS_PATH = os.path.dirname(redis.__file__)
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# (code object, line number) -> call site string, so the path is only made relative once per call site
+call_site_names = {}
+
+
+def get_call_site():
+    """ Returns the file, line and function outside of redis-py and this module that sent the command """
+    frame = sys._getframe(2)
+    while frame is not None and (frame.f_code.co_filename == __file__ or frame.f_code.co_filename.startswith(REDIS_PATH)):
+        frame = frame.f_back
+
+    if frame is None:
+        return 'unknown'
+
+    key = (frame.f_code, frame.f_lineno)
+    call_site = call_site_names.get(key, None)
+    if call_site is None:
+        call_site = call_site_names[key] = '{0}:{1} {2}'.format(os.path.relpath(frame.f_code.co_filename, BASE_PATH), frame.f_lineno, frame.f_code.co_name)
+
+    return call_site
+
+
+class RedisStats:
+    """ Number of commands, round-trips and time spent in redis, per call site """
+
+    lock = threading.Lock()
+
+    # call site -> {'commands', 'round_trips', 'total_time'}
+    call_sites = {}
+
+    def add(call_site, num_commands, duration):
+        REDIS_COMMANDS.inc(amount=num_commands)
+        REDIS_ROUND_TRIP_DURATION.observe(duration)
+
+        with RedisStats.lock:
+            stats = RedisStats.call_sites.get(call_site, None)
+            if stats is None:
+                stats = RedisStats.call_sites[call_site] = {'commands': 0, 'round_trips': 0, 'total_time': 0.0}
+
+            stats['commands'] += num_commands
+            stats['round_trips'] += 1
+            stats['total_time'] += duration
+
+    def get_report(num=10):
+        """ Returns the `num` call sites with the highest total time """
+        with RedisStats.lock:
+            call_sites = [dict(call_site=call_site, **stats) for call_site, stats in RedisStats.call_sites.items()]
+
+        call_sites.sort(key=lambda stats: stats['total_time'], reverse=True)
+        return call_sites[:num]
+
+    def reset():
+        with RedisStats.lock:
+            RedisStats.call_sites = {}
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        num_commands = len(self.command_stack)
+        if num_commands == 0:
+            return super().execute(raise_on_error=raise_on_error)
+
+        start_time = time.time()
+        try:
+            return super().execute(raise_on_error=raise_on_error)
+        finally:
+            RedisStats.add(get_call_site(), num_commands, time.time() - start_time)
+
+
+class InstrumentedRedis(redis.Redis):
+    """ Records how many commands are sent from each call site, and how long they took """
+
+    def execute_command(self, *args, **options):
+        start_time = time.time()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            RedisStats.add(get_call_site(), 1, time.time() - start_time)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint)
+
 
 class RedisManager:
     """
     Responsible for making sure exactly one instance of Redis
     is initialized with the right arguments, and returns when the
     get-method is called.
+
+    Lua scripts are registered by name with RedisManager.register_script,
+    and run with RedisManager.run_script. All scripts registered before
+    init are loaded into redis right away, so the first run is a single EVALSHA.
     """
 
     redis = None
 
+    # name -> Lua source
+    script_sources = {}
+
+    # name -> redis.client.Script
+    scripts = {}
+
+    INT_OPTIONS = ('port', 'db', 'max_connections')
+    FLOAT_OPTIONS = ('socket_timeout', 'socket_connect_timeout')
+
     def init(**options):
+        """ Options are passed through to redis.Redis, i.e. host, port, unix_socket_path and max_connections.
+        Set instrument to '1' to count the commands per call site (costs a few microseconds per command) """
         default_options = {
                 'decode_responses': True,
                 }
         default_options.update(options)
-        RedisManager.redis = redis.Redis(**default_options)
+
+        for key in RedisManager.INT_OPTIONS:
+            if key in default_options:
+                default_options[key] = int(default_options[key])
+        for key in RedisManager.FLOAT_OPTIONS:
+            if key in default_options:
+                default_options[key] = float(default_options[key])
+
+        instrument = str(default_options.pop('instrument', '0')) == '1'
+        redis_class = InstrumentedRedis if instrument else redis.Redis
+
+        RedisManager.redis = redis_class(**default_options)
+
+        try:
+            RedisManager.load_scripts()
+        except redis.RedisError:
+            log.exception('Unable to preload redis scripts')
 
     def get():
         return RedisManager.redis
 
+    def register_script(name, source):
+        RedisManager.script_sources[name] = source
+        RedisManager.scripts.pop(name, None)
+
+    def load_scripts():
+        """ Load all registered scripts into the redis script cache """
+        redis = RedisManager.get()
+        for source in RedisManager.script_sources.values():
+            redis.script_load(source)
+
+    def run_script(name, keys=[], args=[], client=None):
+        """ Run the script registered as `name`.
+        If a pipeline is passed through as client, the result can be found in the pipelines execute() result """
+        if client is None:
+            client = RedisManager.get()
+
+        script = RedisManager.scripts.get(name, None)
+        if script is None:
+            script = RedisManager.scripts[name] = RedisManager.get().register_script(RedisManager.script_sources[name])
+
+        return script(keys=keys, args=args, client=client)
+
     @contextmanager
     def pipeline_context():
         try:
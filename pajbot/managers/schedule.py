@@ -3,6 +3,9 @@ import logging
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from pajbot.managers.channel import ChannelManager
+from pajbot.managers.querystats import QueryStats
+
 log = logging.getLogger(__name__)
 
 
@@ -31,6 +34,10 @@ class ScheduleManager:
             ScheduleManager.base_scheduler = BackgroundScheduler()
             ScheduleManager.base_scheduler.start()
 
+    def wrap(method):
+        """ Jobs run inside of a query context, for the channel they were scheduled from """
+        return ChannelManager.wrap(QueryStats.wrap('job', method))
+
     def execute_now(method, args=[], kwargs={}, scheduler=None):
         if scheduler is None:
             scheduler = ScheduleManager.base_scheduler
@@ -38,7 +45,7 @@ class ScheduleManager:
         if scheduler is None:
             return ScheduledJob(None)
 
-        job = scheduler.add_job(method,
+        job = scheduler.add_job(ScheduleManager.wrap(method),
                 'date',
                 run_date=datetime.datetime.now(),
                 args=args,
@@ -52,7 +59,7 @@ class ScheduleManager:
         if scheduler is None:
             return ScheduledJob(None)
 
-        job = scheduler.add_job(method,
+        job = scheduler.add_job(ScheduleManager.wrap(method),
                 'date',
                 run_date=datetime.datetime.now() + datetime.timedelta(seconds=delay),
                 args=args,
@@ -66,7 +73,7 @@ class ScheduleManager:
         if scheduler is None:
             return ScheduledJob(None)
 
-        job = scheduler.add_job(method,
+        job = scheduler.add_job(ScheduleManager.wrap(method),
                 'interval',
                 seconds=interval,
                 args=args,
@@ -122,7 +122,8 @@ class TwitterManager:
             self.initialize_listener()
             self.initialize_twitter_stream()
 
-            self.twitter_stream.userstream(_with='followings', replies='all', async=True)
+            # async is a keyword since python 3.7
+            self.twitter_stream.userstream(_with='followings', replies='all', **{'async': True})
         except:
             log.exception('Exception caught while trying to connect to the twitter stream')
 
@@ -1,24 +1,37 @@
 import logging
 from contextlib import contextmanager
 
+from sqlalchemy import func
+
+from pajbot.managers.channel import ChannelManager
 from pajbot.managers.db import DBManager
+from pajbot.managers.handler import HandlerManager
+from pajbot.managers.points import PointsManager
+from pajbot.managers.redis import RedisManager
 from pajbot.models.user import User
 from pajbot.models.user import UserCombined
+from pajbot.models.user import UserRedis
 from pajbot.models.user import UserSQLCache
+from pajbot.streamhelper import StreamHelper
 from pajbot.utils import time_method
 
 log = logging.getLogger(__name__)
 
 
 class UserManager:
-    data = {}
     _instance = None
 
+    SYNC_CHUNK_SIZE = 500
+
     def __init__(self):
         UserSQLCache.init()
         UserManager._instance = self
+        self.data = {}
 
     def get():
+        channel = ChannelManager.current()
+        if channel is not None and channel.bot is not None:
+            return channel.bot.users
         return UserManager._instance
 
     def save(self, user):
@@ -35,6 +48,24 @@ class UserManager:
         user.load(**self.data.get(username, {}))
         return user
 
+    def bulk_get_users(self, usernames):
+        """ Returns a list of user objects for the given usernames, in the same order.
+        The redis data of all users is loaded in a single pipeline. """
+        users = [self.get_user(username) for username in usernames]
+        if len(users) == 0:
+            return users
+
+        with RedisManager.get().pipeline() as pipeline:
+            for user in users:
+                user.queue_up_redis_calls(pipeline)
+            data = pipeline.execute()
+
+        num_keys = len(UserRedis.FULL_KEYS)
+        for i, user in enumerate(users):
+            user.load_redis_data(data[i * num_keys:(i + 1) * num_keys])
+
+        return users
+
     @contextmanager
     def get_user_context(self, username):
         try:
@@ -126,35 +157,149 @@ class UserManager:
         return user
 
     @time_method
-    def reset_subs(self):
-        """ Returns how many subs were reset """
-        with DBManager.create_session_scope() as db_session:
-            return db_session.query(User).filter_by(subscriber=True).\
-                    update({User.subscriber: False}, synchronize_session=False)
+    def bulk_add_points(self, user_points):
+        """
+        Give points to (or take points from, if the amount is negative) many users at once.
+
+        Arguments:
+        user_points - A list of (user, points) tuples, where user is either
+                      a UserCombined object or a username.
+
+        All changes are applied to the points ledger in a single round-trip.
+        The cached points of the passed user objects are updated, and the
+        on_bulk_add_points event is triggered once for the whole batch.
+
+        Returns a dictionary of username -> new amount of points
+        """
+
+        if len(user_points) == 0:
+            return {}
+
+        deltas = {}
+        user_objects = []
+        for user, points in user_points:
+            if isinstance(user, str):
+                username = user.lower()
+            else:
+                username = user.username
+                user_objects.append(user)
+            deltas[username] = deltas.get(username, 0) + points
+
+        new_values = PointsManager.bulk_add_points(deltas)
+
+        for user in user_objects:
+            user._points = new_values[user.username]
+
+        HandlerManager.trigger('on_bulk_add_points', user_points, stop_on_false=False)
+
+        return new_values
 
     @time_method
-    def update_subs(self, subs):
+    def sync_subs(self, subs):
         """
-        subs is a list of usernames
+        Make the subscriber flags in the database match the given list of usernames.
+
+        Only users whose subscriber status changed are written, in chunks of
+        SYNC_CHUNK_SIZE users, so the existing subscribers are never
+        flagged as non-subscribers in between.
+
+        Returns a tuple of (added, removed) sets of usernames
         """
 
+        subs = set(username.lower() for username in subs)
+
         with DBManager.create_session_scope() as db_session:
-            subs = set(subs)
-            for user in db_session.query(User).filter(User.username.in_(subs)):
-                try:
-                    subs.remove(user.username)
-                except:
-                    pass
+            current_subs = set(username for username, in db_session.query(User.username).filter_by(subscriber=True))
+            added = subs - current_subs
+            removed = current_subs - subs
+
+            for chunk in UserManager._chunks(removed):
+                db_session.query(User).filter(User.username.in_(chunk)).\
+                        update({User.subscriber: False}, synchronize_session=False)
 
-                user.subscriber = True
+            for chunk in UserManager._chunks(added):
+                existing = set(username for username, in db_session.query(User.username).filter(User.username.in_(chunk)))
+                if len(existing) > 0:
+                    db_session.query(User).filter(User.username.in_(existing)).\
+                            update({User.subscriber: True}, synchronize_session=False)
 
-            for username in subs:
-                # New user!
-                user = User(username=username)
-                user.subscriber = True
+                for username in chunk:
+                    if username not in existing:
+                        # New user!
+                        user = User(username=username)
+                        user.subscriber = True
+                        db_session.add(user)
 
-                db_session.add(user)
+        UserSQLCache.invalidate(added | removed)
+
+        return added, removed
+
+    def _chunks(usernames):
+        usernames = list(usernames)
+        for i in range(0, len(usernames), UserManager.SYNC_CHUNK_SIZE):
+            yield usernames[i:i + UserManager.SYNC_CHUNK_SIZE]
 
     def bulk_load_user_models(self, usernames, db_session):
         users = db_session.query(User).filter(User.username.in_(usernames))
         return {user.username: user for user in users}
+
+    def bulk_find_static(usernames, db_session):
+        """ Same as find_static, but for many users at once.
+        Returns a list of user objects for the users that exist, in the same order as usernames.
+        The SQL data of all users is loaded with one query, and their redis data with one pipeline. """
+        usernames = [username.replace('@', '').lower() for username in usernames]
+        usernames = [username for username in usernames if len(username) > 0]
+        if len(usernames) == 0:
+            return []
+
+        user_models = {user_model.username: user_model for user_model in db_session.query(User).filter(User.username.in_(usernames))}
+
+        users = []
+        for username in usernames:
+            if username in user_models:
+                users.append(UserManager.get_static(username, db_session=db_session, user_model=user_models.pop(username)))
+
+        if len(users) == 0:
+            return users
+
+        with RedisManager.get().pipeline() as pipeline:
+            for user in users:
+                user.queue_up_redis_calls(pipeline)
+            data = pipeline.execute()
+
+        num_keys = len(UserRedis.FULL_KEYS)
+        for i, user in enumerate(users):
+            user.load_redis_data(data[i * num_keys:(i + 1) * num_keys])
+
+        return users
+
+    def bulk_jsonify(users, db_session):
+        """ Returns a list of user.jsonify() for the given users.
+        Points and num_lines ranks for all users are fetched with one redis pipeline,
+        and the points ranks with one SQL query. """
+        if len(users) == 0:
+            return []
+
+        streamer = StreamHelper.get_streamer()
+        num_lines_key = '{streamer}:users:num_lines'.format(streamer=streamer)
+
+        with RedisManager.get().pipeline() as pipeline:
+            pipeline.zcard(num_lines_key)
+            for user in users:
+                pipeline.zrevrank(num_lines_key, user.username)
+                pipeline.hget(PointsManager.get_points_key(), user.username)
+            data = pipeline.execute()
+
+        num_ranked = data[0]
+        nl_ranks = []
+        for i, user in enumerate(users):
+            nl_rank, points = data[1 + i * 2:3 + i * 2]
+            nl_ranks.append(num_ranked if nl_rank is None else nl_rank + 1)
+            # Users that are not in the points ledger yet have their SQL value
+            user._points = user.user_model.points if points is None else int(points)
+
+        distinct_points = list({user._points for user in users})
+        counts = db_session.query(*[db_session.query(func.count(User.id)).filter(User.points > points).as_scalar() for points in distinct_points]).one()
+        points_ranks = {points: int(count) + 1 for points, count in zip(distinct_points, counts)}
+
+        return [user.jsonify(nl_rank=nl_rank, points_rank=points_ranks[user._points]) for user, nl_rank in zip(users, nl_ranks)]
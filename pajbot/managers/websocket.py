@@ -1,10 +1,49 @@
+import collections
 import json
 import logging
 import threading
 
+
 log = logging.getLogger('pajbot')
 
 
+class BackloggedProducer:
+    """
+    Mixin for the websocket protocol. Twisted pauses the client when its write buffer is full,
+    the payloads sent in the meantime are kept in a backlog of at most MAX_CLIENT_BACKLOG payloads
+    (the oldest payload is dropped when it's full), and sent once the client is resumed.
+    """
+
+    def init_backlog(self, manager):
+        self.manager = manager
+        self.paused = False
+        self.backlog = collections.deque(maxlen=WebSocketManager.MAX_CLIENT_BACKLOG)
+
+    def send_payloads(self, payloads):
+        """ Send the given payloads, or queue them up if the client can't keep up """
+        if self.paused:
+            num_dropped = max(0, len(self.backlog) + len(payloads) - self.backlog.maxlen)
+            self.backlog.extend(payloads)
+            self.manager.metrics['dropped'] += num_dropped
+            return
+
+        for payload in payloads:
+            self.sendMessage(payload, False)
+
+    # Called by twisted when the clients write buffer is full
+    def pauseProducing(self):
+        self.paused = True
+
+    # Called by twisted when the clients write buffer has been drained
+    def resumeProducing(self):
+        self.paused = False
+        while len(self.backlog) > 0 and not self.paused:
+            self.sendMessage(self.backlog.popleft(), False)
+
+    def stopProducing(self):
+        self.backlog.clear()
+
+
 class WebSocketServer:
     clients = []
 
@@ -15,7 +54,7 @@ class WebSocketServer:
         from autobahn.twisted.websocket import WebSocketServerFactory, \
                 WebSocketServerProtocol
 
-        class MyServerProtocol(WebSocketServerProtocol):
+        class MyServerProtocol(BackloggedProducer, WebSocketServerProtocol):
             def onConnect(self, request):
                 # log.info(self.factory)
                 # log.info('Client connecting: {0}'.format(request.peer))
@@ -23,13 +62,29 @@ class WebSocketServer:
 
             def onOpen(self):
                 log.info('WebSocket connection open')
+                # None means the client receives every event
+                self.topics = None
+                # Batching clients receive a list of events per message
+                self.batch = False
+                self.init_backlog(manager)
+                self.registerProducer(self, True)
                 WebSocketServer.clients.append(self)
 
             def onMessage(self, payload, isBinary):
                 if isBinary:
                     log.info('Binary message received: {0} bytes'.format(len(payload)))
-                else:
+                    return
+
+                try:
+                    message = json.loads(payload.decode('utf8'))
+                except ValueError:
                     log.info('Text message received: {0}'.format(payload.decode('utf8')))
+                    return
+
+                if isinstance(message, dict) and message.get('type', None) == 'subscribe':
+                    topics = message.get('topics', None)
+                    self.topics = set(topics) if topics is not None else None
+                    self.batch = message.get('batch', False) is True
 
             def onClose(self, wasClean, code, reason):
                 log.info('WebSocket connection closed: {0}'.format(reason))
@@ -38,6 +93,8 @@ class WebSocketServer:
                 except:
                     pass
 
+        self.reactor = reactor
+
         factory = WebSocketServerFactory()
         factory.protocol = MyServerProtocol
 
@@ -66,10 +123,38 @@ class WebSocketServer:
 
 
 class WebSocketManager:
+    """
+    Broadcasts events to the connected websocket clients (i.e. the CLR overlay).
+
+    emit() can be called from any thread. Events are put in a bounded queue
+    (the oldest event is dropped when it's full), and the twisted reactor
+    sends everything that was queued up at most FLUSH_RATE times per second.
+    Each event is only serialized once, no matter how many clients receive it.
+
+    A client can send {"type": "subscribe", "topics": ["new_emote", ...], "batch": true}
+    to only receive the given events, with all events of a flush in a single message.
+    Clients that never subscribe receive every event in a separate message.
+    """
+
+    FLUSH_RATE = 20
+    MAX_QUEUE_SIZE = 1000
+    MAX_CLIENT_BACKLOG = 250
+
     def __init__(self, bot):
         self.clients = []
         self.server = None
         self.bot = bot
+
+        self.queue = collections.deque()
+        self.queue_lock = threading.Lock()
+        self.flush_scheduled = False
+        self.metrics = {
+                'emitted': 0,
+                'dropped': 0,
+                'batches': 0,
+                'batched_events': 0,
+                }
+
         try:
             if 'websocket' in bot.config and bot.config['websocket']['enabled'] == '1':
                 # Initialize twisted logging
@@ -98,13 +183,77 @@ class WebSocketManager:
             log.exception('Uncaught exception in WebSocketManager')
 
     def emit(self, event, data={}):
-        if self.server:
-            payload = json.dumps({
-                'event': event,
-                'data': data,
-                }).encode('utf8')
-            for client in self.server.clients:
-                client.sendMessage(payload, False)
+        if not self.server:
+            return
+
+        with self.queue_lock:
+            if len(self.queue) >= self.MAX_QUEUE_SIZE:
+                self.queue.popleft()
+                self.metrics['dropped'] += 1
+            self.queue.append((event, data))
+            self.metrics['emitted'] += 1
+
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+
+        reactor = self.server.reactor
+        reactor.callFromThread(reactor.callLater, 1.0 / self.FLUSH_RATE, self.flush)
+
+    def flush(self):
+        """ Send all queued up events to the clients. Runs in the reactor thread """
+        with self.queue_lock:
+            events = self.queue
+            self.queue = collections.deque()
+            self.flush_scheduled = False
+
+        if len(events) == 0:
+            return
+
+        self.metrics['batches'] += 1
+        self.metrics['batched_events'] += len(events)
+
+        serialized = [(event, json.dumps({'event': event, 'data': data})) for event, data in events]
+
+        for client in list(self.server.clients):
+            if client.topics is None:
+                client_events = serialized
+            else:
+                client_events = [(event, payload) for event, payload in serialized if event in client.topics]
+
+            if len(client_events) == 0:
+                continue
+
+            try:
+                if client.batch:
+                    payloads = ['[{}]'.format(','.join(payload for event, payload in client_events)).encode('utf8')]
+                else:
+                    payloads = [payload.encode('utf8') for event, payload in client_events]
+
+                client.send_payloads(payloads)
+            except:
+                log.exception('Unhandled exception while sending websocket events')
+
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        with self.queue_lock:
+            metrics['queued'] = len(self.queue)
+        metrics['clients'] = len(self.server.clients) if self.server else 0
+        return metrics
+
+    def collect_metrics(self):
+        """ Metrics collector for MetricsManager """
+        metrics = self.get_metrics()
+        return [
+                ('pajbot_websocket_clients', 'gauge', 'Number of connected websocket clients', [({}, metrics['clients'])]),
+                ('pajbot_websocket_queued_events', 'gauge', 'Number of events waiting to be sent to websocket clients', [({}, metrics['queued'])]),
+                ('pajbot_websocket_events_total', 'counter', 'Number of websocket events', [
+                    ({'result': 'emitted'}, metrics['emitted']),
+                    ({'result': 'dropped'}, metrics['dropped']),
+                    ]),
+                ('pajbot_websocket_batches_total', 'counter', 'Number of flushes that sent events to the websocket clients', [({}, metrics['batches'])]),
+                ('pajbot_websocket_batched_events_total', 'counter', 'Number of events sent in those flushes', [({}, metrics['batched_events'])]),
+                ]
 
     def on_log_message(message, isError=False, printed=False):
         if isError:
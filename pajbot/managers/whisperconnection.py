@@ -44,8 +44,10 @@ class WhisperConnection:
 
 
 class WhisperConnectionManager:
-    def __init__(self, reactor, bot, target, message_limit, time_interval, num_of_conns=30):
+    def __init__(self, reactor, bot, target, message_limit, time_interval, num_of_conns=30, chat_server=None):
+        """ chat_server can be set to a host:port to always connect to, instead of asking Twitch for a server """
         self.db_session = DBManager.create_session()
+        self.chat_server = chat_server
         self.reactor = reactor
         self.bot = bot
         self.message_limit = message_limit
@@ -105,6 +107,10 @@ class WhisperConnectionManager:
             connection.conn.quit('bye')
 
     def update_servers_list(self):
+        if self.chat_server is not None:
+            self.servers_list = [self.chat_server]
+            return
+
         log.debug('Refreshing list of whisper servers')
         servers_list = json.loads(requests.get('http://tmi.twitch.tv/servers?cluster=group').text)
         self.servers_list = servers_list['servers']
@@ -136,7 +142,8 @@ class WhisperConnectionManager:
             return
 
         self.maintenance_lock = True
-        for connection in self.connlist:
+        # Iterate over a copy, since disconnected connections are replaced in the list
+        for connection in list(self.connlist):
             if not connection.conn.is_connected():
                 connection.conn.close()
                 self.connlist.remove(connection)
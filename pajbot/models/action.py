@@ -6,6 +6,7 @@ import irc
 import regex as re
 import requests
 
+from pajbot.managers.channel import ChannelManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.modules.ascii import AsciiProtectionModule
 
@@ -15,6 +16,12 @@ log = logging.getLogger(__name__)
 class ActionParser:
     bot = None
 
+    def get_bot():
+        channel = ChannelManager.current()
+        if channel is not None:
+            return channel.bot
+        return ActionParser.bot
+
     def parse(raw_data=None, data=None, command=''):
         try:
             from pajbot.userdispatch import UserDispatch
@@ -29,13 +36,13 @@ class ActionParser:
             data = json.loads(raw_data)
 
         if data['type'] == 'say':
-            action = SayAction(data['message'], ActionParser.bot)
+            action = SayAction(data['message'], ActionParser.get_bot())
         elif data['type'] == 'me':
-            action = MeAction(data['message'], ActionParser.bot)
+            action = MeAction(data['message'], ActionParser.get_bot())
         elif data['type'] == 'whisper':
-            action = WhisperAction(data['message'], ActionParser.bot)
+            action = WhisperAction(data['message'], ActionParser.get_bot())
         elif data['type'] == 'reply':
-            action = ReplyAction(data['message'], ActionParser.bot)
+            action = ReplyAction(data['message'], ActionParser.get_bot())
         elif data['type'] == 'func':
             try:
                 action = FuncAction(getattr(Dispatch, data['cb']))
@@ -75,34 +75,38 @@ class Banphrase(Base):
 
     def refresh_operator(self):
         self.predicate = getattr(self, 'predicate_{}'.format(self.operator), None)
+        self.phrase_lower = self.phrase.lower() if self.phrase is not None else None
 
-    def predicate_contains(self, message):
+    def predicate_contains(self, message, message_lower):
         if self.case_sensitive:
             return self.phrase in message
         else:
-            return self.phrase.lower() in message.lower()
+            return self.phrase_lower in message_lower
 
-    def predicate_startswith(self, message):
+    def predicate_startswith(self, message, message_lower):
         if self.case_sensitive:
             return message.startswith(self.phrase)
         else:
-            return message.lower().startswith(self.phrase.lower())
+            return message_lower.startswith(self.phrase_lower)
 
-    def predicate_endswith(self, message):
+    def predicate_endswith(self, message, message_lower):
         if self.case_sensitive:
             return message.endswith(self.phrase)
         else:
-            return message.lower().endswith(self.phrase.lower())
+            return message_lower.endswith(self.phrase_lower)
 
-    def match(self, message, user):
+    def match(self, message, user, message_lower=None):
         """
         Returns True if message matches our banphrase.
         Otherwise it returns False
         Respects case-sensitiveness option
+        message_lower can be passed if the caller already has the lowercased message
         """
         if self.sub_immunity is True and user.subscriber is True:
             return False
-        return self.predicate(message)
+        if message_lower is None:
+            message_lower = message.lower()
+        return self.predicate(message, message_lower)
 
     def exact_match(self, message):
         """
@@ -294,8 +298,10 @@ class BanphraseManager:
             notification_msg = 'You have been {punishment} because your message matched the "{banphrase.name}" banphrase.'.format(punishment=punishment, banphrase=banphrase)
             self.bot.whisper(user.username, notification_msg)
 
-    def check_message(self, message, user):
-        match = find(lambda banphrase: banphrase.match(message, user), self.enabled_banphrases)
+    def check_message(self, message, user, message_lower=None):
+        if message_lower is None:
+            message_lower = message.lower()
+        match = find(lambda banphrase: banphrase.match(message, user, message_lower), self.enabled_banphrases)
         return match or False
 
     def find_match(self, message, id=None):
@@ -16,6 +16,7 @@ from sqlalchemy.orm import relationship
 
 from pajbot.exc import FailedCommand
 from pajbot.managers.db import Base
+from pajbot.managers.querystats import QueryStats
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.models.action import ActionParser
 from pajbot.models.action import RawFuncAction
@@ -405,7 +406,7 @@ class Command(Base):
 
     def run_action(self, bot, source, message, event, args):
         cur_time = time.time()
-        with source.spend_currency_context(self.cost, self.tokens_cost):
+        with QueryStats.context('command'), source.spend_currency_context(self.cost, self.tokens_cost):
             ret = self.action.run(bot, source, message, event, args)
             if ret is False:
                 raise FailedCommand('return currency')
@@ -11,6 +11,7 @@ from sqlalchemy.orm import relationship
 
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
+from pajbot.managers.leaderboard import LeaderboardManager
 
 log = logging.getLogger(__name__)
 
@@ -88,7 +89,10 @@ class DuelManager:
             if user_duel_stats.current_streak > user_duel_stats.longest_winstreak:
                 user_duel_stats.longest_winstreak = user_duel_stats.current_streak
 
-            return user_duel_stats
+        # Only once the new stats have been committed, so redis is never ahead of the database
+        LeaderboardManager.update_duel_stats(user_duel_stats)
+
+        return user_duel_stats
 
     def user_lost(user, points_lost):
         """
@@ -111,4 +115,6 @@ class DuelManager:
             if abs(user_duel_stats.current_streak) > user_duel_stats.longest_losestreak:
                 user_duel_stats.longest_losestreak = user_duel_stats.current_streak
 
-            return user_duel_stats
+        LeaderboardManager.update_duel_stats(user_duel_stats)
+
+        return user_duel_stats
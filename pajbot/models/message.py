@@ -0,0 +1,77 @@
+from pajbot.urls import find_urls
+
+
+class MessageFeatures:
+    """
+    Facts about a single chat message that several handlers need.
+
+    One object is created per message in Bot.on_pubmsg/Bot.parse_message, and passed
+    to every on_pubmsg, on_message and on_message_background handler that takes a
+    `features` keyword argument. Everything is computed the first time it's used, and then cached.
+    """
+
+    def __init__(self, message, emotes=None, urls=None):
+        self.message = message
+        self.length = len(message)
+
+        self._emotes = emotes
+        self._urls = urls
+        self._lower = None
+        self._tokens = None
+        self._lower_tokens = None
+        self._non_alnum_ratio = None
+        self._emote_codes = None
+
+    @property
+    def lower(self):
+        if self._lower is None:
+            self._lower = self.message.lower()
+        return self._lower
+
+    @property
+    def tokens(self):
+        """ The message split on single spaces """
+        if self._tokens is None:
+            self._tokens = self.message.split(' ')
+        return self._tokens
+
+    @property
+    def lower_tokens(self):
+        if self._lower_tokens is None:
+            self._lower_tokens = self.lower.split(' ')
+        return self._lower_tokens
+
+    @property
+    def non_alnum_ratio(self):
+        """ How much of the message is not letters or digits, between 0 and 1 """
+        if self._non_alnum_ratio is None:
+            if self.length == 0:
+                self._non_alnum_ratio = 0.0
+            else:
+                self._non_alnum_ratio = sum(not c.isalnum() for c in self.message) / self.length
+        return self._non_alnum_ratio
+
+    @property
+    def emotes(self):
+        """ The emotes as parsed by EmoteManager.parse_emotes, an empty list until they have been parsed """
+        if self._emotes is None:
+            return []
+        return self._emotes
+
+    @emotes.setter
+    def emotes(self, emotes):
+        self._emotes = emotes
+        self._emote_codes = None
+
+    @property
+    def emote_codes(self):
+        if self._emote_codes is None:
+            self._emote_codes = {emote['code'] for emote in self.emotes}
+        return self._emote_codes
+
+    @property
+    def urls(self):
+        """ The unique URLs in the message, see pajbot.urls.find_urls """
+        if self._urls is None:
+            self._urls = find_urls(self.message)
+        return self._urls
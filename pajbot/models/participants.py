@@ -0,0 +1,82 @@
+import logging
+
+from numpy import random
+
+log = logging.getLogger(__name__)
+
+
+class ParticipantSet:
+    """
+    Keeps track of the participants of a join-style game (raffles, lotteries, etc).
+
+    Participants are stored by username only, with a dictionary for O(1)
+    membership checks and a list for uniform random sampling.
+    Each participant can have a weight (i.e. the number of tickets bought).
+
+    Winners should be turned into full user objects once the game is over,
+    see UserManager.bulk_get_users.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # username -> index in self.usernames
+        self.indices = {}
+        self.usernames = []
+        self.weights = []
+        self.total_weight = 0
+
+    def add(self, username, weight=1):
+        """ Add a participant to the set.
+        Returns False if the participant had already joined, otherwise True """
+        if username in self.indices:
+            return False
+
+        self.indices[username] = len(self.usernames)
+        self.usernames.append(username)
+        self.weights.append(weight)
+        self.total_weight += weight
+        return True
+
+    def get_weight(self, username):
+        return self.weights[self.indices[username]]
+
+    def choice(self):
+        """ Returns a uniformly random participant, or None if the set is empty """
+        if len(self.usernames) == 0:
+            return None
+
+        return self.usernames[random.randint(0, len(self.usernames))]
+
+    def weighted_choice(self):
+        """ Returns a random participant where the chance of winning is
+        proportional to the participants weight, or None if the set is empty """
+        if self.total_weight <= 0:
+            return self.choice()
+
+        r = random.uniform(0, self.total_weight)
+        upto = 0
+        for username, weight in zip(self.usernames, self.weights):
+            if upto + weight >= r:
+                return username
+            upto += weight
+
+        return self.usernames[-1]
+
+    def sample(self, num):
+        """ Returns `num` unique participants in random order """
+        num = min(num, len(self.usernames))
+        if num <= 0:
+            return []
+
+        return [self.usernames[i] for i in random.choice(len(self.usernames), num, replace=False)]
+
+    def __contains__(self, username):
+        return username in self.indices
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def __iter__(self):
+        return iter(self.usernames)
@@ -1,5 +1,8 @@
 import datetime
+import json
 import logging
+import threading
+import time
 
 from sqlalchemy import Column
 from sqlalchemy import DateTime
@@ -10,9 +13,33 @@ from sqlalchemy.orm import relationship
 
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
+from pajbot.managers.redis import RedisManager
+from pajbot.models.stream import Stream
+from pajbot.streamhelper import StreamHelper
 
 log = logging.getLogger('pajbot')
 
+QUEUE_KEY = '{streamer}:pleblist:queue'
+QUEUE_VERSION_KEY = '{streamer}:pleblist:queue:next_version'
+QUEUE_CHANNEL = '{streamer}:pleblist:queue:changes'
+
+# KEYS[1] = queue hash, KEYS[2] = change channel
+# ARGV[1] = version, ARGV[2] = JSON of the queue
+# The queue is only stored if it's newer than the one in redis, so two processes
+# updating it at the same time can't leave the older queue behind.
+# Returns 1 if the queue was stored, 0 otherwise
+SCRIPT_STORE_QUEUE = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+if tonumber(ARGV[1]) <= version then
+    return 0
+end
+redis.call('HMSET', KEYS[1], 'version', ARGV[1], 'data', ARGV[2])
+redis.call('PUBLISH', KEYS[2], ARGV[1])
+return 1
+"""
+
+RedisManager.register_script('pleblist.store_queue', SCRIPT_STORE_QUEUE)
+
 
 class PleblistSong(Base):
     __tablename__ = 'tb_pleblist_song'
@@ -56,6 +83,16 @@ class PleblistSong(Base):
     def link(self):
         return 'youtu.be/{}'.format(self.youtube_id)
 
+    def from_json(stream_id, data):
+        """ Create a PleblistSong from the output of jsonify, without adding it to a session """
+        song = PleblistSong(stream_id, data['youtube_id'], skip_after=data['skip_after'])
+        song.id = data['id']
+        song.date_added = None
+        info = data['info']
+        if info is not None:
+            song.song_info = PleblistSongInfo(song.youtube_id, info['title'], info['duration'], info['default_thumbnail'])
+        return song
+
 
 class PleblistSongInfo(Base):
     __tablename__ = 'tb_pleblist_song_info'
@@ -79,9 +116,41 @@ class PleblistSongInfo(Base):
                 }
 
 
+class PleblistQueue:
+    """ The unplayed songs of the current stream, as stored in redis by PleblistManager.update_queue.
+    stream_id is None if the stream is offline. songs is a list of PleblistSong.jsonify() outputs, next song first """
+
+    def __init__(self, version, data):
+        self.version = version
+        self.stream_id = data['stream_id']
+        self.songs = data['songs']
+        self._current_song = None
+
+    @property
+    def current_song(self):
+        """ The next song as a PleblistSong that isn't attached to a session, or None if the queue is empty """
+        if self._current_song is None and len(self.songs) > 0:
+            self._current_song = PleblistSong.from_json(self.stream_id, self.songs[0])
+        return self._current_song
+
+    def get_songs_after(self, song_id):
+        return [song for song in self.songs if song['id'] > song_id]
+
+
 class PleblistManager:
     youtube = None
 
+    # streamer -> the last PleblistQueue this process has seen
+    queues = {}
+
+    # How long wait_for_queue waits for a change by default, in seconds
+    WAIT_TIMEOUT = 25
+
+    # How many requests in this process can wait for a change at the same time.
+    # Every waiting request holds a web worker and a redis connection
+    MAX_WAITERS = 5
+    waiters = threading.BoundedSemaphore(MAX_WAITERS)
+
     def init(developer_key):
         if PleblistManager.youtube is None:
             import apiclient
@@ -137,6 +206,91 @@ class PleblistManager:
                 default_thumbnail,
                 )
 
+    def update_queue():
+        """ Load the queue of the current stream from the database, and share it through redis.
+        Must be called after every change to the songs of the current stream, and when the stream starts or stops.
+        Returns the newest PleblistQueue """
+        streamer = StreamHelper.get_streamer()
+        redis = RedisManager.get()
+
+        # The version is picked before reading the database,
+        # so a queue that's read later always ends up with a higher version
+        version = redis.incr(QUEUE_VERSION_KEY.format(streamer=streamer))
+
+        with DBManager.create_session_scope() as db_session:
+            current_stream = db_session.query(Stream).filter_by(ended=False).order_by(Stream.stream_start).first()
+            if current_stream is None:
+                data = {'stream_id': None, 'songs': []}
+            else:
+                songs = db_session.query(PleblistSong).filter(PleblistSong.stream_id == current_stream.id, PleblistSong.date_played.is_(None)).order_by(PleblistSong.date_added.asc(), PleblistSong.id.asc())
+                data = {'stream_id': current_stream.id, 'songs': [song.jsonify() for song in songs]}
+
+        stored = RedisManager.run_script('pleblist.store_queue',
+                keys=[QUEUE_KEY.format(streamer=streamer), QUEUE_CHANNEL.format(streamer=streamer)],
+                args=[version, json.dumps(data)])
+        if not stored:
+            # Someone else stored a newer queue in the meantime
+            return PleblistManager.get_queue()
+
+        queue = PleblistQueue(version, data)
+        PleblistManager.set_cached_queue(streamer, queue)
+        return queue
+
+    def set_cached_queue(streamer, queue):
+        cached_queue = PleblistManager.queues.get(streamer, None)
+        if cached_queue is None or cached_queue.version < queue.version:
+            PleblistManager.queues[streamer] = queue
+
+    def get_queue():
+        """ Returns the PleblistQueue of the current stream.
+        Costs a single HGET unless the queue changed since this process last saw it """
+        streamer = StreamHelper.get_streamer()
+        redis = RedisManager.get()
+        queue_key = QUEUE_KEY.format(streamer=streamer)
+
+        version = redis.hget(queue_key, 'version')
+        if version is None:
+            return PleblistManager.update_queue()
+
+        queue = PleblistManager.queues.get(streamer, None)
+        if queue is not None and queue.version >= int(version):
+            return queue
+
+        version, data = redis.hmget(queue_key, 'version', 'data')
+        queue = PleblistQueue(int(version), json.loads(data))
+        PleblistManager.set_cached_queue(streamer, queue)
+        return queue
+
+    def wait_for_queue(version, timeout=None):
+        """ Wait until the version of the queue is something else than `version`, for at most `timeout` seconds.
+        If MAX_WAITERS requests are waiting already, the queue is returned right away.
+        Returns the PleblistQueue of the current stream """
+        if timeout is None:
+            timeout = PleblistManager.WAIT_TIMEOUT
+
+        if not PleblistManager.waiters.acquire(blocking=False):
+            return PleblistManager.get_queue()
+
+        pubsub = RedisManager.get().pubsub(ignore_subscribe_messages=True)
+        try:
+            # Subscribe before checking the version, so a change in between isn't missed
+            pubsub.subscribe(QUEUE_CHANNEL.format(streamer=StreamHelper.get_streamer()))
+
+            queue = PleblistManager.get_queue()
+            deadline = time.time() + timeout
+            while queue.version == version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                if pubsub.get_message(timeout=remaining) is not None:
+                    queue = PleblistManager.get_queue()
+
+            return queue
+        finally:
+            pubsub.close()
+            PleblistManager.waiters.release()
+
     def get_current_song(stream_id):
         with DBManager.create_session_scope() as session:
             cur_song = session.query(PleblistSong).filter(PleblistSong.stream_id == stream_id, PleblistSong.date_played.is_(None)).order_by(PleblistSong.date_added.asc(), PleblistSong.id.asc()).first()
@@ -3,7 +3,9 @@ import logging
 
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
 from sqlalchemy import Integer
+from sqlalchemy.ext.hybrid import hybrid_property
 
 from pajbot.managers.db import Base
 
@@ -22,3 +24,74 @@ class Roulette(Base):
         self.user_id = user_id
         self.created_at = datetime.datetime.now()
         self.points = points
+
+
+class UserRouletteStats(Base):
+    """ Aggregated roulette stats for a single user.
+    Updated every time the user does a roulette, so the profile page
+    does not have to go through every Roulette row of the user. """
+
+    __tablename__ = 'tb_user_roulette_stats'
+
+    user_id = Column(Integer, ForeignKey('tb_user.id'), primary_key=True, autoincrement=False)
+    num_roulettes = Column(Integer, nullable=False, default=0)
+    num_wins = Column(Integer, nullable=False, default=0)
+    profit = Column(Integer, nullable=False, default=0)
+    total_points = Column(Integer, nullable=False, default=0)
+    biggest_win = Column(Integer, nullable=False, default=0)
+    biggest_loss = Column(Integer, nullable=False, default=0)
+    last_roulette = Column(DateTime, nullable=True)
+    current_streak = Column(Integer, nullable=False, default=0)
+    longest_winstreak = Column(Integer, nullable=False, default=0)
+    longest_losestreak = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.num_roulettes = 0
+        self.num_wins = 0
+        self.profit = 0
+        self.total_points = 0
+        self.biggest_win = 0
+        self.biggest_loss = 0
+        self.last_roulette = None
+        self.current_streak = 0
+        self.longest_winstreak = 0
+        self.longest_losestreak = 0
+
+    @hybrid_property
+    def num_losses(self):
+        return self.num_roulettes - self.num_wins
+
+    @property
+    def winrate(self):
+        if self.num_roulettes == 0:
+            return 0
+        return self.num_wins / self.num_roulettes
+
+    def add_roulette(self, points, created_at=None):
+        """ Add the result of a roulette to the stats.
+        points = how many points the user won (positive) or lost (negative) """
+        self.num_roulettes += 1
+        self.profit += points
+        self.total_points += abs(points)
+        self.last_roulette = created_at or datetime.datetime.now()
+
+        if points > 0:
+            self.num_wins += 1
+            self.biggest_win = max(self.biggest_win, points)
+
+            if self.current_streak > 0:
+                self.current_streak += 1
+            else:
+                self.current_streak = 1
+            self.longest_winstreak = max(self.longest_winstreak, self.current_streak)
+        else:
+            self.biggest_loss = min(self.biggest_loss, points)
+
+            if self.current_streak < 0:
+                self.current_streak -= 1
+            else:
+                self.current_streak = -1
+            self.longest_losestreak = max(self.longest_losestreak, abs(self.current_streak))
+
+        return self
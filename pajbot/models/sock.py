@@ -1,11 +1,36 @@
 import json
 import logging
 import os
+import queue
+import selectors
 import socket
+import struct
 import threading
+from contextlib import contextmanager
+
+from pajbot.managers.channel import ChannelManager
 
 log = logging.getLogger(__name__)
 
+"""
+Messages sent over the socket are framed as a 4 byte big-endian length
+followed by that many bytes of UTF-8 encoded JSON.
+The JSON payload is either a single event ({"event": "...", "data": {...}})
+or a list of events, which are all handled together.
+
+A connection can be kept open and used for any number of frames.
+For backwards compatibility, a connection that starts with a raw JSON
+payload (no length prefix) is read until it is closed and handled as one payload.
+"""
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def encode_frame(payload):
+    payload_bytes = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload_bytes)) + payload_bytes
+
 
 class SocketResource:
     def __init__(self, socket_file):
@@ -29,14 +54,59 @@ class SocketResource:
             pass
 
 
+class SocketConnection:
+    """ Buffers incoming data for a single client connection """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer = b''
+        self.legacy = None
+
+    def read_payloads(self, data):
+        """ Add the newly received data to the buffer.
+        Returns a list of all complete payloads in the buffer """
+        self.buffer += data
+
+        if self.legacy is None and len(self.buffer) > 0:
+            # A JSON payload starts with { or [, which would be an impossibly large frame header
+            self.legacy = self.buffer[:1] in (b'{', b'[')
+
+        if self.legacy:
+            # Legacy payloads are only complete once the connection is closed
+            return []
+
+        payloads = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            frame_size, = FRAME_HEADER.unpack_from(self.buffer)
+            if frame_size > MAX_FRAME_SIZE:
+                raise ValueError('Frame too large ({} bytes)'.format(frame_size))
+
+            frame_end = FRAME_HEADER.size + frame_size
+            if len(self.buffer) < frame_end:
+                break
+
+            payloads.append(self.buffer[FRAME_HEADER.size:frame_end])
+            self.buffer = self.buffer[frame_end:]
+
+        return payloads
+
+    def close(self):
+        """ Returns the pending legacy payload, if any """
+        self.conn.close()
+        if self.legacy and len(self.buffer) > 0:
+            return [self.buffer]
+        return []
+
+
 class SocketManager:
     def __init__(self, bot):
         self.handlers = {}
         self.socket_file = None
+        self.bot = bot
 
         if self.check_config(bot.config) is True:
             self.socket_file = bot.config['sock']['sock_file']
-            self.thread = threading.Thread(target=self.start, name='SocketManagerThread')
+            self.thread = threading.Thread(target=ChannelManager.wrap(self.start), name='SocketManagerThread')
             self.thread.daemon = True
             self.thread.start()
 
@@ -66,53 +136,156 @@ class SocketManager:
 
     def start(self):
         with SocketResource(self.socket_file) as sr:
+            selector = selectors.DefaultSelector()
+            sr.server.setblocking(False)
+            selector.register(sr.server, selectors.EVENT_READ, None)
+
             while True:
-                conn, addr = sr.server.accept()
-                log.debug('Accepted connection from {}'.format(addr))
+                for key, mask in selector.select():
+                    if key.data is None:
+                        self.accept(selector, key.fileobj)
+                    else:
+                        self.read(selector, key.data)
 
-                data = conn.recv(4096)
-                if data:
-                    try:
-                        json_data = json.loads(data.decode('utf-8'))
-                    except ValueError:
-                        log.warn('Invalid JSON Data passwed through SocketManager: {}'.format(data))
-                        continue
+    def accept(self, selector, server):
+        try:
+            conn, addr = server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
 
-                    if 'event' not in json_data:
-                        log.warn('Missing event key from json data: {}'.format(json_data))
-                        continue
+        log.debug('Accepted connection from {}'.format(addr))
+        conn.setblocking(False)
+        selector.register(conn, selectors.EVENT_READ, SocketConnection(conn))
 
-                    if 'data' not in json_data:
-                        log.warn('Missing data key in json_data: {}'.format(json_data))
-                        continue
+    def read(self, selector, connection):
+        try:
+            data = connection.conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            log.exception('Error while reading from socket connection')
+            data = b''
 
-                    try:
-                        event = json_data['event'].lower()
-                    except AttributeError:
-                        log.warn('Unknown event: {}'.format(json_data['event']))
-                        continue
+        try:
+            if data:
+                payloads = connection.read_payloads(data)
+            else:
+                selector.unregister(connection.conn)
+                payloads = connection.close()
+        except ValueError:
+            log.exception('Invalid data passed through SocketManager, closing connection')
+            selector.unregister(connection.conn)
+            connection.close()
+            return
+
+        events = []
+        for payload in payloads:
+            events.extend(self.parse_payload(payload))
+
+        if len(events) > 0:
+            # Handlers are not thread-safe, so they are run on the bots main thread.
+            # They're scheduled on the reactor directly, so they don't wait behind the jobs in mainthread_queue
+            self.bot.execute_delayed(0, self.handle_events, (events, ))
+
+    def parse_payload(self, payload):
+        """ Returns a list of (event, data) tuples from the given raw payload """
+        try:
+            json_data = json.loads(payload.decode('utf-8'))
+        except ValueError:
+            log.warn('Invalid JSON Data passwed through SocketManager: {}'.format(payload))
+            return []
+
+        if not isinstance(json_data, list):
+            json_data = [json_data]
+
+        events = []
+        for event_data in json_data:
+            if not isinstance(event_data, dict) or 'event' not in event_data:
+                log.warn('Missing event key from json data: {}'.format(event_data))
+                continue
+
+            if 'data' not in event_data:
+                log.warn('Missing data key in json_data: {}'.format(event_data))
+                continue
 
+            try:
+                event = event_data['event'].lower()
+            except AttributeError:
+                log.warn('Unknown event: {}'.format(event_data['event']))
+                continue
+
+            if '.' not in event:
+                log.warn('Missing separator in event: {}'.format(event_data))
+                continue
+
+            events.append((event, event_data['data']))
+
+        return events
+
+    def handle_events(self, events):
+        for event, data in events:
+            if event in self.handlers:
+                for handler in self.handlers[event]:
                     try:
-                        handler, trigger = json_data['event'].lower().split('.')
-                    except ValueError:
-                        log.warn('Missing separator in event: {}'.format(json_data))
-                        continue
-
-                    if event in self.handlers:
-                        for handler in self.handlers[event]:
-                            try:
-                                handler(json_data['data'], conn)
-                            except:
-                                log.exception('Unhandled exception in handler for event {}'.format(event))
-                    else:
-                        log.debug('Unhandled handler: {}'.format(event))
+                        handler(data, None)
+                    except:
+                        log.exception('Unhandled exception in handler for event {}'.format(event))
+            else:
+                log.debug('Unhandled handler: {}'.format(event))
 
 
 class SocketClientManager:
+    """
+    Sends events to the bots SocketManager.
+
+    Connections are kept open and reused through a small pool.
+    Use the batch() context manager to send several events in one frame:
+
+        with SocketClientManager.batch():
+            for banphrase in banphrases:
+                SocketClientManager.send('banphrase.update', {'id': banphrase.id})
+    """
+
     sock_file = None
+    pool = None
+    local = threading.local()
+
+    POOL_SIZE = 4
 
     def init(sock_file):
         SocketClientManager.sock_file = sock_file
+        SocketClientManager.pool = queue.LifoQueue(maxsize=SocketClientManager.POOL_SIZE)
+
+    def _get_connection():
+        try:
+            return SocketClientManager.pool.get_nowait()
+        except queue.Empty:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(SocketClientManager.sock_file)
+            return client
+
+    def _release_connection(client):
+        try:
+            SocketClientManager.pool.put_nowait(client)
+        except queue.Full:
+            client.close()
+
+    def _send_frame(payload):
+        frame = encode_frame(payload)
+
+        # A pooled connection might have been closed by the bot (i.e. after a restart),
+        # in which case we retry once with a fresh connection
+        for attempt in range(0, 2):
+            client = SocketClientManager._get_connection()
+            try:
+                client.sendall(frame)
+            except (BrokenPipeError, ConnectionResetError):
+                client.close()
+                if attempt == 0:
+                    continue
+                raise
+            SocketClientManager._release_connection(client)
+            return True
 
     def send(event, data):
         if SocketClientManager.sock_file is None:
@@ -123,16 +296,43 @@ class SocketClientManager:
                 'data': data
                 }
 
-        payload_bytes = json.dumps(payload).encode('utf-8')
+        pending = getattr(SocketClientManager.local, 'pending', None)
+        if pending is not None:
+            # We're inside of a batch, the event is sent when the batch ends
+            pending.append(payload)
+            return True
 
-        try:
-            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
-                client.connect(SocketClientManager.sock_file)
-                client.sendall(payload_bytes)
-                return True
-        except (socket.error, socket.herror, socket.gaierror):
-            log.exception('A socket error occured')
+        return SocketClientManager.send_batch([payload])
+
+    def send_batch(payloads):
+        """ Send a list of {'event': ..., 'data': ...} payloads in a single frame """
+        if SocketClientManager.sock_file is None:
             return False
+
+        if len(payloads) == 0:
+            return True
+
+        try:
+            return SocketClientManager._send_frame(payloads if len(payloads) > 1 else payloads[0])
         except socket.timeout:
             log.exception('The server took to long to respond.')
             return False
+        except (socket.error, socket.herror, socket.gaierror):
+            log.exception('A socket error occured')
+            return False
+
+    @contextmanager
+    def batch():
+        """ Collect all events sent in this context (on this thread) and send them in one frame """
+        if getattr(SocketClientManager.local, 'pending', None) is not None:
+            # Nested batch, the outermost batch sends everything
+            yield
+            return
+
+        SocketClientManager.local.pending = []
+        try:
+            yield
+        finally:
+            payloads = SocketClientManager.local.pending
+            SocketClientManager.local.pending = None
+            SocketClientManager.send_batch(payloads)
@@ -20,6 +20,7 @@ from sqlalchemy.orm import relationship
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.managers.highlight import HighlightManager
 from pajbot.managers.redis import RedisManager
 
 log = logging.getLogger('pajbot')
@@ -99,7 +100,7 @@ class StreamChunkHighlight(Base):
     stream_chunk_id = Column(Integer, ForeignKey('tb_stream_chunk.id'), nullable=False)
     created_by = Column(Integer, nullable=True)
     last_edited_by = Column(Integer, nullable=True)
-    created_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
     highlight_offset = Column(Integer, nullable=False)
     description = Column(String(128), nullable=True)
     override_link = Column(String(256), nullable=True)
@@ -482,6 +483,8 @@ class StreamManager:
             with DBManager.create_session_scope(expire_on_commit=False) as db_session:
                 db_session.add(highlight)
                 db_session.add(self.current_stream_chunk)
+
+            HighlightManager.on_highlight_added(highlight.created_at)
         except:
             log.exception('uncaught exception in create_highlight')
             return 'Unknown reason, ask pajlada'
@@ -537,8 +540,12 @@ class StreamManager:
         """
 
         with DBManager.create_session_scope() as db_session:
+            created_at = db_session.query(StreamChunkHighlight.created_at).filter(StreamChunkHighlight.id == id).scalar()
             num_rows = db_session.query(StreamChunkHighlight).filter(StreamChunkHighlight.id == id).delete()
 
+        if num_rows == 1:
+            HighlightManager.on_highlight_removed(created_at)
+
         return (num_rows == 1)
 
     def get_current_stream_value(self, key, extra={}):
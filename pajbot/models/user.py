@@ -12,6 +12,8 @@ from sqlalchemy import String
 from pajbot.exc import FailedCommand
 from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
+from pajbot.managers.metrics import MetricsManager
+from pajbot.managers.points import PointsManager
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.managers.time import TimeManager
@@ -20,6 +22,62 @@ from pajbot.utils import time_method  # NOQA
 
 log = logging.getLogger(__name__)
 
+CACHE_REQUESTS = MetricsManager.counter('pajbot_cache_requests_total', 'Number of cache lookups', ['cache', 'result'])
+
+# KEYS = the users warning keys, ARGV[1] = how long a warning lasts (in seconds)
+# Uses up the first free warning, if there is one.
+# Returns how many warnings the user had already used
+SCRIPT_USE_WARNING = """
+local chances_used = 0
+local free_key = nil
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        chances_used = chances_used + 1
+    elseif not free_key then
+        free_key = key
+    end
+end
+if free_key then
+    redis.call('SETEX', free_key, ARGV[1], 1)
+end
+return chances_used
+"""
+
+# KEYS[1] = tokens sorted set, ARGV[1] = username, ARGV[2] = amount of tokens to spend
+# Returns {1, new_value} if the tokens were spent, or {0, current_value} if the user could not afford it
+SCRIPT_SPEND_TOKENS = """
+local current_value = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1]) or 0)
+if current_value < tonumber(ARGV[2]) then
+    return {0, current_value}
+end
+local new_value = current_value - tonumber(ARGV[2])
+if new_value == 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], new_value, ARGV[1])
+end
+return {1, new_value}
+"""
+
+# KEYS[1] = tokens sorted set, ARGV[1] = username, ARGV[2] = amount of tokens to add
+# ARGV[3] = (optional) the most tokens the user can end up with
+# Returns the new amount of tokens
+SCRIPT_ADD_TOKENS = """
+local new_value = tonumber(redis.call('ZINCRBY', KEYS[1], ARGV[2], ARGV[1]))
+if ARGV[3] and new_value > tonumber(ARGV[3]) then
+    new_value = tonumber(ARGV[3])
+    redis.call('ZADD', KEYS[1], new_value, ARGV[1])
+end
+if new_value == 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return new_value
+"""
+
+RedisManager.register_script('user.use_warning', SCRIPT_USE_WARNING)
+RedisManager.register_script('user.spend_tokens', SCRIPT_SPEND_TOKENS)
+RedisManager.register_script('user.add_tokens', SCRIPT_ADD_TOKENS)
+
 
 class User(Base):
     __tablename__ = 'tb_user'
@@ -69,30 +127,45 @@ class NoCacheHit(Exception):
 
 
 class UserSQLCache:
+    # streamer -> username -> cached values
     cache = {}
 
     def init():
         ScheduleManager.execute_every(30 * 60, UserSQLCache._clear_cache)
 
     def _clear_cache():
-        UserSQLCache.cache = {}
+        UserSQLCache.cache.pop(StreamHelper.get_streamer(), None)
+
+    def _get_cache():
+        """ Each channel has its own users table, so the cache is per streamer """
+        streamer = StreamHelper.get_streamer()
+        cache = UserSQLCache.cache.get(streamer, None)
+        if cache is None:
+            cache = UserSQLCache.cache[streamer] = {}
+        return cache
 
     def save(user):
-        UserSQLCache.cache[user.username] = {
+        UserSQLCache._get_cache()[user.username] = {
                 'id': user.id,
                 'level': user.level,
                 'subscriber': user.subscriber,
                 }
 
-    def get(username, value):
-        if username not in UserSQLCache.cache:
-            raise NoCacheHit('User not in cache')
+    def invalidate(usernames):
+        cache = UserSQLCache._get_cache()
+        for username in usernames:
+            cache.pop(username, None)
 
-        if value not in UserSQLCache.cache[username]:
+    def get(username, value):
+        cache = UserSQLCache._get_cache()
+        if username not in cache or value not in cache[username]:
+            CACHE_REQUESTS.inc('user_sql', 'miss')
             raise NoCacheHit('Value not in cache')
 
+        CACHE_REQUESTS.inc('user_sql', 'hit')
+
         # log.debug('Returning {}:{} from cache'.format(username, value))
-        return UserSQLCache.cache[username][value]
+        return cache[username][value]
 
 
 class UserSQL:
@@ -101,6 +174,7 @@ class UserSQL:
         self.user_model = user_model
         self.model_loaded = user_model is not None
         self.shared_db_session = db_session
+        self._points = None
 
     def select_or_create(db_session, username):
         user = db_session.query(User).filter_by(username=username).one_or_none()
@@ -217,16 +291,33 @@ class UserSQL:
 
     @property
     def points(self):
-        self.sql_load()
-        return self.user_model.points
+        """ Points are stored in the redis points ledger (see PointsManager).
+        The users SQL value is only used to add him to the ledger the first time. """
+        if self._points is None:
+            points = PointsManager.get_points(self.username)
+            if points is None:
+                self.sql_load()
+                points = PointsManager.seed_points(self.username, self.user_model.points)
+            self._points = points
+
+        return self._points
 
     @points.setter
     def points(self, value):
-        self.sql_load()
-        self.user_model.points = value
+        delta = value - self.points
+        if delta == 0:
+            return
+
+        new_value = PointsManager.add_points(self.username, delta)
+        if new_value is None:
+            self.sql_load()
+            new_value = PointsManager.add_points(self.username, delta, seed=self.user_model.points)
+
+        self._points = new_value
 
     @property
     def points_rank(self):
+        """ Based on tb_user.points, so it can be behind the points ledger until the next checkpoint """
         if self.shared_db_session:
             query_data = self.shared_db_session.query(sqlalchemy.func.count(User.id)).filter(User.points > self.points).one()
         else:
@@ -357,6 +448,16 @@ class UserRedis:
             else:
                 self.redis.zrem('{streamer}:users:num_lines'.format(streamer=StreamHelper.get_streamer()), self.username)
 
+    def add_num_lines(self, amount):
+        """ Atomically add `amount` to the users line count. Returns the new line count """
+        if not self.save_to_redis:
+            self.values['num_lines'] = self.num_lines + amount
+            return self.values['num_lines']
+
+        new_value = self.redis.zincrby('{streamer}:users:num_lines'.format(streamer=StreamHelper.get_streamer()), self.username, amount)
+        self.values['num_lines'] = int(new_value)
+        return self.values['num_lines']
+
     @property
     def tokens(self):
         if self.save_to_redis:
@@ -511,14 +612,16 @@ class UserCombined(UserRedis, UserSQL):
                 'timeout_end': self.timeout_end,
                 }
 
-    def jsonify(self):
+    def jsonify(self, nl_rank=None, points_rank=None):
+        """ The ranks can be passed through if they have already been calculated,
+        see UserManager.bulk_jsonify """
         return {
                 'id': self.id,
                 'username': self.username,
                 'username_raw': self.username_raw,
                 'points': self.points,
-                'nl_rank': self.num_lines_rank,
-                'points_rank': self.points_rank,
+                'nl_rank': self.num_lines_rank if nl_rank is None else nl_rank,
+                'points_rank': self.points_rank if points_rank is None else points_rank,
                 'level': self.level,
                 'last_seen': self.last_seen,
                 'last_active': self.last_active,
@@ -587,16 +690,12 @@ class UserCombined(UserRedis, UserSQL):
 
         return len(warnings) - warnings.count(None)
 
-    def add_warning(self, redis, timeout, warning_keys, warnings):
-        """ Returns a number between 0 and n where n is the amount of
-            chances a user has before he should face the full timeout length. """
-
-        for id in range(0, len(warning_keys)):
-            if warnings[id] is None:
-                redis.setex(warning_keys[id], time=timeout, value=1)
-                return True
+    def use_warning(self, redis, timeout, warning_keys):
+        """ Atomically use up one of the users warnings, if he has any left.
+        Returns how many warnings the user had used before this one, a number between 0 and n
+        where n is the amount of chances a user has before he should face the full timeout length. """
 
-        return False
+        return RedisManager.run_script('user.use_warning', keys=warning_keys, args=[timeout], client=redis)
 
     def timeout(self, timeout_length, warning_module=None, use_warnings=True):
         """ Returns a tuple with the follow data:
@@ -614,9 +713,7 @@ class UserCombined(UserRedis, UserSQL):
             total_chances = warning_module.settings['total_chances']
 
             warning_keys = self.get_warning_keys(total_chances, warning_module.settings['redis_prefix'])
-            warnings = self.get_warnings(redis, warning_keys)
-
-            chances_used = self.get_chances_used(warnings)
+            chances_used = self.use_warning(redis, warning_module.settings['length'], warning_keys)
 
             if chances_used < total_chances:
                 """ The user used up one of his warnings.
@@ -624,8 +721,6 @@ class UserCombined(UserRedis, UserSQL):
                 timeout_length = warning_module.settings['base_timeout'] * (chances_used + 1)
                 punishment = 'timed out for {} seconds (warning)'.format(timeout_length)
 
-                self.add_warning(redis, warning_module.settings['length'], warning_keys, warnings)
-
         return (timeout_length, punishment)
 
     @contextmanager
@@ -638,7 +733,7 @@ class UserCombined(UserRedis, UserSQL):
         except FailedCommand:
             log.debug('Returning {} points to {}'.format(points_to_spend, self.username_raw))
             self.points += points_to_spend
-            self.tokens += tokens_to_spend
+            self.add_tokens(tokens_to_spend)
         except:
             # An error occured, return the users points!
             log.exception('XXXX')
@@ -647,19 +742,50 @@ class UserCombined(UserRedis, UserSQL):
 
     def _spend_points(self, points_to_spend):
         """ Returns true if points were spent, otherwise return False """
-        if points_to_spend <= self.points:
-            self.points -= points_to_spend
-            return True
+        if points_to_spend == 0:
+            return self.points >= 0
+
+        res = PointsManager.spend_points(self.username, points_to_spend)
+        if res is None:
+            # The user is not in the points ledger yet
+            self.points
+            res = PointsManager.spend_points(self.username, points_to_spend)
 
-        return False
+        spent, self._points = res
+        return spent
 
     def _spend_tokens(self, tokens_to_spend):
         """ Returns true if tokens were spent, otherwise return False """
-        if tokens_to_spend <= self.tokens:
-            self.tokens -= tokens_to_spend
-            return True
+        if tokens_to_spend <= 0 or not self.save_to_redis:
+            if tokens_to_spend <= self.tokens:
+                self.tokens -= tokens_to_spend
+                return True
 
-        return False
+            return False
+
+        key = '{streamer}:users:tokens'.format(streamer=StreamHelper.get_streamer())
+        spent, new_value = RedisManager.run_script('user.spend_tokens', keys=[key], args=[self.username, tokens_to_spend])
+        self.values['tokens'] = int(new_value)
+        return spent == 1
+
+    def add_tokens(self, tokens_to_add, max_tokens=None):
+        """ Atomically add tokens to the user, so it's safe to use from the background thread.
+        If max_tokens is set, the user ends up with at most max_tokens tokens.
+        Returns the new amount of tokens """
+        if not self.save_to_redis:
+            new_value = self.tokens + tokens_to_add
+            if max_tokens is not None:
+                new_value = min(new_value, max_tokens)
+            self.values['tokens'] = new_value
+            return new_value
+
+        key = '{streamer}:users:tokens'.format(streamer=StreamHelper.get_streamer())
+        args = [self.username, tokens_to_add]
+        if max_tokens is not None:
+            args.append(max_tokens)
+        new_value = RedisManager.run_script('user.add_tokens', keys=[key], args=args)
+        self.values['tokens'] = int(new_value)
+        return self.values['tokens']
 
     def remove_debt(self, debt):
         try:
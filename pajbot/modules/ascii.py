@@ -1,6 +1,7 @@
 import logging
 
 from pajbot.managers.handler import HandlerManager
+from pajbot.models.message import MessageFeatures
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
 
@@ -53,18 +54,18 @@ class AsciiProtectionModule(BaseModule):
         super().__init__()
         self.bot = None
 
-    def check_message(message):
-        non_alnum = sum(not c.isalnum() for c in message)
-        ratio = non_alnum / len(message)
-        log.debug(message)
-        log.debug(ratio)
+    def check_message(message, ratio=None):
+        if ratio is None:
+            ratio = MessageFeatures(message).non_alnum_ratio
         if (len(message) > 240 and ratio > 0.8) or ratio > 0.93:
             return True
         return False
 
-    def on_pubmsg(self, source, message):
-        if len(message) > self.settings['min_msg_length'] and source.level < self.settings['bypass_level'] and source.moderator is False:
-            if AsciiProtectionModule.check_message(message) is not False:
+    def on_pubmsg(self, source, message, features=None):
+        if features is None:
+            features = MessageFeatures(message)
+        if features.length > self.settings['min_msg_length'] and source.level < self.settings['bypass_level'] and source.moderator is False:
+            if AsciiProtectionModule.check_message(message, features.non_alnum_ratio) is not False:
                 duration, punishment = self.bot.timeout_warn(source, self.settings['timeout_length'], reason='Too many ASCII characters')
                 """ We only send a notification to the user if he has spent more than
                 one hour watching the stream. """
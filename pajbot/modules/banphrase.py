@@ -4,6 +4,7 @@ import pajbot.models
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import DBManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.models.message import MessageFeatures
 from pajbot.modules import BaseModule
 
 log = logging.getLogger(__name__)
@@ -18,10 +19,12 @@ class BanphraseModule(BaseModule):
     CATEGORY = 'Filter'
     SETTINGS = []
 
-    def is_message_bad(self, source, msg_raw, event):
-        msg_lower = msg_raw.lower()
+    def is_message_bad(self, source, msg_raw, event, features=None):
+        if features is None:
+            features = MessageFeatures(msg_raw)
+        msg_lower = features.lower
 
-        res = self.bot.banphrase_manager.check_message(msg_raw, source)
+        res = self.bot.banphrase_manager.check_message(msg_raw, source, message_lower=msg_lower)
         if res is not False:
             self.bot.banphrase_manager.punish(source, res)
             return True
@@ -48,13 +51,13 @@ class BanphraseModule(BaseModule):
     def disable(self, bot):
         HandlerManager.remove_handler('on_message', self.on_message)
 
-    def on_message(self, source, message, emotes, whisper, urls, event):
+    def on_message(self, source, message, emotes, whisper, urls, event, features=None):
         if whisper:
             return
         if source.level >= 500 or source.moderator:
             return
 
-        if self.is_message_bad(source, message, event):
+        if self.is_message_bad(source, message, event, features=features):
             # we matched a filter.
             # return False so no more code is run for this message
             return False
@@ -4,7 +4,7 @@ import pajbot.models
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
 from pajbot.modules.basic import BasicCommandsModule
-from pajbot.modules.linkchecker import find_unique_urls
+from pajbot.urls import find_urls
 
 log = logging.getLogger(__name__)
 
@@ -59,8 +59,7 @@ class AbCommandModule(BaseModule):
 
         if message:
             """ check if there is a link in the message """
-            check_message = find_unique_urls(bot.url_regex, message)
-            if check_message == set():
+            if len(find_urls(message)) == 0:
                 msg_parts = message.split(' ')
                 if len(msg_parts) >= 2:
                     outer_str = msg_parts[0]
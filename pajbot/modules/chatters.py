@@ -2,6 +2,8 @@ import datetime
 import logging
 
 from pajbot.managers.db import DBManager
+from pajbot.managers.leaderboard import LeaderboardManager
+from pajbot.managers.points import PointsManager
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.user import UserManager
 from pajbot.models.user import User
@@ -55,7 +57,6 @@ class ChattersModule(BaseModule):
                 else:
                     more_update_data['minutes_in_chat_offline'] = self.update_chatters_interval
 
-                points_to_give_out = {}
                 dt_now = datetime.datetime.now().timestamp()
                 for user in users:
                     user._set_last_seen(dt_now)
@@ -69,24 +70,28 @@ class ChattersModule(BaseModule):
 
                     num_points = int(num_points)
 
-                    if num_points not in points_to_give_out:
-                        points_to_give_out[num_points] = []
-
-                    points_to_give_out[num_points].append(user.username)
+                    if num_points > 0:
+                        # Users that are not in the points ledger yet are added with their SQL value
+                        seed = user.user_model.points if user.user_model is not None else 0
+                        PointsManager.add_points(user.username, num_points, seed=seed, redis=pipeline)
 
                     user.save(save_to_db=False)
 
-                for num_points, usernames in points_to_give_out.items():
-                    payload = {
-                            User.points: User.points + num_points,
-                            }
-                    if self.bot.is_online:
-                        payload[User.minutes_in_chat_online] = User.minutes_in_chat_online + self.update_chatters_interval
-                    else:
-                        payload[User.minutes_in_chat_offline] = User.minutes_in_chat_offline + self.update_chatters_interval
-                    db_session.query(User).filter(User.username.in_(usernames)).\
+                payload = {}
+                if self.bot.is_online:
+                    payload[User.minutes_in_chat_online] = User.minutes_in_chat_online + self.update_chatters_interval
+                else:
+                    payload[User.minutes_in_chat_offline] = User.minutes_in_chat_offline + self.update_chatters_interval
+                # Users created while handing out points are updated as well
+                db_session.flush()
+                updated_usernames = [user.username for user in users if user.user_model is not None]
+                if len(updated_usernames) > 0:
+                    db_session.query(User).filter(User.username.in_(updated_usernames)).\
                             update(payload, synchronize_session=False)
 
+                    # Only users with a row in tb_user get the minutes, so the boards match the database
+                    LeaderboardManager.add_minutes(pipeline, updated_usernames, self.update_chatters_interval, self.bot.is_online)
+
                 pipeline.execute()
 
     """ NON-BATCHED VERSION
@@ -245,15 +245,14 @@ class DuelModule(BaseModule):
 
             return False
 
-        source.points -= duel_price
-        requestor.points -= duel_price
         winning_pot = int(duel_price * (1.0 - duel_tax))
         participants = [source, requestor]
         winner = random.choice(participants)
         participants.remove(winner)
         loser = participants.pop()
-        winner.points += duel_price
-        winner.points += winning_pot
+
+        if duel_price > 0:
+            bot.users.bulk_add_points([(winner, winning_pot), (loser, -duel_price)])
 
         winner.save()
         loser.save()
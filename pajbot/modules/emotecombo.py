@@ -1,6 +1,7 @@
 import logging
 
 from pajbot.managers.handler import HandlerManager
+from pajbot.models.message import MessageFeatures
 from pajbot.modules import BaseModule
 
 log = logging.getLogger(__name__)
@@ -31,22 +32,20 @@ class EmoteComboModule(BaseModule):
         self.emote_count = 0
         self.current_emote = None
 
-    def on_message(self, source, message, emotes, whisper, urls, event):
+    def on_message(self, source, message, emotes, whisper, urls, event, features=None):
         if whisper is False:
             if len(emotes) == 0:
                 # Ignore messages without any emotes
                 return True
 
-            prev_code = None
+            if features is None:
+                features = MessageFeatures(message, emotes=emotes)
+
             # Check if the message contains more than one unique emotes
-            for emote in emotes:
-                if prev_code is not None:
-                    if prev_code != emote['code']:
-                        # The message contained more than 1 unique emote, reset.
-                        self.reset()
-                        return True
-                else:
-                    prev_code = emote['code']
+            if len(features.emote_codes) > 1:
+                # The message contained more than 1 unique emote, reset.
+                self.reset()
+                return True
 
             emote = emotes[0]
 
@@ -71,8 +70,8 @@ class EmoteComboModule(BaseModule):
             self.inc_emote_count()
 
     def enable(self, bot):
-        HandlerManager.add_handler('on_message', self.on_message)
+        HandlerManager.add_handler('on_message_background', self.on_message)
         self.bot = bot
 
     def disable(self, bot):
-        HandlerManager.remove_handler('on_message', self.on_message)
+        HandlerManager.remove_handler('on_message_background', self.on_message)
@@ -33,7 +33,7 @@ class EmotesOnScreenModule(BaseModule):
 
     def enable(self, bot):
         self.bot = bot
-        HandlerManager.add_handler('on_message', self.on_message)
+        HandlerManager.add_handler('on_message_background', self.on_message)
 
     def disable(self, bot):
-        HandlerManager.remove_handler('on_message', self.on_message)
+        HandlerManager.remove_handler('on_message_background', self.on_message)
@@ -179,11 +179,20 @@ class HSBetModule(BaseModule):
                     else:
                         losers.append((user, points))
                         total_losing_points += points
-                        user.pay_debt(points)
+                        user.remove_debt(points)
                         db_bets[username].profit = -points
                         self.bot.whisper(user.username, 'You bet {} points on the wrong outcome, so you lost it all. :('.format(
                             points))
 
+                # Pay out (and collect) all bets in one batch
+                payouts = [(user, -points) for user, points in losers if points > 0]
+                for user, points in winners:
+                    if points > 0:
+                        pot_cut = points / total_winning_points
+                        db_bets[user.username].profit = int(pot_cut * total_losing_points)
+                        payouts.append((user, db_bets[user.username].profit))
+                self.bot.users.bulk_add_points(payouts)
+
                 for obj in losers:
                     user, points = obj
                     user.save()
@@ -200,9 +209,7 @@ class HSBetModule(BaseModule):
                         continue
 
                     pot_cut = points / total_winning_points
-                    points_reward = int(pot_cut * total_losing_points)
-                    db_bets[user.username].profit = points_reward
-                    user.points += points_reward
+                    points_reward = db_bets[user.username].profit
                     user.save()
                     HandlerManager.trigger('on_user_win_hs_bet', user, points_reward)
                     self.bot.whisper(user.username, 'You bet {} points on the right outcome, that rewards you with a profit of {} points! (Your bet was {:.2f}% of the total pool)'.format(
@@ -20,6 +20,7 @@ from pajbot.managers.db import Base
 from pajbot.managers.db import DBManager
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
+from pajbot.urls import Url
 
 log = logging.getLogger(__name__)
 
@@ -59,26 +60,6 @@ def is_same_url(x, y):
     return parsed_x.netloc == parsed_y.netloc and parsed_x.path.strip('/') == parsed_y.path.strip('/') and parsed_x.query == parsed_y.query
 
 
-def find_unique_urls(regex, message):
-    _urls = regex.finditer(message)
-    urls = []
-    for i in _urls:
-        url = i.group(0)
-        if not (url.startswith('http://') or url.startswith('https://')):
-            url = 'http://' + url
-        if not(url[-1].isalpha() or url[-1].isnumeric() or url[-1] == '/'):
-            url = url[:-1]
-        urls.append(url)
-
-    return set(urls)
-
-
-class Url:
-    def __init__(self, url):
-        self.url = url
-        self.parsed = urllib.parse.urlparse(url)
-
-
 class LinkCheckerCache:
     def __init__(self):
         self.cache = {}
@@ -240,12 +221,11 @@ class LinkCheckerModule(BaseModule):
                 if do_timeout is True:
                     # Check if the links are in our super-whitelist. i.e. on the pajlada.se domain o forsen.tv
                     for url in urls:
-                        parsed_url = Url(url)
-                        if len(parsed_url.parsed.netloc.split('.')) < 2:
+                        if len(url.parsed.netloc.split('.')) < 2:
                             continue
                         whitelisted = False
                         for whitelist in self.super_whitelist:
-                            if is_subdomain(parsed_url.parsed.netloc, whitelist):
+                            if is_subdomain(url.parsed.netloc, whitelist):
                                 whitelisted = True
                                 break
                         if whitelisted is False:
@@ -412,7 +392,8 @@ class LinkCheckerModule(BaseModule):
         return self.RET_FURTHER_ANALYSIS
 
     def simple_check(self, url, action):
-        url = Url(url)
+        if not isinstance(url, Url):
+            url = Url(url)
         if len(url.parsed.netloc.split('.')) < 2:
             # The URL is broken, ignore it
             return self.RET_FURTHER_ANALYSIS
@@ -420,7 +401,8 @@ class LinkCheckerModule(BaseModule):
         return self.basic_check(url, action)
 
     def check_url(self, url, action):
-        url = Url(url)
+        if not isinstance(url, Url):
+            url = Url(url)
         if len(url.parsed.netloc.split('.')) < 2:
             # The URL is broken, ignore it
             return
@@ -1,6 +1,5 @@
 import datetime
 import logging
-from urllib.parse import urlsplit
 
 from sqlalchemy import Column
 from sqlalchemy import DateTime
@@ -58,7 +57,7 @@ class LinkTrackerModule(BaseModule):
     def add_url(self, url):
         if self.db_session is None:
             return
-        url_data = urlsplit(url)
+        url_data = url.parsed
         if url_data.netloc[:4] == 'www.':
             netloc = url_data.netloc[4:]
         else:
@@ -1,6 +1,7 @@
 import logging
 
 from pajbot.managers.handler import HandlerManager
+from pajbot.models.message import MessageFeatures
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
 
@@ -53,8 +54,10 @@ class MaxMsgLengthModule(BaseModule):
         super().__init__()
         self.bot = None
 
-    def on_pubmsg(self, source, message):
-        if len(message) > self.settings['max_msg_length'] and source.level < self.settings['bypass_level'] and source.moderator is False:
+    def on_pubmsg(self, source, message, features=None):
+        if features is None:
+            features = MessageFeatures(message)
+        if features.length > self.settings['max_msg_length'] and source.level < self.settings['bypass_level'] and source.moderator is False:
             duration, punishment = self.bot.timeout_warn(source, self.settings['timeout_length'], reason='Message too long')
             """ We only send a notification to the user if he has spent more than
             one hour watching the stream. """
@@ -134,6 +134,8 @@ class PleblistModule(BaseModule):
 
             bot.say('{} just requested the song "{}" to be played KKona'.format(source.username_raw, song_info.title))
 
+        PleblistManager.update_queue()
+
     def pleblist_add_song(self, **options):
         message = options['message']
         bot = options['bot']
@@ -1,8 +1,7 @@
 import logging
 
-from numpy import random
-
 import pajbot.models
+from pajbot.models.participants import ParticipantSet
 from pajbot.modules.base import BaseModule
 
 log = logging.getLogger(__name__)
@@ -19,7 +18,7 @@ class PointLotteryModule(BaseModule):
         super().__init__()
 
         self.lottery_running = False
-        self.lottery_users = []
+        self.lottery_users = ParticipantSet()
         self.lottery_points = 0
 
     def load_commands(self, **options):
@@ -91,7 +90,7 @@ class PointLotteryModule(BaseModule):
             bot.say('{0}, a lottery is already running OMGScoots'.format(source.username_raw))
             return False
 
-        self.lottery_users = []
+        self.lottery_users.clear()
         self.lottery_running = True
         self.lottery_points = 0
 
@@ -112,7 +111,7 @@ class PointLotteryModule(BaseModule):
             log.debug('No lottery running')
             return False
 
-        if source in [user for user, points in self.lottery_users if user == source]:
+        if source.username in self.lottery_users:
             return False
 
         try:
@@ -137,7 +136,7 @@ class PointLotteryModule(BaseModule):
             return False
 
         # Added user to the lottery
-        self.lottery_users.append((source, tickets))
+        self.lottery_users.add(source.username, weight=tickets)
 
     def process_end(self, **options):
         bot = options['bot']
@@ -147,11 +146,11 @@ class PointLotteryModule(BaseModule):
 
         self.lottery_running = False
 
-        if not self.lottery_users:
+        if len(self.lottery_users) == 0:
             bot.me('Wow, no one joined the lottery DansGame')
             return False
 
-        winner = self.weighted_choice(self.lottery_users)
+        winner = bot.users[self.lottery_users.weighted_choice()]
 
         log.info('at end, lottery points is now at {}'.format(self.lottery_points))
 
@@ -164,7 +163,7 @@ class PointLotteryModule(BaseModule):
 
         winner.save()
 
-        self.lottery_users = []
+        self.lottery_users.clear()
 
     def process_status(self, **options):
         bot = options['bot']
@@ -174,14 +173,3 @@ class PointLotteryModule(BaseModule):
 
         bot.me('{} people have joined the lottery so far, for a total of {} points'.format(len(self.lottery_users),
                                                                                                self.lottery_points))
-
-    @staticmethod
-    def weighted_choice(choices):
-        total = sum(w for c, w in choices)
-        r = random.uniform(0, total)
-        upto = 0
-        for c, w in choices:
-            if upto + w >= r:
-                return c
-            upto += w
-        assert False, "Shouldn't get here"
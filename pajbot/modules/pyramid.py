@@ -79,12 +79,12 @@ class PyramidModule(BaseModule):
         self.going_down = False
         self.regex = re.compile(' +')
 
-    def on_pubmsg(self, source, message):
+    def on_pubmsg(self, source, message, features=None):
         if source.username == 'twitchnotify':
             return
 
         try:
-            msg_parts = message.split(' ')
+            msg_parts = features.tokens if features is not None else message.split(' ')
             if len(self.data) > 0:
                 cur_len = len(msg_parts)
                 last_len = len(self.data[-1])
@@ -40,21 +40,15 @@ class BaseQuest(BaseModule):
         reward_type = self.quest_module.settings['reward_type']
         reward_amount = self.quest_module.settings['reward_amount']
         if reward_type == 'tokens':
-            user.tokens += reward_amount
+            # Make sure the user doesn't end up with more tokens than allowed
+            user.add_tokens(reward_amount, max_tokens=self.quest_module.settings['max_tokens'])
         else:
             user.points += reward_amount
 
-        # Make sure the user doesn't have more tokens than allowed
-        if user.tokens > self.quest_module.settings['max_tokens']:
-            user.tokens = self.quest_module.settings['max_tokens']
-
         # Notify the user that they've finished today's quest
         message = 'You finished todays quest! You have been awarded with {} {}.'.format(reward_amount, reward_type)
         pajbot.managers.handler.HandlerManager.trigger('send_whisper', user.username, message)
 
-        # XXX: this can safely be removed once points are moved to redis
-        user.save()
-
     def start_quest(self):
         """ This method is triggered by either the stream starting, or the bot loading up
         while a quest/stream is already active """
@@ -4,6 +4,7 @@ from numpy import random
 
 from pajbot.managers.handler import HandlerManager
 from pajbot.managers.redis import RedisManager
+from pajbot.models.message import MessageFeatures
 from pajbot.modules import ModuleSetting
 from pajbot.modules import QuestModule
 from pajbot.modules.quests import BaseQuest
@@ -41,26 +42,27 @@ class TypeEmoteQuestModule(BaseQuest):
     def get_limit(self):
         return self.settings['quest_limit']
 
-    def on_message(self, source, message, emotes, whisper, urls, event):
-        for emote in emotes:
-            if emote['code'] == self.current_emote:
-                user_progress = self.get_user_progress(source.username, default=0) + 1
+    def on_message(self, source, message, emotes, whisper, urls, event, features=None):
+        if features is None:
+            features = MessageFeatures(message, emotes=emotes)
 
-                if user_progress > self.get_limit():
-                    log.debug('{} has already complete the quest. Moving along.'.format(source.username))
-                    # no need to do more
-                    return
+        if self.current_emote in features.emote_codes:
+            user_progress = self.get_user_progress(source.username, default=0) + 1
 
-                redis = RedisManager.get()
+            if user_progress > self.get_limit():
+                log.debug('{} has already complete the quest. Moving along.'.format(source.username))
+                # no need to do more
+                return
+
+            redis = RedisManager.get()
 
-                if user_progress == self.get_limit():
-                    self.finish_quest(redis, source)
+            if user_progress == self.get_limit():
+                self.finish_quest(redis, source)
 
-                self.set_user_progress(source.username, user_progress, redis=redis)
-                return
+            self.set_user_progress(source.username, user_progress, redis=redis)
 
     def start_quest(self):
-        HandlerManager.add_handler('on_message', self.on_message)
+        HandlerManager.add_handler('on_message_background', self.on_message)
 
         redis = RedisManager.get()
 
@@ -81,7 +83,7 @@ class TypeEmoteQuestModule(BaseQuest):
             self.current_emote = self.current_emote
 
     def stop_quest(self):
-        HandlerManager.remove_handler('on_message', self.on_message)
+        HandlerManager.remove_handler('on_message_background', self.on_message)
 
         redis = RedisManager.get()
 
@@ -65,14 +65,14 @@ class TypeMeMessageQuestModule(BaseQuest):
                 self.set_user_progress(source.username, user_progress, redis=redis)
 
     def start_quest(self):
-        HandlerManager.add_handler('on_message', self.on_message)
+        HandlerManager.add_handler('on_message_background', self.on_message)
 
         redis = RedisManager.get()
 
         self.load_progress(redis=redis)
 
     def stop_quest(self):
-        HandlerManager.remove_handler('on_message', self.on_message)
+        HandlerManager.remove_handler('on_message_background', self.on_message)
 
         redis = RedisManager.get()
 
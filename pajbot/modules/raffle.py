@@ -1,10 +1,9 @@
 import logging
 import math
 
-from numpy import random
-
 import pajbot.models
 from pajbot.managers.handler import HandlerManager
+from pajbot.models.participants import ParticipantSet
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
 from pajbot.streamhelper import StreamHelper
@@ -180,7 +179,7 @@ class RaffleModule(BaseModule):
         super().__init__()
 
         self.raffle_running = False
-        self.raffle_users = []
+        self.raffle_users = ParticipantSet()
         self.raffle_points = 0
         self.raffle_length = 0
 
@@ -247,7 +246,7 @@ class RaffleModule(BaseModule):
             bot.say('{0}, a raffle is already running OMGScoots'.format(source.username_raw))
             return False
 
-        self.raffle_users = []
+        self.raffle_users.clear()
         self.raffle_running = True
         self.raffle_points = 100
         self.raffle_length = 60
@@ -295,12 +294,8 @@ class RaffleModule(BaseModule):
         if not self.raffle_running:
             return False
 
-        for user in self.raffle_users:
-            if user == source:
-                return False
-
-        # Added user to the raffle
-        self.raffle_users.append(source)
+        # Add the user to the raffle, unless he's already in it
+        self.raffle_users.add(source.username)
 
     def end_raffle(self):
         if not self.raffle_running:
@@ -312,9 +307,9 @@ class RaffleModule(BaseModule):
             self.bot.me('Wow, no one joined the raffle DansGame')
             return False
 
-        winner = random.choice(self.raffle_users)
+        winner = self.bot.users[self.raffle_users.choice()]
 
-        self.raffle_users = []
+        self.raffle_users.clear()
 
         if self.settings['show_on_clr']:
             self.bot.websocket_manager.emit('notification', {'message': '{} won {} points in the raffle!'.format(winner.username_raw, self.raffle_points)})
@@ -330,7 +325,7 @@ class RaffleModule(BaseModule):
         if self.raffle_running:
             return False
 
-        self.raffle_users = []
+        self.raffle_users.clear()
         self.raffle_running = True
         self.raffle_points = points
         self.raffle_length = length
@@ -396,9 +391,6 @@ class RaffleModule(BaseModule):
             self.bot.me('Wow, no one joined the raffle DansGame')
             return False
 
-        # Shuffle the list of participants
-        random.shuffle(self.raffle_users)
-
         num_participants = len(self.raffle_users)
 
         abs_points = abs(self.raffle_points)
@@ -425,17 +417,18 @@ class RaffleModule(BaseModule):
                 break
 
         log.info('k done. got {} winners'.format(num_winners))
-        winners = self.raffle_users[:num_winners]
-        self.raffle_users = []
+        winners = self.bot.users.bulk_get_users(self.raffle_users.sample(num_winners))
+        self.raffle_users.clear()
 
         if negative:
             points_per_user *= -1
 
         self.bot.me('The multi-raffle has finished! {0} users won {1} points each! PogChamp'.format(len(winners), points_per_user))
 
+        self.bot.users.bulk_add_points([(winner, points_per_user) for winner in winners])
+
         winners_arr = []
         for winner in winners:
-            winner.points += points_per_user
             winners_arr.append(winner)
 
             winners_str = generate_winner_list(winners_arr)
@@ -443,8 +436,6 @@ class RaffleModule(BaseModule):
                 self.bot.me('{} won {} points each!'.format(winners_str, points_per_user))
                 winners_arr = []
 
-            winner.save()
-
         if len(winners_arr) > 0:
             winners_str = generate_winner_list(winners_arr)
             self.bot.me('{} won {} points each!'.format(winners_str, points_per_user))
@@ -9,6 +9,7 @@ import pajbot.utils
 from pajbot.managers.db import DBManager
 from pajbot.managers.handler import HandlerManager
 from pajbot.models.roulette import Roulette
+from pajbot.models.roulette import UserRouletteStats
 from pajbot.modules import BaseModule
 from pajbot.modules import ModuleSetting
 
@@ -195,6 +196,12 @@ class RouletteModule(BaseModule):
             r = Roulette(user.id, points)
             db_session.add(r)
 
+            user_roulette_stats = db_session.query(UserRouletteStats).get(user.id)
+            if user_roulette_stats is None:
+                user_roulette_stats = UserRouletteStats(user.id)
+                db_session.add(user_roulette_stats)
+            user_roulette_stats.add_roulette(points, created_at=r.created_at)
+
         arguments = {
             'bet': bet,
             'user': user.username_raw,
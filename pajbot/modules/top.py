@@ -2,6 +2,7 @@ import logging
 
 import pajbot.models
 from pajbot.managers.db import DBManager
+from pajbot.managers.leaderboard import LeaderboardManager
 from pajbot.managers.redis import RedisManager
 from pajbot.models.user import User
 from pajbot.modules import BaseModule
@@ -81,11 +82,10 @@ class TopModule(BaseModule):
         bot = options['bot']
 
         data = []
-        with DBManager.create_session_scope() as db_session:
-            for user in db_session.query(User).order_by(User.minutes_in_chat_online.desc())[:self.settings['num_top']]:
-                data.append('{user.username_raw} ({time_spent})'.format(
-                    user=user,
-                    time_spent=time_since(user.minutes_in_chat_online * 60, 0, format='short')))
+        for username_raw, minutes in LeaderboardManager.get_top_users('minutes_in_chat_online', self.settings['num_top']):
+            data.append('{username_raw} ({time_spent})'.format(
+                username_raw=username_raw,
+                time_spent=time_since(minutes * 60, 0, format='short')))
 
         bot.say('Top {num_top} watchers: {data}'.format(
             num_top=self.settings['num_top'],
@@ -95,11 +95,10 @@ class TopModule(BaseModule):
         bot = options['bot']
 
         data = []
-        with DBManager.create_session_scope() as db_session:
-            for user in db_session.query(User).order_by(User.minutes_in_chat_offline.desc())[:self.settings['num_top']]:
-                data.append('{user.username_raw} ({time_spent})'.format(
-                    user=user,
-                    time_spent=time_since(user.minutes_in_chat_offline * 60, 0, format='short')))
+        for username_raw, minutes in LeaderboardManager.get_top_users('minutes_in_chat_offline', self.settings['num_top']):
+            data.append('{username_raw} ({time_spent})'.format(
+                username_raw=username_raw,
+                time_spent=time_since(minutes * 60, 0, format='short')))
 
         bot.say('Top {num_top} offliners: {data}'.format(
             num_top=self.settings['num_top'],
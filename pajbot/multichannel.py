@@ -0,0 +1,274 @@
+"""
+Serve several channels from one bot process.
+
+The config file has the bot account in the [main] section, and the config file of every channel
+in the [channels] section:
+
+    [main]
+    nickname = pajbot
+    password = oauth:abc
+
+    [channels]
+    pajlada = configs/pajlada.ini
+    forsen = configs/forsen.ini
+
+Every channel config is a normal pajbot config (its nickname and password are replaced with the ones above).
+Each channel keeps its own database, modules, commands, handlers, users and redis keys
+(which are prefixed with the streamer name), see ChannelManager.
+
+Shared by all channels:
+    - The IRC reactor and chat connections, which join every channel
+    - The whisper connections. Whispers are handled by the first channel, and extra
+      whisper accounts are read from its database
+    - The scheduler, the redis connection and the HTTP session of APIBase
+    - The BTTV and Twitch emote index
+    - The metrics, see the [metrics] section. The [metrics] section of the channel configs is ignored
+
+The timezone is per process, and only one channel can have the websocket enabled.
+"""
+
+import collections
+import logging
+import sys
+
+import irc.client
+
+from pajbot.apiwrappers import APIBase
+from pajbot.apiwrappers import TwitchAPI
+from pajbot.bot import Bot
+from pajbot.managers.channel import Channel
+from pajbot.managers.channel import ChannelManager
+from pajbot.managers.irc import IRCManager
+from pajbot.managers.irc import MultiIRCManager
+from pajbot.managers.metrics import MetricsManager
+from pajbot.managers.schedule import ScheduleManager
+from pajbot.utils import load_config
+
+log = logging.getLogger(__name__)
+
+
+class ChannelIRCManager(IRCManager):
+    """ Sends everything through the connections of the MultiChannelBot """
+
+    def __init__(self, bot, host):
+        super().__init__(bot)
+        self.host = host
+
+    def start(self):
+        pass
+
+    def whisper(self, username, message):
+        if self.host.irc is None:
+            log.warning('Tried to whisper {} before the connections were set up'.format(username))
+            return
+
+        return self.host.irc.whisper(username, message)
+
+    def privmsg(self, message, channel, increase_message=True):
+        if self.host.irc is None:
+            log.warning('Tried to send a message to {} before the connections were set up'.format(channel))
+            return
+
+        return self.host.irc.privmsg(message, channel, increase_message=increase_message)
+
+    def on_disconnect(self, chatconn, event):
+        pass
+
+    def add_dispatcher(self, reactor):
+        # The MultiChannelBot dispatches the events of every channel
+        pass
+
+
+class ChannelBot(Bot):
+    """ The bot of one channel in a MultiChannelBot. Must be created inside of its channel context """
+
+    def __init__(self, host, channel, config, args=None):
+        self.host = host
+        self.channel_context = channel
+        channel.bot = self
+
+        super().__init__(config, args)
+
+    def create_reactor(self):
+        return self.host.reactor
+
+    def create_irc_manager(self):
+        return ChannelIRCManager(self, self.host)
+
+    def connect(self):
+        pass
+
+    def init_metrics(self):
+        # The MultiChannelBot collects the metrics of every channel, and runs the metrics server
+        pass
+
+    def quit_bot(self, **options):
+        self.host.quit_bot()
+
+
+class MultiChannelBot:
+    """ Runs a ChannelBot for every channel in the [channels] section of the config """
+
+    version = Bot.version
+
+    def __init__(self, config, args=None):
+        self.config = config
+        self.args = args
+
+        self.nickname = config['main'].get('nickname', 'pajbot')
+        self.password = config['main'].get('password', 'abcdef')
+
+        self.reactor = irc.client.Reactor(self.on_connect)
+        ScheduleManager.init()
+
+        twitch_client_id = None
+        twitch_oauth = None
+        if 'twitchapi' in self.config:
+            twitch_client_id = self.config['twitchapi'].get('client_id', None)
+            twitch_oauth = self.config['twitchapi'].get('oauth', None)
+        self.twitchapi = TwitchAPI(twitch_client_id, twitch_oauth)
+
+        # '#channel' -> ChannelBot
+        self.bots = collections.OrderedDict()
+        self.irc = None
+
+        for channel_config in self.load_channel_configs():
+            self.add_channel(channel_config)
+
+        if len(self.bots) == 0:
+            raise ValueError('No channels found in the [channels] section')
+
+        # The chat connections use the first channel for their server lookups,
+        # and the whisper accounts are read from its database
+        main_bot = self.get_main_bot()
+        self.streamer = main_bot.streamer
+        with ChannelManager.context(main_bot.channel_context):
+            self.irc = self.create_irc_manager()
+        self.irc.add_dispatcher(self.reactor)
+        for channel in self.bots:
+            self.irc.add_channel(channel)
+
+        MetricsManager.add_collector('bot', self.collect_metrics)
+        MetricsManager.add_collector('api', APIBase.collect_metrics)
+        if 'metrics' in self.config and 'port' in self.config['metrics']:
+            try:
+                MetricsManager.start_http_server(int(self.config['metrics']['port']), host=self.config['metrics'].get('host', '127.0.0.1'))
+            except:
+                log.exception('Unable to start the metrics server')
+
+    def load_channel_configs(self):
+        """ Returns the config of every channel in the [channels] section """
+        configs = []
+        for streamer, config_path in self.config._sections['channels'].items():
+            log.info('Loading channel {} from {}'.format(streamer, config_path))
+            configs.append(load_config(config_path))
+        return configs
+
+    def create_channel_bot(self, channel, config):
+        return ChannelBot(self, channel, config, self.args)
+
+    def create_irc_manager(self):
+        return MultiIRCManager(self)
+
+    def add_channel(self, config):
+        """ Start serving the channel with the given config """
+        config['main']['nickname'] = self.nickname
+        config['main']['password'] = self.password
+
+        if 'streamer' in config['main']:
+            streamer = config['main']['streamer']
+        else:
+            streamer = config['main']['target'][1:]
+
+        channel = Channel(streamer)
+        with ChannelManager.context(channel):
+            bot = self.create_channel_bot(channel, config)
+
+        self.bots[bot.channel] = bot
+        if self.irc is not None:
+            self.irc.add_channel(bot.channel)
+
+        return bot
+
+    def get_main_bot(self):
+        return next(iter(self.bots.values()))
+
+    def collect_metrics(self):
+        """ Metrics collector for MetricsManager, the metrics of every ChannelBot (and its websocket) with a channel label """
+        metrics = collections.OrderedDict()
+        for bot in self.bots.values():
+            with ChannelManager.context(bot.channel_context):
+                collected = bot.collect_metrics()
+                if bot.websocket_manager.server is not None:
+                    collected += bot.websocket_manager.collect_metrics()
+
+            for name, metric_type, documentation, samples in collected:
+                if name not in metrics:
+                    metrics[name] = (name, metric_type, documentation, [])
+                for labels, value in samples:
+                    metrics[name][3].append((dict(labels, channel=bot.streamer), value))
+
+        return list(metrics.values())
+
+    def dispatch(self, method_name, chatconn, event, bot=None):
+        if bot is None:
+            bot = self.bots.get(event.target, None)
+            if bot is None:
+                return
+
+        with ChannelManager.context(bot.channel_context):
+            return getattr(bot, method_name)(chatconn, event)
+
+    def on_connect(self, sock):
+        return self.irc.on_connect(sock)
+
+    def on_disconnect(self, chatconn, event):
+        self.irc.on_disconnect(chatconn, event)
+
+    def on_pubmsg(self, chatconn, event):
+        return self.dispatch('on_pubmsg', chatconn, event)
+
+    def on_action(self, chatconn, event):
+        return self.dispatch('on_action', chatconn, event)
+
+    def on_usernotice(self, chatconn, event):
+        return self.dispatch('on_usernotice', chatconn, event)
+
+    def on_whisper(self, chatconn, event):
+        # Whispers aren't sent to a channel
+        return self.dispatch('on_whisper', chatconn, event, bot=self.get_main_bot())
+
+    def execute_delayed(self, delay, function, arguments=()):
+        self.reactor.execute_delayed(delay, function, arguments)
+
+    def execute_every(self, period, function, arguments=()):
+        self.reactor.execute_every(period, function, arguments)
+
+    def say(self, *messages, separator='. '):
+        """ Say the same thing in every channel """
+        for bot in self.bots.values():
+            with ChannelManager.context(bot.channel_context):
+                bot.say(*messages, separator=separator)
+
+    def connect(self):
+        return self.irc.start()
+
+    def start(self):
+        self.reactor.process_forever()
+
+    def quit_bot(self, **options):
+        for bot in self.bots.values():
+            with ChannelManager.context(bot.channel_context):
+                try:
+                    bot.shutdown()
+                except:
+                    log.exception('Unhandled exception while shutting down {}'.format(bot.streamer))
+
+        try:
+            ScheduleManager.base_scheduler.shutdown(wait=False)
+        except:
+            log.exception('Error while shutting down the apscheduler')
+
+        self.irc.quit()
+
+        sys.exit(0)
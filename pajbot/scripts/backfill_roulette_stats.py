@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Rebuild tb_user_roulette_stats from every roulette in tb_roulette.
+
+Usage: python3 -m pajbot.scripts.backfill_roulette_stats [--config config.ini]
+
+Meant to be run once after upgrading, preferably while the bot is not running.
+Running it again is safe, all stats are recomputed from scratch.
+"""
+
+import argparse
+import logging
+
+from pajbot.managers.db import DBManager
+from pajbot.models.roulette import Roulette
+from pajbot.models.roulette import UserRouletteStats
+from pajbot.utils import init_logging
+from pajbot.utils import load_config
+
+log = logging.getLogger('pajbot')
+
+
+def backfill(batch_size=1000):
+    """ Returns how many users had their stats rebuilt """
+    num_users = 0
+
+    with DBManager.create_session_scope() as db_session:
+        db_session.query(UserRouletteStats).delete(synchronize_session=False)
+
+        user_roulette_stats = None
+        query = db_session.query(Roulette.user_id, Roulette.points, Roulette.created_at).\
+                order_by(Roulette.user_id, Roulette.id).yield_per(batch_size)
+
+        for user_id, points, created_at in query:
+            if user_roulette_stats is None or user_roulette_stats.user_id != user_id:
+                user_roulette_stats = UserRouletteStats(user_id)
+                db_session.add(user_roulette_stats)
+                num_users += 1
+
+                if num_users % batch_size == 0:
+                    db_session.flush()
+                    log.info('Backfilled roulette stats for {} users...'.format(num_users))
+
+            user_roulette_stats.add_roulette(points, created_at=created_at)
+
+    return num_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rebuild the roulette stats of every user')
+    parser.add_argument('--config', '-c', default='config.ini')
+    args = parser.parse_args()
+
+    init_logging('pajbot')
+
+    config = load_config(args.config)
+
+    DBManager.init(config['main']['db'])
+
+    log.info('Backfilled roulette stats for {} users'.format(backfill()))
+
+
+if __name__ == '__main__':
+    main()
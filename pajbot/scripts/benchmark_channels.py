@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Measure what every extra channel costs a MultiChannelBot, in memory and in CPU time.
+
+Usage: python3 -m pajbot.scripts.benchmark_channels chat.log [--channels 1,2,5,10] [--modules all]
+
+Channels are added one step at a time (pajlada0, pajlada1, ...), each with the same settings as
+pajbot.scripts.replay uses. After every step we report the RSS of the process, and replay the log
+in every channel (with the messages retargeted to it) to see the CPU time spent per event.
+
+The last line compares the RSS with running the same number of channels as separate processes,
+where every process costs about as much as the first channel did.
+"""
+
+import argparse
+import copy
+import logging
+import os
+import resource
+import time
+
+from pajbot.managers.channel import ChannelManager
+from pajbot.multichannel import ChannelBot
+from pajbot.multichannel import MultiChannelBot
+from pajbot.scripts.replay import CaptureIRCManager
+from pajbot.scripts.replay import get_config
+from pajbot.scripts.replay import replay
+from pajbot.scripts.replay import ReplayBot
+from pajbot.tmi import parse_line
+from pajbot.utils import init_logging
+
+log = logging.getLogger('pajbot')
+
+
+def get_rss_mb():
+    """ The current RSS of the process, or the peak RSS if /proc isn't available """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ReplayChannelBot(ReplayBot, ChannelBot):
+    pass
+
+
+class ReplayMultiChannelBot(MultiChannelBot):
+    streamer_name = 'pajlada'
+
+    def load_channel_configs(self):
+        return [get_config(None, '{}0'.format(self.streamer_name))]
+
+    def create_channel_bot(self, channel, config):
+        return ReplayChannelBot(self, channel, config, self.args)
+
+    def create_irc_manager(self):
+        return CaptureIRCManager(self)
+
+
+def retarget(events, channel):
+    retargeted = []
+    for irc_event in events:
+        if irc_event.type != 'whisper':
+            irc_event = copy.copy(irc_event)
+            irc_event.target = channel
+        retargeted.append(irc_event)
+    return retargeted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='measure the memory and CPU cost of every channel in a MultiChannelBot')
+    parser.add_argument('log', help='File with raw IRC lines')
+    parser.add_argument('--channels', default='1,2,5,10', help='Comma-separated list of channel counts to measure')
+    parser.add_argument('--streamer', default='pajlada', help='Prefix of the streamer names')
+    parser.add_argument('--modules', default='', help='Comma-separated list of module IDs to enable, or "all"')
+    parser.add_argument('--silent', action='count', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    init_logging('pajbot')
+    logging.getLogger('pajbot').setLevel(logging.WARNING)
+
+    with open(args.log, 'r', encoding='utf-8') as log_file:
+        events = [parse_line(line.rstrip('\r\n')) for line in log_file if len(line.strip()) > 0]
+    events = [irc_event for irc_event in events if irc_event is not None]
+
+    steps = sorted(int(num_channels) for num_channels in args.channels.split(',') if len(num_channels.strip()) > 0)
+
+    ReplayBot.enabled_modules = [module_id.strip() for module_id in args.modules.split(',') if len(module_id.strip()) > 0]
+    ReplayMultiChannelBot.streamer_name = args.streamer
+
+    base_rss = get_rss_mb()
+    host = ReplayMultiChannelBot(get_config(None, '{}0'.format(args.streamer)), args)
+    first_channel_rss = get_rss_mb() - base_rss
+
+    print('{0:>8} {1:>10} {2:>14} {3:>16} {4:>10}'.format('channels', 'RSS (MB)', 'MB/channel', 'CPU ms/1k events', 'events/s'))
+    previous_rss = base_rss
+    previous_channels = 0
+    rss = base_rss
+    for num_channels in steps:
+        while len(host.bots) < num_channels:
+            host.add_channel(get_config(None, '{}{}'.format(args.streamer, len(host.bots))))
+        rss = get_rss_mb()
+
+        num_events = 0
+        start_cpu_time = time.process_time()
+        start_time = time.perf_counter()
+        for bot in host.bots.values():
+            with ChannelManager.context(bot.channel_context):
+                num_events += len(replay(bot, retarget(events, bot.channel)))
+        cpu_time = time.process_time() - start_cpu_time
+        total_time = time.perf_counter() - start_time
+
+        print('{0:>8} {1:>10.1f} {2:>14.2f} {3:>16.1f} {4:>10.1f}'.format(
+            num_channels,
+            rss,
+            (rss - previous_rss) / max(num_channels - previous_channels, 1),
+            cpu_time * 1000 * 1000 / max(num_events, 1),
+            num_events / total_time if total_time > 0 else 0.0))
+
+        previous_rss = rss
+        previous_channels = num_channels
+
+    if len(steps) > 0:
+        print('{0} channels in one process: {1:.1f}MB, as {0} separate processes: about {2:.1f}MB'.format(
+            len(host.bots), rss, len(host.bots) * (base_rss + first_channel_rss)))
+
+
+if __name__ == '__main__':
+    main()
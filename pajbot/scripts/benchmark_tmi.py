@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Compare how fast raw TMI lines are turned into events by irc.client and by pajbot.tmi.
+
+Usage: python3 -m pajbot.scripts.benchmark_tmi [chat.log] [--repeat 20]
+
+The lines are taken from a chat log in the format pajbot.scripts.replay reads,
+or from a built-in sample if no log is given.
+Both sides go through ServerConnection._process_line, and then read the tags
+Bot.parse_message reads, the same way the bot did before and after pajbot.tmi.
+"""
+
+import argparse
+import time
+
+import irc.client
+
+from pajbot.managers.connection import CustomServerConnection
+
+SAMPLE_LINES = [
+        '@badges=subscriber/12,turbo/1;color=#FF0000;display-name=Foo;emotes=25:0-4,12-16/1902:6-10;id=b34ccfc7-4977-403a-8a94-33c6bac34fb8;mod=0;room-id=1337;subscriber=1;tmi-sent-ts=1507246572675;turbo=1;user-id=1337;user-type= :foo!foo@foo.tmi.twitch.tv PRIVMSG #pajlada :Kappa Keepo Kappa',
+        '@badges=;color=;display-name=Bar;emotes=;id=3d9540a0-04b6-4bea-baf9-9165b14160be;mod=0;room-id=1337;subscriber=0;tmi-sent-ts=1507246572675;turbo=0;user-id=1338;user-type= :bar!bar@bar.tmi.twitch.tv PRIVMSG #pajlada :hello everyone how is the stream going today',
+        '@badges=moderator/1;color=#00FF7F;display-name=Baz;emotes=;id=9a1e9a3e-8d1a-4b4e-bb1c-6ad2b0bdb5a5;mod=1;room-id=1337;subscriber=0;tmi-sent-ts=1507246572675;turbo=0;user-id=1339;user-type=mod :baz!baz@baz.tmi.twitch.tv PRIVMSG #pajlada :!points',
+        '@badges=;color=;display-name=Foo;emotes=;message-id=1;thread-id=1337_1338;turbo=0;user-id=1337;user-type= :foo!foo@foo.tmi.twitch.tv WHISPER pajbot :!points',
+        '@badges=subscriber/0;color=;display-name=Foo;emotes=;id=1;login=foo;mod=0;msg-id=resub;msg-param-months=6;room-id=1337;subscriber=1;system-msg=Foo\\shas\\ssubscribed\\sfor\\s6\\smonths!;tmi-sent-ts=1507246572675;turbo=0;user-id=1337;user-type= :tmi.twitch.tv USERNOTICE #pajlada :Great stream -- keep it up!',
+        ]
+
+
+class CaptureMixin:
+    """ Keeps the events instead of dispatching them to the reactor """
+
+    def _handle_event(self, event):
+        self.events.append(event)
+
+
+class CaptureServerConnection(CaptureMixin, irc.client.ServerConnection):
+    pass
+
+
+class CaptureCustomServerConnection(CaptureMixin, CustomServerConnection):
+    pass
+
+
+def read_tags_list(event):
+    """ How Bot.parse_message read the tags of irc.client events """
+    tags = {}
+    for tag in event.tags or []:
+        if tag['key'] == 'subscriber':
+            tags['subscriber'] = tag['value'] == '1'
+        elif tag['key'] == 'emotes' and tag['value']:
+            tags['emotes'] = tag['value'].split('/')
+        elif tag['key'] == 'display-name' and tag['value']:
+            tags['display-name'] = tag['value']
+        elif tag['key'] == 'user-type':
+            tags['user-type'] = tag['value']
+    return tags
+
+
+def read_tags(event):
+    """ How Bot.parse_message reads the tags of pajbot.tmi events """
+    tags = event.tags
+    return {
+            'subscriber': tags.get('subscriber') == '1',
+            'emotes': tags.emotes,
+            'display-name': tags.get('display-name'),
+            'user-type': tags.get('user-type'),
+            }
+
+
+def benchmark(connection_class, read, lines, repeat):
+    connection = connection_class(irc.client.Reactor())
+    connection.real_server_name = 'tmi.twitch.tv'
+    connection.events = []
+
+    start_time = time.perf_counter()
+    for i in range(0, repeat):
+        for line in lines:
+            connection._process_line(line)
+        for event in connection.events:
+            if event.type != 'all_raw_messages':
+                read(event)
+        connection.events = []
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark TMI line parsing against irc.client')
+    parser.add_argument('log', nargs='?', default=None, help='File with raw IRC lines')
+    parser.add_argument('--repeat', type=int, default=20, help='How many times to go through the lines')
+    args = parser.parse_args()
+
+    if args.log is None:
+        lines = SAMPLE_LINES * 200
+    else:
+        with open(args.log, 'r', encoding='utf-8') as log_file:
+            lines = [line.rstrip('\r\n') for line in log_file if len(line.strip()) > 0]
+
+    num_lines = len(lines) * args.repeat
+    for name, connection_class, read in (('irc.client', CaptureServerConnection, read_tags_list), ('pajbot.tmi', CaptureCustomServerConnection, read_tags)):
+        total_time = benchmark(connection_class, read, lines, args.repeat)
+        print('{0:>10}: {1:.3f}s, {2:,.0f} lines/s'.format(name, total_time, num_lines / total_time))
+
+
+if __name__ == '__main__':
+    main()
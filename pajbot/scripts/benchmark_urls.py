@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compare the speed of pajbot.urls.find_urls with the regex the bot used to find URLs with.
+
+Usage: python3 -m pajbot.scripts.benchmark_urls [chat.log] [--repeat 20]
+
+The messages are taken from a chat log in the format pajbot.scripts.replay reads,
+or from a built-in sample if no log is given.
+Messages where the two disagree are printed with --show-differences.
+"""
+
+import argparse
+import re
+import time
+
+from pajbot.tmi import parse_line
+from pajbot.urls import find_unique_urls
+
+LEGACY_URL_REGEX = re.compile(r'\(?(?:(http|https):\/\/)?(?:((?:[^\W\s]|\.|-|[:]{1})+)@{1})?((?:www.)?(?:[^\W\s]|\.|-)+[\.][^\W\s]{2,4}|localhost(?=\/)|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(\d*))?([\/]?[^\s\?]*[\/]{1})*(?:\/?([^\s\n\?\[\]\{\}\#]*(?:(?=\.)){1}|[^\s\n\?\[\]\{\}\.\#]*)?([\.]{1}[^\s\?\#]*)?)?(?:\?{1}([^\s\n\#\[\]]*))?([\#][^\s\n]*)?\)?', re.IGNORECASE)
+
+SAMPLE_MESSAGES = [
+        'Kappa',
+        'PogChamp PogChamp PogChamp',
+        'hello everyone how is the stream going today',
+        '!points',
+        'LUL he actually did it',
+        'this is a pretty long message without any links in it, but with a comma and some words FeelsGoodMan',
+        'what version is this? 1.5 or 2.0',
+        'wait... what',
+        'check out pajlada.se',
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ is a good song',
+        'clips.twitch.tv/SomeClipName',
+        'gachiGASM gachiGASM gachiGASM gachiGASM',
+        ]
+
+
+def legacy_find_unique_urls(message):
+    urls = []
+    for match in LEGACY_URL_REGEX.finditer(message):
+        url = match.group(0)
+        if not (url.startswith('http://') or url.startswith('https://')):
+            url = 'http://' + url
+        if not(url[-1].isalpha() or url[-1].isnumeric() or url[-1] == '/'):
+            url = url[:-1]
+        urls.append(url)
+
+    return set(urls)
+
+
+def benchmark(f, messages, repeat):
+    start_time = time.perf_counter()
+    for i in range(0, repeat):
+        for message in messages:
+            f(message)
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark URL extraction against the old URL regex')
+    parser.add_argument('log', nargs='?', default=None, help='File with raw IRC lines')
+    parser.add_argument('--repeat', type=int, default=20, help='How many times to go through the messages')
+    parser.add_argument('--show-differences', action='store_true', help='Print the messages where the results differ')
+    args = parser.parse_args()
+
+    if args.log is None:
+        messages = SAMPLE_MESSAGES * 100
+    else:
+        with open(args.log, 'r', encoding='utf-8') as log_file:
+            events = [parse_line(line.rstrip('\r\n')) for line in log_file if len(line.strip()) > 0]
+        messages = [event.arguments[0] for event in events if event is not None and len(event.arguments) > 0]
+
+    num_messages = len(messages) * args.repeat
+    for name, f in (('regex', legacy_find_unique_urls), ('find_urls', find_unique_urls)):
+        total_time = benchmark(f, messages, args.repeat)
+        print('{0:>10}: {1:.3f}s, {2:,.0f} messages/s'.format(name, total_time, num_messages / total_time))
+
+    if args.show_differences:
+        for message in sorted(set(messages)):
+            legacy_urls = legacy_find_unique_urls(message)
+            urls = find_unique_urls(message)
+            if legacy_urls != urls:
+                print('{0!r}: regex={1} find_urls={2}'.format(message, sorted(legacy_urls), sorted(urls)))
+
+
+if __name__ == '__main__':
+    main()
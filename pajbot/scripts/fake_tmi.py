@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the Twitch chat servers (TMI), for testing and benchmarking
+the connection managers without connecting to Twitch.
+
+Usage: python3 -m pajbot.scripts.fake_tmi [--port 6667] [--rate-limit 20] [--latency 0.05] [--disconnect-every 60]
+
+Point the bot at it by setting irc_server = 127.0.0.1:6667 in the [main] section of the config.
+
+The server speaks enough of the Twitch dialect for the bot:
+ - CAP REQ for twitch.tv/tags, twitch.tv/commands and twitch.tv/membership
+ - JOIN, with ROOMSTATE/USERSTATE and membership replies depending on the requested capabilities
+ - PRIVMSG with IRCv3 tags, relayed to everyone else in the channel
+ - /w whispers, delivered as WHISPER to the target if it's connected
+ - PING/PONG
+Messages and whispers are rate limited per connection. Anything over the limit is dropped
+with a msg_ratelimit NOTICE, or the connection is closed with --rate-limit-disconnect.
+Connections can be forcibly closed at an interval to test reconnecting, and every
+incoming line can be delayed to simulate latency.
+
+Every 10 seconds the server prints how many messages it received, how many were dropped,
+and how long clients took to reconnect after being disconnected.
+"""
+
+import argparse
+import collections
+import logging
+import socketserver
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+SERVER_NAME = 'tmi.twitch.tv'
+
+TAG_ESCAPES = {
+        '\\': '\\\\',
+        ';': '\\:',
+        ' ': '\\s',
+        '\r': '\\r',
+        '\n': '\\n',
+        }
+
+
+def escape_tag_value(value):
+    return ''.join(TAG_ESCAPES.get(char, char) for char in str(value))
+
+
+def format_tags(tags):
+    return '@' + ';'.join('{}={}'.format(key, escape_tag_value(value)) for key, value in tags.items())
+
+
+class RateLimiter:
+    """ Allows `limit` events per `interval` seconds, using a sliding window """
+
+    def __init__(self, limit, interval):
+        self.limit = limit
+        self.interval = interval
+        self.timestamps = collections.deque()
+
+    def allow(self):
+        if self.limit <= 0:
+            return True
+
+        now = time.time()
+        while len(self.timestamps) > 0 and self.timestamps[0] <= now - self.interval:
+            self.timestamps.popleft()
+
+        if len(self.timestamps) >= self.limit:
+            return False
+
+        self.timestamps.append(now)
+        return True
+
+
+class FakeTMIClient(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+
+        self.nickname = None
+        self.capabilities = set()
+        self.channels = set()
+        self.write_lock = threading.Lock()
+        self.message_limiter = RateLimiter(self.server.rate_limit, self.server.rate_limit_interval)
+        self.whisper_limiter = RateLimiter(self.server.whisper_rate_limit, self.server.rate_limit_interval)
+        self.closed = False
+
+        self.server.add_client(self)
+
+    def finish(self):
+        self.server.remove_client(self)
+        with self.write_lock:
+            # Other clients might still be sending to this one
+            self.closed = True
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def send_line(self, line):
+        with self.write_lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(line.encode('utf-8') + b'\r\n')
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def send_numeric(self, numeric, message):
+        self.send_line(':{} {} {} :{}'.format(SERVER_NAME, numeric, self.nickname, message))
+
+    def disconnect(self):
+        """ Close the connection from the server side """
+        with self.write_lock:
+            self.closed = True
+        try:
+            self.request.shutdown(2)
+        except OSError:
+            pass
+
+    def handle(self):
+        try:
+            for raw_line in self.rfile:
+                if self.closed:
+                    break
+
+                if self.server.latency > 0:
+                    time.sleep(self.server.latency)
+
+                line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if len(line) == 0:
+                    continue
+
+                command, arguments = self.parse(line)
+                handler = getattr(self, 'on_' + command.lower(), None)
+                if handler is not None:
+                    handler(arguments)
+        except OSError:
+            # The client reset the connection
+            pass
+
+    def parse(self, line):
+        trailing = None
+        if ' :' in line:
+            line, trailing = line.split(' :', 1)
+        arguments = line.split()
+        if trailing is not None:
+            arguments.append(trailing)
+        return arguments[0], arguments[1:]
+
+    def has_capability(self, capability):
+        return 'twitch.tv/' + capability in self.capabilities
+
+    def on_cap(self, arguments):
+        if len(arguments) < 2 or arguments[0] != 'REQ':
+            return
+
+        requested = arguments[1].split()
+        for capability in requested:
+            self.capabilities.add(capability)
+        self.send_line(':{} CAP * ACK :{}'.format(SERVER_NAME, ' '.join(requested)))
+
+    def on_pass(self, arguments):
+        pass
+
+    def on_user(self, arguments):
+        pass
+
+    def on_nick(self, arguments):
+        if len(arguments) == 0:
+            return
+
+        self.nickname = arguments[0].lower()
+        self.send_numeric('001', 'Welcome, GLHF!')
+        self.send_numeric('002', 'Your host is {}'.format(SERVER_NAME))
+        self.send_numeric('003', 'This server is rather new')
+        self.send_numeric('004', '-')
+        self.send_numeric('375', '-')
+        self.send_numeric('372', 'You are in a maze of twisty passages, all alike.')
+        self.send_numeric('376', '>')
+
+        self.server.on_login(self)
+
+    def on_ping(self, arguments):
+        self.send_line(':{} PONG {} :{}'.format(SERVER_NAME, SERVER_NAME, arguments[0] if len(arguments) > 0 else SERVER_NAME))
+
+    def on_join(self, arguments):
+        if len(arguments) == 0:
+            return
+
+        for channel in arguments[0].split(','):
+            self.channels.add(channel)
+
+            if self.has_capability('membership'):
+                self.send_line(':{0}!{0}@{0}.{1} JOIN {2}'.format(self.nickname, SERVER_NAME, channel))
+                self.send_line(':{0}.{1} 353 {0} = {2} :{0}'.format(self.nickname, SERVER_NAME, channel))
+                self.send_line(':{0}.{1} 366 {0} {2} :End of /NAMES list'.format(self.nickname, SERVER_NAME, channel))
+
+            if self.has_capability('commands'):
+                prefix = ''
+                if self.has_capability('tags'):
+                    prefix = format_tags({'display-name': self.nickname, 'emote-sets': '0', 'mod': 0, 'subscriber': 0, 'user-type': ''}) + ' '
+                self.send_line('{}:{} USERSTATE {}'.format(prefix, SERVER_NAME, channel))
+                self.server.send_roomstate(channel, client=self)
+
+    def on_part(self, arguments):
+        if len(arguments) > 0:
+            self.channels.discard(arguments[0])
+
+    def on_privmsg(self, arguments):
+        if len(arguments) < 2:
+            return
+
+        channel, message = arguments[0], arguments[1]
+
+        if message.startswith(('/w ', '.w ')):
+            if not self.whisper_limiter.allow():
+                self.server.on_rate_limited(self, channel)
+                return
+
+            parts = message.split(' ', 2)
+            if len(parts) == 3:
+                self.server.send_whisper(self.nickname, parts[1], parts[2])
+            return
+
+        if not self.message_limiter.allow():
+            self.server.on_rate_limited(self, channel)
+            return
+
+        self.server.send_privmsg(channel, self.nickname, message, sender=self)
+
+
+class FakeTMIServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Run it in a thread with serve_forever(), and stop it with shutdown() and server_close().
+
+    Arguments:
+    rate_limit - How many messages each connection may send per rate_limit_interval. 0 means no limit
+    whisper_rate_limit - How many whispers each connection may send per rate_limit_interval
+    rate_limit_disconnect - Disconnect clients that go over the limit, instead of dropping the message
+    latency - Seconds to wait before handling each incoming line
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), rate_limit=20, whisper_rate_limit=100, rate_limit_interval=30,
+            rate_limit_disconnect=False, latency=0.0):
+        super().__init__(address, FakeTMIClient)
+
+        self.rate_limit = rate_limit
+        self.whisper_rate_limit = whisper_rate_limit
+        self.rate_limit_interval = rate_limit_interval
+        self.rate_limit_disconnect = rate_limit_disconnect
+        self.latency = latency
+
+        self.lock = threading.Lock()
+        self.clients = []
+
+        # (channel, username, message) of every message sent by a client
+        self.messages = []
+
+        # (from, to, message) of every whisper sent by a client
+        self.whispers = []
+
+        self.stats = collections.Counter()
+
+        # nickname -> when the server last disconnected the client
+        self.disconnected_at = {}
+
+        # How long it took clients to log in again after being disconnected by the server, in seconds
+        self.reconnect_times = []
+
+    @property
+    def address(self):
+        """ Returns the address in the host:port form used by the irc_server config option """
+        return '{}:{}'.format(*self.server_address)
+
+    def add_client(self, client):
+        with self.lock:
+            self.clients.append(client)
+            self.stats['connections'] += 1
+
+    def remove_client(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def on_login(self, client):
+        with self.lock:
+            disconnected_at = self.disconnected_at.pop(client.nickname, None)
+            if disconnected_at is not None:
+                self.reconnect_times.append(time.time() - disconnected_at)
+
+    def on_rate_limited(self, client, channel):
+        with self.lock:
+            self.stats['rate_limited'] += 1
+
+        if self.rate_limit_disconnect:
+            self.disconnect(client)
+        else:
+            client.send_line('@msg-id=msg_ratelimit :{} NOTICE {} :Your message was not sent because you are sending messages too quickly.'.format(SERVER_NAME, channel))
+
+    def get_clients(self, channel=None, nickname=None):
+        with self.lock:
+            clients = list(self.clients)
+        return [client for client in clients if (channel is None or channel in client.channels) and (nickname is None or client.nickname == nickname)]
+
+    def disconnect(self, client):
+        with self.lock:
+            self.stats['disconnects'] += 1
+            if client.nickname is not None:
+                self.disconnected_at[client.nickname] = time.time()
+        client.disconnect()
+
+    def disconnect_all(self):
+        """ Forcibly close every connection, like a TMI restart would """
+        for client in self.get_clients():
+            self.disconnect(client)
+
+    def send_privmsg(self, channel, username, message, tags={}, sender=None):
+        """ Send a message as `username` to everyone in the channel.
+        sender is the client that sent the message, if any. Its message is recorded, and not sent back to it """
+        if sender is not None:
+            with self.lock:
+                self.messages.append((channel, username, message))
+                self.stats['messages'] += 1
+
+        message_tags = {
+                'badges': '',
+                'color': '',
+                'display-name': username,
+                'emotes': '',
+                'id': str(uuid.uuid4()),
+                'mod': 0,
+                'subscriber': 0,
+                'tmi-sent-ts': int(time.time() * 1000),
+                'turbo': 0,
+                'user-type': '',
+                }
+        message_tags.update(tags)
+
+        line = ':{0}!{0}@{0}.{1} PRIVMSG {2} :{3}'.format(username, SERVER_NAME, channel, message)
+        for client in self.get_clients(channel=channel):
+            if client is sender:
+                continue
+            client.send_line((format_tags(message_tags) + ' ' + line) if client.has_capability('tags') else line)
+
+    def send_whisper(self, from_username, to_username, message, tags={}):
+        to_username = to_username.lower()
+        with self.lock:
+            self.whispers.append((from_username, to_username, message))
+            self.stats['whispers'] += 1
+
+        whisper_tags = {
+                'badges': '',
+                'color': '',
+                'display-name': from_username,
+                'emotes': '',
+                'message-id': self.stats['whispers'],
+                'thread-id': '{}_{}'.format(*sorted([from_username, to_username])),
+                'turbo': 0,
+                'user-type': '',
+                }
+        whisper_tags.update(tags)
+
+        line = ':{0}!{0}@{0}.{1} WHISPER {2} :{3}'.format(from_username, SERVER_NAME, to_username, message)
+        for client in self.get_clients(nickname=to_username):
+            if client.has_capability('commands'):
+                client.send_line((format_tags(whisper_tags) + ' ' + line) if client.has_capability('tags') else line)
+
+    def send_usernotice(self, channel, login, msg_id, message='', tags={}):
+        """ i.e. send_usernotice('#pajlada', 'foo', 'resub', 'hi', {'msg-param-months': 2}) """
+        notice_tags = {
+                'display-name': login,
+                'login': login,
+                'msg-id': msg_id,
+                'system-msg': '',
+                }
+        notice_tags.update(tags)
+
+        line = ':{} USERNOTICE {}'.format(SERVER_NAME, channel)
+        if message:
+            line += ' :' + message
+
+        for client in self.get_clients(channel=channel):
+            if client.has_capability('commands') and client.has_capability('tags'):
+                client.send_line(format_tags(notice_tags) + ' ' + line)
+
+    def send_roomstate(self, channel, tags={}, client=None):
+        roomstate_tags = {
+                'broadcaster-lang': '',
+                'r9k': 0,
+                'slow': 0,
+                'subs-only': 0,
+                }
+        roomstate_tags.update(tags)
+
+        line = ':{} ROOMSTATE {}'.format(SERVER_NAME, channel)
+        for target in ([client] if client is not None else self.get_clients(channel=channel)):
+            if target.has_capability('commands'):
+                target.send_line((format_tags(roomstate_tags) + ' ' + line) if target.has_capability('tags') else line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run a local stand-in for the Twitch chat servers')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6667)
+    parser.add_argument('--rate-limit', type=int, default=20, help='Messages per connection per 30 seconds, 0 for no limit')
+    parser.add_argument('--whisper-rate-limit', type=int, default=100, help='Whispers per connection per 30 seconds, 0 for no limit')
+    parser.add_argument('--rate-limit-disconnect', action='store_true', help='Disconnect clients that go over the rate limit')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before handling each incoming line')
+    parser.add_argument('--disconnect-every', type=float, default=0, help='Disconnect every client at this interval (in seconds)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    server = FakeTMIServer((args.host, args.port),
+            rate_limit=args.rate_limit,
+            whisper_rate_limit=args.whisper_rate_limit,
+            rate_limit_disconnect=args.rate_limit_disconnect,
+            latency=args.latency)
+
+    thread = threading.Thread(target=server.serve_forever, name='FakeTMIServerThread')
+    thread.daemon = True
+    thread.start()
+
+    log.info('Listening on {}'.format(server.address))
+
+    last_disconnect = time.time()
+    last_report = time.time()
+    last_stats = collections.Counter()
+    try:
+        while True:
+            time.sleep(1)
+            now = time.time()
+
+            if args.disconnect_every > 0 and now - last_disconnect >= args.disconnect_every:
+                log.info('Disconnecting all clients')
+                server.disconnect_all()
+                last_disconnect = now
+
+            if now - last_report >= 10:
+                stats = server.stats.copy()
+                reconnect_times = sorted(server.reconnect_times)
+                log.info('{:.1f} messages/s, {:.1f} whispers/s, {} rate limited, {} clients, {} reconnects (max {:.2f}s)'.format(
+                    (stats['messages'] - last_stats['messages']) / (now - last_report),
+                    (stats['whispers'] - last_stats['whispers']) / (now - last_report),
+                    stats['rate_limited'],
+                    len(server.get_clients()),
+                    len(reconnect_times),
+                    reconnect_times[-1] if len(reconnect_times) > 0 else 0.0))
+                last_stats = stats
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Compare the redis points ledger with the points stored in the database.
+
+Usage: python3 -m pajbot.scripts.reconcile_points [--config config.ini] [--fix]
+
+With --fix, every mismatching user is flagged so the next checkpoint
+overwrites the database value with the ledger value.
+"""
+
+import argparse
+import logging
+
+from pajbot.managers.db import DBManager
+from pajbot.managers.points import PointsManager
+from pajbot.managers.redis import RedisManager
+from pajbot.streamhelper import StreamHelper
+from pajbot.utils import init_logging
+from pajbot.utils import load_config
+
+log = logging.getLogger('pajbot')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='reconcile the points ledger with the database')
+    parser.add_argument('--config', '-c', default='config.ini')
+    parser.add_argument('--fix', action='store_true', help='Flag mismatching users for the next checkpoint')
+    parser.add_argument('--checkpoint', action='store_true', help='Run a checkpoint right away')
+    args = parser.parse_args()
+
+    init_logging('pajbot')
+
+    config = load_config(args.config)
+
+    redis_options = {}
+    if 'redis' in config:
+        redis_options = config._sections['redis']
+
+    RedisManager.init(**redis_options)
+    DBManager.init(config['main']['db'])
+    StreamHelper.init_streamer(config['main']['streamer'])
+
+    mismatches = PointsManager.reconcile(fix=args.fix)
+    for username, ledger_points, sql_points in mismatches:
+        log.info('{}: ledger={} sql={}'.format(username, ledger_points, sql_points))
+
+    log.info('{} mismatching users'.format(len(mismatches)))
+
+    if args.checkpoint:
+        log.info('Checkpointed {} users'.format(PointsManager.checkpoint()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded chat log through the bot, to measure how many messages per second it can handle.
+
+Usage: python3 -m pajbot.scripts.replay chat.log [--config config.ini] [--modules all] [--repeat 5] [--json]
+
+The bot runs against an in-memory SQLite database and fakeredis (or a local redis
+database with --redis-db), and everything it tries to send to chat is captured
+instead of sent. The database starts out empty apart from the modules enabled with --modules.
+
+The log is a file of raw IRC lines as received from TMI, one per line, i.e.
+    @badges=;color=;display-name=Foo;emotes=;subscriber=0;user-type= :foo!foo@foo.tmi.twitch.tv PRIVMSG #pajlada :hello
+    @login=foo;msg-id=resub;msg-param-months=2;system-msg= :tmi.twitch.tv USERNOTICE #pajlada :hi
+    @badges=;color=;display-name=Foo;emotes=;user-type= :foo!foo@foo.tmi.twitch.tv WHISPER pajbot :!points
+Other commands are ignored.
+
+At the end we report the throughput, per-message latency percentiles, redis commands and
+SQL statements per message, and the peak RSS of the process.
+"""
+
+import argparse
+import configparser
+import importlib
+import json
+import logging
+import pkgutil
+import resource
+import time
+
+from sqlalchemy import event
+
+import pajbot.models
+import pajbot.modules
+from pajbot.bot import Bot
+from pajbot.managers.db import Base
+from pajbot.managers.db import DBManager
+from pajbot.managers.irc import IRCManager
+from pajbot.managers.querystats import QueryStats
+from pajbot.managers.redis import InstrumentedRedis
+from pajbot.managers.redis import RedisManager
+from pajbot.managers.redis import RedisStats
+from pajbot.models.module import Module
+from pajbot.tmi import parse_line
+from pajbot.utils import init_logging
+from pajbot.utils import load_config
+
+log = logging.getLogger('pajbot')
+
+
+def add_mysql_collations(dbapi_connection, connection_record):
+    """ Some columns use MySQL collations, which SQLite doesn't know about """
+    dbapi_connection.create_collation('utf8mb4_bin', lambda a, b: (a > b) - (a < b))
+
+
+class CaptureIRCManager(IRCManager):
+    """ Keeps everything the bot tries to send instead of connecting to TMI """
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        # list of (type, target, message)
+        self.sent = []
+
+    def start(self):
+        pass
+
+    def whisper(self, username, message):
+        self.sent.append(('whisper', username, message))
+
+    def privmsg(self, message, channel, increase_message=True):
+        self.sent.append(('privmsg', channel, message))
+
+    def on_disconnect(self, chatconn, event):
+        pass
+
+    def _dispatcher(self, connection, event):
+        pass
+
+    def add_channel(self, channel):
+        pass
+
+
+class ReplayBot(Bot):
+    """ A bot that runs against scratch storage, and never connects to anything """
+
+    enabled_modules = []
+    redis_db = None
+
+    # Bots in the same process (see pajbot.scripts.benchmark_channels) share the same redis
+    redis = None
+
+    def init_storage(self):
+        DBManager.init('sqlite://')
+        event.listen(DBManager.get_engine(), 'connect', add_mysql_collations)
+
+        if ReplayBot.redis is not None:
+            RedisManager.redis = ReplayBot.redis
+        elif self.redis_db is None:
+            import fakeredis
+            connection_pool = fakeredis.FakeRedis(decode_responses=True).connection_pool
+            RedisManager.redis = ReplayBot.redis = InstrumentedRedis(connection_pool=connection_pool, decode_responses=True)
+        else:
+            RedisManager.init(db=self.redis_db, instrument='1')
+            RedisManager.get().flushdb()
+            ReplayBot.redis = RedisManager.redis
+
+    def upgrade_database(self):
+        # Make sure every model is registered before creating the schema
+        for module_info in pkgutil.iter_modules(pajbot.models.__path__):
+            importlib.import_module('pajbot.models.' + module_info[1])
+
+        Base.metadata.create_all(DBManager.get_engine())
+
+        with DBManager.create_session_scope() as db_session:
+            for module in pajbot.modules.available_modules:
+                if module.ID in self.enabled_modules or 'all' in self.enabled_modules:
+                    db_session.add(Module(module.ID, enabled=True))
+
+    def create_irc_manager(self):
+        return CaptureIRCManager(self)
+
+
+def get_config(path, streamer):
+    if path is not None:
+        config = load_config(path)
+    else:
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'main': {
+                'nickname': 'pajbot',
+                'streamer': streamer,
+                'trusted_mods': '0',
+                'add_self_as_whisper_account': '0',
+                },
+            'web': {
+                'domain': 'localhost',
+                },
+            })
+
+    config['main']['db'] = 'sqlite://'
+    for section in ('sock', 'websocket', 'twitter'):
+        config.remove_section(section)
+    if 'twitchapi' in config:
+        config['twitchapi']['update_subscribers'] = '0'
+
+    return config
+
+
+def percentile(values, p):
+    """ values must be sorted """
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def replay(bot, events):
+    """ Returns a list with the time it took to handle each event, in seconds """
+    handlers = {
+            'pubmsg': bot.on_pubmsg,
+            'action': bot.on_action,
+            'whisper': bot.on_whisper,
+            'usernotice': bot.on_usernotice,
+            }
+
+    latencies = []
+    for irc_event in events:
+        start_time = time.perf_counter()
+        with QueryStats.context('replay'):
+            handlers[irc_event.type](None, irc_event)
+
+            # Run anything the handlers queued up for the main thread
+            while not bot.mainthread_queue.queue.empty():
+                bot.mainthread_queue.parse_action()
+        latencies.append(time.perf_counter() - start_time)
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay a chat log through the bot and report how fast it was handled')
+    parser.add_argument('log', help='File with raw IRC lines')
+    parser.add_argument('--config', '-c', default=None, help='Config file to take the bot settings from. The db, sock and websocket settings are ignored')
+    parser.add_argument('--streamer', default='pajlada', help='Streamer to use if no config file is given')
+    parser.add_argument('--modules', default='', help='Comma-separated list of module IDs to enable, or "all"')
+    parser.add_argument('--redis-db', type=int, default=None, help='Use this database on the local redis server instead of fakeredis. It is flushed first!')
+    parser.add_argument('--repeat', type=int, default=1, help='How many times to replay the log')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--silent', action='count', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    init_logging('pajbot')
+    logging.getLogger('pajbot').setLevel(logging.WARNING)
+
+    with open(args.log, 'r', encoding='utf-8') as log_file:
+        events = [parse_line(line.rstrip('\r\n')) for line in log_file if len(line.strip()) > 0]
+    events = [irc_event for irc_event in events if irc_event is not None]
+
+    ReplayBot.enabled_modules = [module_id.strip() for module_id in args.modules.split(',') if len(module_id.strip()) > 0]
+    ReplayBot.redis_db = args.redis_db
+
+    bot = ReplayBot(get_config(args.config, args.streamer), args)
+
+    QueryStats.reset()
+    RedisStats.reset()
+
+    start_time = time.perf_counter()
+    latencies = []
+    for i in range(0, args.repeat):
+        latencies.extend(replay(bot, events))
+    bot.background_messages.wait(timeout=60)
+    total_time = time.perf_counter() - start_time
+
+    num_events = len(latencies)
+    latencies.sort()
+    query_stats = QueryStats.get_report()['contexts'].get('replay', {'num_statements': 0})
+    redis_stats = RedisStats.get_report(num=len(RedisStats.call_sites))
+
+    report = {
+            'events': num_events,
+            'total_time': total_time,
+            'events_per_second': num_events / total_time if total_time > 0 else 0.0,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p90': percentile(latencies, 90) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': latencies[-1] * 1000 if num_events > 0 else 0.0,
+                },
+            'sql_statements_per_event': query_stats['num_statements'] / max(num_events, 1),
+            'redis_commands_per_event': sum(stats['commands'] for stats in redis_stats) / max(num_events, 1),
+            'redis_round_trips_per_event': sum(stats['round_trips'] for stats in redis_stats) / max(num_events, 1),
+            'messages_sent': len(bot.irc.sent),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return
+
+    print('Replayed {events} events in {total_time:.2f}s ({events_per_second:.1f} events/s)'.format(**report))
+    print('Latency: p50={p50:.2f}ms p90={p90:.2f}ms p99={p99:.2f}ms max={max:.2f}ms'.format(**report['latency_ms']))
+    print('Per event: {sql_statements_per_event:.2f} SQL statements, {redis_commands_per_event:.2f} redis commands '
+          'in {redis_round_trips_per_event:.2f} round-trips'.format(**report))
+    print('Sent {messages_sent} messages, peak RSS {peak_rss_mb:.1f}MB'.format(**report))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
 import collections
 
+from pajbot.managers.channel import ChannelManager
+
 
 class StreamHelper:
     """ Staticly available class with a bunch of useful variables.
     streamer: The name of the streamer in full lowercase
     stream_id: The ID of the current stream. False if the stream is not live
+
+    If a channel is active (see ChannelManager), its streamer and stream manager are used instead
     """
 
     streamer = 'Unknown'
@@ -47,6 +51,11 @@ class StreamHelper:
     valid_social_keys = set(social_keys.keys())
 
     def init_bot(bot, stream_manager):
+        channel = ChannelManager.current()
+        if channel is not None:
+            channel.stream_manager = stream_manager
+            return
+
         StreamHelper.init_streamer(bot.streamer)
         StreamHelper.stream_manager = stream_manager
 
@@ -57,8 +66,17 @@ class StreamHelper:
         StreamHelper.streamer = streamer
 
     def get_streamer():
+        channel = ChannelManager.current()
+        if channel is not None:
+            return channel.streamer
         return StreamHelper.streamer
 
+    def get_stream_manager():
+        channel = ChannelManager.current()
+        if channel is not None:
+            return channel.stream_manager
+        return StreamHelper.stream_manager
+
     def get_current_stream_id():
         """ Gets the stream ID of the current stream.
         Returns None if the stream manager has not been initialized.
@@ -66,15 +84,16 @@ class StreamHelper:
         Returns the current streams ID (integer) otherwise.
         """
 
-        if StreamHelper.stream_manager is None:
+        stream_manager = StreamHelper.get_stream_manager()
+        if stream_manager is None:
             # Stream manager not initialized, web interface?
             return None
 
-        if StreamHelper.stream_manager.current_stream is None:
+        if stream_manager.current_stream is None:
             # Stream is offline
             return False
 
-        return StreamHelper.stream_manager.current_stream.id
+        return stream_manager.current_stream.id
 
     def get_last_stream_id():
         """ Gets the stream ID of the last stream.
@@ -83,27 +102,29 @@ class StreamHelper:
         Returns the current streams ID (integer) otherwise.
         """
 
-        if StreamHelper.stream_manager is None:
+        stream_manager = StreamHelper.get_stream_manager()
+        if stream_manager is None:
             # Stream manager not initialized, web interface?
             return None
 
-        if StreamHelper.stream_manager.last_stream is None:
+        if stream_manager.last_stream is None:
             # Stream is offline
             return False
 
-        return StreamHelper.stream_manager.last_stream.id
+        return stream_manager.last_stream.id
 
     def get_viewers():
         """ Returns how many viewers are currently watching the stream.
         Returns 0 if something fails
         """
 
-        if StreamHelper.stream_manager is None:
+        stream_manager = StreamHelper.get_stream_manager()
+        if stream_manager is None:
             # Stream manager not initialized, web interface?
             return 0
 
-        if StreamHelper.stream_manager.current_stream is None:
+        if stream_manager.current_stream is None:
             # Stream is offline
             return 0
 
-        return StreamHelper.stream_manager.num_viewers
+        return stream_manager.num_viewers
@@ -0,0 +1,173 @@
+"""
+Parses the raw IRC lines TMI sends us.
+
+irc.client parses the tags of every line into a list of {'key': ..., 'value': ...} dicts,
+unescaping every value right away, and every handler then has to scan that list for the
+keys it wants. Tags keeps the raw tag string of the line instead, and only splits it into
+a dictionary (with interned keys) the first time a tag is looked up. Values are unescaped
+when they are read, and only if they contain an escape sequence.
+
+parse_line turns the PRIVMSG, WHISPER and USERNOTICE lines we care about into irc.client
+Events with a Tags object, see CustomServerConnection._process_line.
+"""
+
+import collections.abc
+import logging
+import sys
+
+import irc.client
+
+log = logging.getLogger(__name__)
+
+TAG_ESCAPES = {
+        ':': ';',
+        's': ' ',
+        '\\': '\\',
+        'r': '\r',
+        'n': '\n',
+        }
+
+
+def unescape_tag_value(value):
+    """ Unescape a tag value as described in https://ircv3.net/specs/core/message-tags-3.2.html """
+    if '\\' not in value:
+        return value
+
+    unescaped = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            char = TAG_ESCAPES.get(next(chars, ''), '')
+        unescaped.append(char)
+    return ''.join(unescaped)
+
+
+def parse_emotes_tag(value):
+    """
+    Parse the value of the emotes tag, i.e. 25:0-4,12-16/1902:6-10
+    Returns a list of (emote_id, ranges) tuples, where ranges is a tuple of (first_index, last_index) tuples:
+        [('25', ((0, 4), (12, 16))), ('1902', ((6, 10), ))]
+    Malformed emotes are skipped
+    """
+    if not value:
+        return []
+
+    emotes = []
+    for emote in value.split('/'):
+        emote_id, separator, occurrences = emote.partition(':')
+        try:
+            ranges = []
+            for occurrence in occurrences.split(','):
+                first_index, last_index = occurrence.split('-')
+                ranges.append((int(first_index), int(last_index)))
+        except ValueError:
+            log.warning('Malformed emote {!r} in emotes tag {!r}'.format(emote, value))
+            continue
+
+        emotes.append((sys.intern(emote_id), tuple(ranges)))
+
+    return emotes
+
+
+class Tags(collections.abc.Mapping):
+    """
+    The IRCv3 tags of a line, as a read-only mapping of tag name -> unescaped value.
+    Tags without a value (i.e. emotes=) are None, like in irc.client.
+    """
+
+    __slots__ = ('raw', '_values', '_unescaped', '_emotes')
+
+    def __init__(self, raw=''):
+        # The tags part of the line, without the leading @
+        self.raw = raw
+        self._values = None
+        self._unescaped = None
+        self._emotes = None
+
+    @classmethod
+    def from_list(cls, tags):
+        """ Create a Tags object from the list of {'key', 'value'} dicts irc.client.Event uses """
+        self = cls()
+        self._values = {sys.intern(tag['key']): tag['value'] for tag in tags or []}
+        self._unescaped = set(self._values)
+        return self
+
+    def _parse(self):
+        values = {}
+        if self.raw:
+            for item in self.raw.split(';'):
+                key, separator, value = item.partition('=')
+                values[sys.intern(key)] = value or None
+        self._values = values
+        self._unescaped = set()
+
+    def __getitem__(self, key):
+        if self._values is None:
+            self._parse()
+
+        value = self._values[key]
+        if value is not None and key not in self._unescaped:
+            value = self._values[key] = unescape_tag_value(value)
+            self._unescaped.add(key)
+        return value
+
+    def __iter__(self):
+        if self._values is None:
+            self._parse()
+        return iter(self._values)
+
+    def __len__(self):
+        if self._values is None:
+            self._parse()
+        return len(self._values)
+
+    def __contains__(self, key):
+        if self._values is None:
+            self._parse()
+        return key in self._values
+
+    def __repr__(self):
+        return 'Tags({!r})'.format(dict(self))
+
+    @property
+    def emotes(self):
+        """ The emotes tag, parsed with parse_emotes_tag """
+        if self._emotes is None:
+            self._emotes = parse_emotes_tag(self.get('emotes'))
+        return self._emotes
+
+
+def parse_line(line):
+    """
+    Returns an irc.client.Event for a raw PRIVMSG (pubmsg/action), WHISPER or USERNOTICE line
+    with a Tags object as its tags, or None for every other line
+    """
+    raw_tags = ''
+    if line.startswith('@'):
+        raw_tags, separator, line = line[1:].partition(' ')
+
+    prefix = None
+    if line.startswith(':'):
+        prefix, separator, line = line[1:].partition(' ')
+
+    command, separator, line = line.partition(' ')
+    target, separator, trailing = line.partition(' ')
+    command = command.lower()
+
+    if command == 'privmsg':
+        if not irc.client.is_channel(target):
+            return None
+        message = trailing[1:] if trailing.startswith(':') else trailing
+        if message.startswith('\x01ACTION ') and message.endswith('\x01'):
+            return irc.client.Event('action', irc.client.NickMask(prefix) if prefix else None, target, [message[8:-1]], Tags(raw_tags))
+        elif '\x01' in message:
+            # Other CTCP messages are left to irc.client
+            return None
+        return irc.client.Event('pubmsg', irc.client.NickMask(prefix) if prefix else None, target, [message], Tags(raw_tags))
+    elif command in ('whisper', 'usernotice'):
+        if len(target) == 0:
+            return None
+        arguments = [trailing[1:] if trailing.startswith(':') else trailing] if trailing else []
+        return irc.client.Event(command, irc.client.NickMask(prefix) if prefix else None, target, arguments, Tags(raw_tags))
+
+    return None
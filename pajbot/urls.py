@@ -0,0 +1,172 @@
+"""
+Finds URLs in chat messages.
+
+Messages are split on whitespace, and every word containing a . or :// is checked on its own:
+surrounding punctuation is stripped, the host must be an IPv4 address, localhost (only with
+a scheme or a path) or a domain name with a known top-level domain.
+If the word as a whole isn't a URL, it's scanned for hosts inside it, so links glued to other
+characters (i.e. hi,evil.com or *evil.com* or a zero-width space) are still found.
+Messages without a . or :// are skipped right away, which is most of them.
+
+Found URLs are normalized, so the same link written in different ways is only found once:
+    - The scheme is lowercased, and http:// is added if there was none
+    - The host is lowercased, and default ports are removed
+    - Repeated slashes in the path and the trailing slash are removed
+"""
+
+import re
+import urllib.parse
+
+from pajbot.tlds import TLDS
+
+SCHEMES = {'http': 80, 'https': 443}
+
+LEADING_PUNCTUATION = '([{<"\'`'
+TRAILING_PUNCTUATION = '.,:;!?)]}>"\'`'
+BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+re_slashes = re.compile(r'/{2,}')
+
+# Something that looks like a host, optionally with a scheme. Used to find URLs inside a word
+re_host = re.compile(r'(?:https?://)?[\w-]+(?:\.[\w-]+)+', re.IGNORECASE)
+
+
+class Url(str):
+    """ A URL together with its parsed form (a urllib.parse.ParseResult).
+    Since it's a str, it compares, hashes and formats like the URL string """
+
+    def __init__(self, url):
+        self.url = str(url)
+        self.parsed = urllib.parse.urlparse(self.url)
+
+
+def strip_trailing_punctuation(word):
+    while len(word) > 0 and word[-1] in TRAILING_PUNCTUATION:
+        closing = word[-1]
+        if closing in BRACKETS and word.count(BRACKETS[closing]) >= word.count(closing):
+            # Balanced brackets are part of the URL, i.e. https://en.wikipedia.org/wiki/Kappa_(emote)
+            break
+        word = word[:-1]
+
+    return word
+
+
+def is_ipv4(labels):
+    return len(labels) == 4 and all(label.isdigit() and int(label) <= 255 for label in labels)
+
+
+def is_valid_host(host, allow_localhost=False):
+    if host == 'localhost':
+        return allow_localhost
+
+    labels = host.split('.')
+    if len(labels) < 2:
+        return False
+
+    if is_ipv4(labels):
+        return True
+
+    for label in labels:
+        if len(label) == 0 or len(label) > 63 or not label.replace('-', '').replace('_', '').isalnum():
+            return False
+
+    tld = labels[-1]
+    return tld in TLDS or tld.startswith('xn--')
+
+
+def parse_url(word):
+    """ Returns the normalized Url if the given word is a URL, otherwise None """
+    word = strip_trailing_punctuation(word.lstrip(LEADING_PUNCTUATION))
+
+    scheme = 'http'
+    has_scheme = False
+    separator = word.find('://')
+    if separator != -1:
+        scheme = word[:separator].lower()
+        if scheme not in SCHEMES:
+            return None
+        word = word[separator + 3:]
+        has_scheme = True
+
+    netloc_end = len(word)
+    for char in '/?#':
+        index = word.find(char, 0, netloc_end)
+        if index != -1:
+            netloc_end = index
+    netloc = word[:netloc_end]
+    rest = word[netloc_end:]
+
+    userinfo, at, netloc = netloc.rpartition('@')
+    host, colon, port = netloc.partition(':')
+    host = host.lower()
+    if host.endswith('.'):
+        host = host[:-1]
+
+    if not is_valid_host(host, allow_localhost=has_scheme or rest.startswith('/')):
+        return None
+
+    if colon:
+        if not port.isdigit() or int(port) > 65535:
+            return None
+        if int(port) == SCHEMES[scheme]:
+            colon = port = ''
+
+    rest, hash_sign, fragment = rest.partition('#')
+    path, question_mark, query = rest.partition('?')
+    path = re_slashes.sub('/', path).rstrip('/')
+
+    return Url(''.join([
+        scheme, '://',
+        userinfo, at,
+        host, colon, port,
+        path,
+        '?' if query else '', query,
+        '#' if fragment else '', fragment,
+        ]))
+
+
+def scan_word(word):
+    """ Returns the URLs found inside a word that isn't a URL as a whole """
+    urls = []
+    position = 0
+    while True:
+        match = re_host.search(word, position)
+        if match is None:
+            return urls
+
+        end = match.end()
+        if word.endswith('://', 0, match.start()):
+            # A host after a scheme we don't handle, i.e. ftp://
+            position = end
+            continue
+
+        if word[end:end + 1] in ('/', '?', '#', ':'):
+            # The rest of the word is the port, path, query or fragment of this URL
+            end = len(word)
+
+        url = parse_url(word[match.start():end])
+        if url is not None:
+            urls.append(url)
+        position = end
+
+
+def find_urls(message):
+    """ Returns a list of the unique (normalized) URLs in the message, in the order they were found """
+    if '.' not in message and '://' not in message:
+        return []
+
+    urls = []
+    for word in message.split():
+        if '.' not in word and '://' not in word:
+            continue
+
+        url = parse_url(word)
+        for url in (scan_word(word) if url is None else [url]):
+            if url not in urls:
+                urls.append(url)
+
+    return urls
+
+
+def find_unique_urls(message):
+    return set(find_urls(message))
@@ -24,6 +24,7 @@ def init(args):
     import pajbot.web.routes
     from pajbot.bot import Bot
     from pajbot.managers.db import DBManager
+    from pajbot.managers.querystats import QueryStats
     from pajbot.managers.redis import RedisManager
     from pajbot.managers.time import TimeManager
     from pajbot.models.module import ModuleManager
@@ -80,7 +81,7 @@ def init(args):
     if 'sock' in config and 'sock_file' in config['sock']:
         SocketClientManager.init(config['sock']['sock_file'])
 
-    DBManager.init(config['main']['db'])
+    DBManager.init(config['main']['db'], **DBManager.get_pool_options(config['main']))
     TimeManager.init_timezone(config['main'].get('timezone', 'UTC'))
 
     app.module_manager = ModuleManager(None).load()
@@ -159,6 +160,14 @@ def init(args):
                 'redirect_uri': 'MISSING',
                 }
 
+    @app.before_request
+    def begin_query_stats():
+        QueryStats.begin('web')
+
+    @app.teardown_request
+    def end_query_stats(exception):
+        QueryStats.end()
+
     @app.context_processor
     def current_time():
         current_time = {}
@@ -4,6 +4,7 @@ import pajbot.web.routes.api.banphrases
 import pajbot.web.routes.api.clr
 import pajbot.web.routes.api.commands
 import pajbot.web.routes.api.common
+import pajbot.web.routes.api.debug
 import pajbot.web.routes.api.email
 import pajbot.web.routes.api.modules
 import pajbot.web.routes.api.pleblist
@@ -58,3 +59,6 @@ def init(app):
 
     # /modules
     pajbot.web.routes.api.modules.init(api)
+
+    # /debug
+    pajbot.web.routes.api.debug.init(api)
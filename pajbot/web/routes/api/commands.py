@@ -1,6 +1,8 @@
 import json
 import logging
 
+from flask import make_response
+from flask import request
 from flask_restful import reqparse
 from flask_restful import Resource
 from sqlalchemy.orm import joinedload
@@ -19,6 +21,21 @@ from pajbot.utils import find
 log = logging.getLogger(__name__)
 
 
+class APICommands(Resource):
+    def get(self):
+        snapshot = pajbot.web.utils.get_commands_snapshot()
+
+        if request.if_none_match.contains(snapshot['etag']):
+            response = make_response('', 304)
+        else:
+            response = make_response(snapshot['json'], 200)
+            response.headers['Content-Type'] = 'application/json'
+
+        response.set_etag(snapshot['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+
 class APICommand(Resource):
     def get(self, raw_command_id):
         command_string = raw_command_id
@@ -29,10 +46,12 @@ class APICommand(Resource):
         except (ValueError, TypeError):
             pass
 
+        bot_commands_list = pajbot.web.utils.get_cached_commands()
+
         if command_id:
-            command = find(lambda c: c['id'] == command_id, pajbot.web.utils.get_cached_commands())
+            command = find(lambda c: c['id'] == command_id, bot_commands_list)
         else:
-            command = find(lambda c: c['resolve_string'] == command_string, pajbot.web.utils.get_cached_commands())
+            command = find(lambda c: c['resolve_string'] == command_string, bot_commands_list)
 
         if not command:
             return {
@@ -218,6 +237,7 @@ class APICommandCheckAlias(Resource):
 
 
 def init(api):
+    api.add_resource(APICommands, '/commands')
     api.add_resource(APICommand, '/commands/<raw_command_id>')
     api.add_resource(APICommandRemove, '/commands/remove/<int:command_id>')
     api.add_resource(APICommandUpdate, '/commands/update/<int:command_id>')
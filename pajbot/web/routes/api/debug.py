@@ -0,0 +1,39 @@
+from flask_restful import reqparse
+from flask_restful import Resource
+
+import pajbot.web.utils
+from pajbot.managers.querystats import QueryStats
+from pajbot.managers.redis import RedisStats
+
+
+class APIDebugSQL(Resource):
+    def __init__(self):
+        super().__init__()
+
+        self.get_parser = reqparse.RequestParser()
+        self.get_parser.add_argument('num', type=int, required=False, default=10)
+
+    @pajbot.web.utils.requires_level(2000)
+    def get(self, **options):
+        args = self.get_parser.parse_args()
+        return QueryStats.get_report(min(max(args['num'], 1), 100))
+
+
+class APIDebugRedis(Resource):
+    def __init__(self):
+        super().__init__()
+
+        self.get_parser = reqparse.RequestParser()
+        self.get_parser.add_argument('num', type=int, required=False, default=10)
+
+    @pajbot.web.utils.requires_level(2000)
+    def get(self, **options):
+        args = self.get_parser.parse_args()
+        return {
+                'call_sites': RedisStats.get_report(min(max(args['num'], 1), 100)),
+                }
+
+
+def init(api):
+    api.add_resource(APIDebugSQL, '/debug/sql')
+    api.add_resource(APIDebugRedis, '/debug/redis')
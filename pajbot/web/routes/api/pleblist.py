@@ -5,7 +5,6 @@ from flask import abort
 from flask import url_for
 from flask_restful import reqparse
 from flask_restful import Resource
-from sqlalchemy import and_
 from sqlalchemy import func
 from sqlalchemy.orm import noload
 
@@ -14,12 +13,52 @@ from pajbot.managers.db import DBManager
 from pajbot.models.pleblist import PleblistManager
 from pajbot.models.pleblist import PleblistSong
 from pajbot.models.pleblist import PleblistSongInfo
+from pajbot.models.sock import SocketClientManager
 from pajbot.models.stream import Stream
 from pajbot.web import app
 
 log = logging.getLogger(__name__)
 
 
+def update_queue():
+    """ Share the queue after a change to the songs of the current stream, and let the bot know """
+    queue = PleblistManager.update_queue()
+    SocketClientManager.send('pleblist.update', {'version': queue.version})
+
+
+queue_parser = reqparse.RequestParser()
+queue_parser.add_argument('version', type=int, required=False)
+queue_parser.add_argument('password', required=False, location='cookies')
+
+
+def get_queue():
+    """ Returns the PleblistQueue of the current stream.
+    If the version of the queue the client has is passed through as ?version=X, wait until the queue changes.
+    Only the pleblist host (with the pleblist password cookie) can wait, everyone else gets the queue right away """
+    args = queue_parser.parse_args()
+    if args['version'] is None or args['password'] is None:
+        return PleblistManager.get_queue()
+
+    try:
+        pajbot.web.utils.pleblist_login(args['password'], app.bot_config)
+    except pajbot.exc.InvalidLogin:
+        return PleblistManager.get_queue()
+
+    return PleblistManager.wait_for_queue(args['version'])
+
+
+def jsonify_queue(queue, songs, base_url):
+    """ pajbot.web.utils.jsonify_list for a list of songs from the queue, with the version of the queue """
+    return pajbot.web.utils.jsonify_list(
+            'songs',
+            songs,
+            base_url=base_url,
+            jsonify_method=list,
+            keyset_column='id',
+            extra={'version': queue.version}
+            )
+
+
 class APIPleblistSkip(Resource):
     def __init__(self):
         super().__init__()
@@ -41,29 +80,23 @@ class APIPleblistSkip(Resource):
                 abort(404)
 
             db_session.delete(song)
-            db_session.flush()
 
-            return {
-                    'message': 'GOT EM'
-                    }, 200
+        update_queue()
+
+        return {
+                'message': 'GOT EM'
+                }, 200
 
 
 class APIPleblistListCurrent(Resource):
     def get(self):
-        with DBManager.create_session_scope() as session:
-            current_stream = session.query(Stream).filter_by(ended=False).order_by(Stream.stream_start).first()
-            if current_stream is None:
-                return {
-                        'error': 'Stream offline'
-                        }, 400
+        queue = get_queue()
+        if queue.stream_id is None:
+            return {
+                    'error': 'Stream offline'
+                    }, 400
 
-            songs = session.query(PleblistSong).filter(PleblistSong.stream_id == current_stream.id, PleblistSong.date_played.is_(None))
-
-            return pajbot.web.utils.jsonify_list(
-                    'songs',
-                    songs,
-                    base_url=url_for(self.endpoint, _external=True),
-                    )
+        return jsonify_queue(queue, queue.songs, url_for(self.endpoint, _external=True))
 
 
 class APIPleblistListStream(Resource):
@@ -75,25 +108,26 @@ class APIPleblistListStream(Resource):
                     'songs',
                     songs,
                     base_url=url_for(self.endpoint, stream_id=stream_id, _external=True),
+                    keyset_column=PleblistSong.id,
                     )
 
 
 class APIPleblistListAfter(Resource):
     def get(self, song_id):
-        with DBManager.create_session_scope() as session:
-            current_stream = session.query(Stream).filter_by(ended=False).order_by(Stream.stream_start).first()
-            if current_stream is None:
-                return {
-                        'error': 'Stream offline'
-                        }, 400
+        queue = get_queue()
+        if queue.stream_id is None:
+            return {
+                    'error': 'Stream offline'
+                    }, 400
 
-            songs = session.query(PleblistSong).filter(and_(PleblistSong.stream_id == current_stream.id, PleblistSong.date_played.is_(None), PleblistSong.id > song_id))
+        try:
+            songs = queue.get_songs_after(int(song_id))
+        except ValueError:
+            return {
+                    'error': 'Invalid song_id'
+                    }, 400
 
-            return pajbot.web.utils.jsonify_list(
-                    'songs',
-                    songs,
-                    base_url=url_for(self.endpoint, song_id=song_id, _external=True),
-                    )
+        return jsonify_queue(queue, songs, url_for(self.endpoint, song_id=song_id, _external=True))
 
 
 class APIPleblistAdd(Resource):
@@ -134,9 +168,11 @@ class APIPleblistAdd(Resource):
                     session.add(song_info)
                     session.commit()
 
-            return {
-                    'success': 'got em!'
-                    }, 200
+        update_queue()
+
+        return {
+                'success': 'got em!'
+                }, 200
 
 
 class APIPleblistNext(Resource):
@@ -174,9 +210,11 @@ class APIPleblistNext(Resource):
             # TODO: Add more data.
             # Was this song forcefully skipped? Or did it end naturally.
 
-            return {
-                    'success': 'got em!'
-                    }, 200
+        update_queue()
+
+        return {
+                'success': 'got em!'
+                }, 200
 
 
 class APIPleblistValidate(Resource):
@@ -65,6 +65,51 @@ class APITimerToggle(Resource):
             return {'success': 'successful toggle', 'new_state': new_state}
 
 
+class APITimerBulkToggle(Resource):
+    """ Enable or disable many timers at once, the bot is notified about all of them in a single frame """
+
+    def __init__(self):
+        super().__init__()
+
+        self.post_parser = reqparse.RequestParser()
+        self.post_parser.add_argument('ids', type=int, action='append', required=True)
+        self.post_parser.add_argument('new_state', required=True)
+
+    @pajbot.web.utils.requires_level(500)
+    def post(self, **options):
+        args = self.post_parser.parse_args()
+
+        try:
+            new_state = int(args['new_state'])
+        except (ValueError, KeyError):
+            return {'error': 'Invalid `new_state` parameter.'}, 400
+
+        with SocketClientManager.batch():
+            with DBManager.create_session_scope() as db_session:
+                rows = db_session.query(Timer).filter(Timer.id.in_(args['ids'])).all()
+                if len(rows) == 0:
+                    return {
+                            'error': 'No timers with these IDs found'
+                            }, 404
+
+                for row in rows:
+                    row.enabled = True if new_state == 1 else False
+                db_session.commit()
+
+                for row in rows:
+                    AdminLogManager.post('Timer toggled',
+                            options['user'],
+                            'Enabled' if row.enabled else 'Disabled',
+                            row.name)
+                    SocketClientManager.send('timer.update', {
+                        'id': row.id,
+                        'new_state': row.enabled,
+                        })
+
+                return {'success': 'successful toggle', 'new_state': new_state, 'ids': [row.id for row in rows]}
+
+
 def init(api):
     api.add_resource(APITimerRemove, '/timers/remove/<int:timer_id>')
     api.add_resource(APITimerToggle, '/timers/toggle/<int:row_id>')
+    api.add_resource(APITimerBulkToggle, '/timers/toggle')
@@ -1,28 +1,48 @@
+from flask_restful import reqparse
 from flask_restful import Resource
 
-from pajbot.managers.redis import RedisManager
+from pajbot.managers.db import DBManager
 from pajbot.managers.user import UserManager
-from pajbot.streamhelper import StreamHelper
 
 
 class APIUser(Resource):
     def get(self, username):
-        user = UserManager.find_static(username)
-        if not user:
+        with DBManager.create_session_scope() as db_session:
+            users = UserManager.bulk_find_static([username], db_session)
+            if len(users) == 0:
+                return {
+                        'error': 'Not found'
+                        }, 404
+
+            return UserManager.bulk_jsonify(users, db_session)[0]
+
+
+class APIUsers(Resource):
+    MAX_USERS = 100
+
+    def __init__(self):
+        super().__init__()
+
+        self.get_parser = reqparse.RequestParser()
+        self.get_parser.add_argument('names', required=True)
+
+    def get(self):
+        args = self.get_parser.parse_args()
+
+        usernames = [username.strip() for username in args['names'].split(',') if len(username.strip()) > 0]
+        if len(usernames) > self.MAX_USERS:
             return {
-                    'error': 'Not found'
-                    }, 404
+                    'error': 'You can look up at most {} users at a time'.format(self.MAX_USERS)
+                    }, 400
 
-        redis = RedisManager.get()
-        key = '{streamer}:users:num_lines'.format(streamer=StreamHelper.get_streamer())
-        rank = redis.zrevrank(key, user.username)
-        if rank is None:
-            rank = redis.zcard(key)
-        else:
-            rank = rank + 1
+        with DBManager.create_session_scope() as db_session:
+            users = UserManager.bulk_find_static(usernames, db_session)
 
-        return user.jsonify()
+            return {
+                    'users': UserManager.bulk_jsonify(users, db_session)
+                    }
 
 
 def init(api):
     api.add_resource(APIUser, '/users/<username>')
+    api.add_resource(APIUsers, '/users')
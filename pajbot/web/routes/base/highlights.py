@@ -2,15 +2,28 @@ import datetime
 
 from flask import redirect
 from flask import render_template
-from sqlalchemy import cast
-from sqlalchemy import Date
+from flask import request
+from sqlalchemy.orm import defaultload
 from sqlalchemy.orm import joinedload
 
 from pajbot.managers.db import DBManager
+from pajbot.managers.highlight import HighlightManager
+from pajbot.models.stream import StreamChunk
 from pajbot.models.stream import StreamChunkHighlight
 
 
 def init(app):
+    HIGHLIGHTS_PER_PAGE = 10
+
+    def highlight_list_options():
+        """ Load everything the highlight/list.html template needs in the same query """
+        return (
+                joinedload(StreamChunkHighlight.stream_chunk).joinedload(StreamChunk.stream),
+                defaultload(StreamChunkHighlight.stream_chunk).noload(StreamChunk.highlights),
+                joinedload(StreamChunkHighlight.created_by_user),
+                joinedload(StreamChunkHighlight.last_edited_by_user),
+                )
+
     @app.route('/highlights/<date>/')
     def highlight_list_date(date):
         # Make sure we were passed a valid date
@@ -19,22 +32,17 @@ def init(app):
         except ValueError:
             # Invalid date
             return redirect('/highlights/', 303)
-        session = DBManager.create_session()
-        dates_with_highlights = []
-        highlights = session.query(StreamChunkHighlight).options(joinedload('*')).filter(cast(StreamChunkHighlight.created_at, Date) == parsed_date).order_by(StreamChunkHighlight.created_at.desc()).all()
-        for highlight in session.query(StreamChunkHighlight):
-            dates_with_highlights.append(datetime.datetime(
-                year=highlight.created_at.year,
-                month=highlight.created_at.month,
-                day=highlight.created_at.day))
 
-        try:
+        with DBManager.create_session_scope() as db_session:
+            highlights = db_session.query(StreamChunkHighlight).options(*highlight_list_options()).\
+                    filter(StreamChunkHighlight.created_at >= parsed_date).\
+                    filter(StreamChunkHighlight.created_at < parsed_date + datetime.timedelta(days=1)).\
+                    order_by(StreamChunkHighlight.created_at.desc()).all()
+
             return render_template('highlights_date.html',
                     highlights=highlights,
                     date=parsed_date,
-                    dates_with_highlights=set(dates_with_highlights))
-        finally:
-            session.close()
+                    dates_with_highlights=HighlightManager.get_dates_with_highlights())
 
     @app.route('/highlights/<date>/<highlight_id>', defaults={'highlight_title': None})
     @app.route('/highlights/<date>/<highlight_id>-<highlight_title>')
@@ -53,17 +61,24 @@ def init(app):
 
     @app.route('/highlights/')
     def highlights():
-        session = DBManager.create_session()
-        dates_with_highlights = []
-        highlights = session.query(StreamChunkHighlight).options(joinedload('*')).filter(StreamChunkHighlight.created_at >= (datetime.datetime.utcnow() - datetime.timedelta(days=60))).order_by(StreamChunkHighlight.created_at_with_offset.desc()).all()
-        for highlight in highlights:
-            dates_with_highlights.append(datetime.datetime(
-                year=highlight.created_at.year,
-                month=highlight.created_at.month,
-                day=highlight.created_at.day))
-        try:
+        # Keyset pagination: ?before=<id> shows the highlights that were created before the given highlight
+        before_id = request.args.get('before', None, type=int)
+
+        with DBManager.create_session_scope() as db_session:
+            query = db_session.query(StreamChunkHighlight).options(*highlight_list_options())
+            if before_id is not None:
+                query = query.filter(StreamChunkHighlight.id < before_id)
+            highlights = query.order_by(StreamChunkHighlight.id.desc()).limit(HIGHLIGHTS_PER_PAGE + 1).all()
+
+            next_before_id = None
+            if len(highlights) > HIGHLIGHTS_PER_PAGE:
+                highlights = highlights[:HIGHLIGHTS_PER_PAGE]
+                next_before_id = highlights[-1].id
+
+            # The pages are split up by id, but each page is still shown in the order the highlights happened on stream
+            highlights.sort(key=lambda highlight: highlight.created_at - datetime.timedelta(seconds=highlight.highlight_offset), reverse=True)
+
             return render_template('highlights.html',
-                    highlights=highlights[:10],
-                    dates_with_highlights=set(dates_with_highlights))
-        finally:
-            session.close()
+                    highlights=highlights,
+                    next_before_id=next_before_id,
+                    dates_with_highlights=HighlightManager.get_dates_with_highlights())
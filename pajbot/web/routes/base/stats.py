@@ -1,7 +1,9 @@
 from flask import render_template
+from sqlalchemy.orm import joinedload
 
 import pajbot.web.utils
 from pajbot.managers.db import DBManager
+from pajbot.managers.leaderboard import LeaderboardManager
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.user import UserManager
 from pajbot.models.duel import UserDuelStats
@@ -38,15 +40,27 @@ def init(app):
 
     @app.route('/stats/duels/')
     def stats_duels():
+        boards = {
+                'top_5_winners': LeaderboardManager.get_top('duels_won', 5),
+                'top_5_points_won': LeaderboardManager.get_top('duel_profit', 5),
+                'top_5_points_lost': LeaderboardManager.get_top('duel_profit', 5, reverse=True),
+                'top_5_losers': LeaderboardManager.get_top('duels_lost', 5),
+                'top_5_winrate': LeaderboardManager.get_top('duel_winrate', 5, score_cast_func=float),
+                'bottom_5_winrate': LeaderboardManager.get_top('duel_winrate_bottom', 5, reverse=True, score_cast_func=float),
+                }
+
+        user_ids = set()
+        for board in boards.values():
+            user_ids.update(int(user_id) for user_id, score in board)
+
         with DBManager.create_session_scope() as db_session:
+            duel_stats = {}
+            if len(user_ids) > 0:
+                query = db_session.query(UserDuelStats).options(joinedload(UserDuelStats.user)).filter(UserDuelStats.user_id.in_(user_ids))
+                duel_stats = {stats.user_id: stats for stats in query}
 
-            data = {
-                    'top_5_winners': db_session.query(UserDuelStats).order_by(UserDuelStats.duels_won.desc())[:5],
-                    'top_5_points_won': db_session.query(UserDuelStats).order_by(UserDuelStats.profit.desc())[:5],
-                    'top_5_points_lost': db_session.query(UserDuelStats).order_by(UserDuelStats.profit.asc())[:5],
-                    'top_5_losers': db_session.query(UserDuelStats).order_by(UserDuelStats.duels_lost.desc())[:5],
-                    'top_5_winrate': db_session.query(UserDuelStats).filter(UserDuelStats.duels_won >= 5).order_by(UserDuelStats.winrate.desc())[:5],
-                    'bottom_5_winrate': db_session.query(UserDuelStats).filter(UserDuelStats.duels_lost >= 5).order_by(UserDuelStats.winrate.asc())[:5],
-                    }
+            data = {}
+            for key, board in boards.items():
+                data[key] = [duel_stats[int(user_id)] for user_id, score in board if int(user_id) in duel_stats]
 
             return render_template('stats_duels.html', **data)
@@ -3,9 +3,12 @@ from flask import render_template
 from pajbot.managers.db import DBManager
 from pajbot.managers.user import UserManager
 from pajbot.models.roulette import Roulette
+from pajbot.models.roulette import UserRouletteStats
 
 
 def init(app):
+    NUM_RECENT_ROULETTES = 50
+
     @app.route('/user/<username>')
     def user_profile(username):
         with DBManager.create_session_scope() as db_session:
@@ -13,79 +16,27 @@ def init(app):
             if not user:
                 return render_template('no_user.html'), 404
 
-            roulettes = db_session.query(Roulette).filter_by(user_id=user.id).order_by(Roulette.created_at.desc()).all()
+            # The full history is summarized in UserRouletteStats, only the most recent roulettes are listed
+            roulettes = db_session.query(Roulette).filter_by(user_id=user.id).order_by(Roulette.id.desc()).limit(NUM_RECENT_ROULETTES).all()
+            user_roulette_stats = db_session.query(UserRouletteStats).get(user.id)
 
             roulette_stats = None
-            if len(roulettes) > 0:
-                profit = 0
-                total_points = 0
-                biggest_loss = 0
-                biggest_win = 0
-                biggest_winstreak = 0
-                biggest_losestreak = 0
-                num_wins = 0
-                num_losses = 0
-                winrate = 0
-                num_roulettes = len(roulettes)
-                cw = 0
-                for roulette in roulettes:
-                    profit += roulette.points
-                    total_points += abs(roulette.points)
-
-                    if roulette.points > 0:
-                        # a win!
-                        num_wins += 1
-                        if cw < 0:
-                            if abs(cw) > biggest_losestreak:
-                                biggest_losestreak = abs(cw)
-                            cw = 0
-                        cw += 1
-                    else:
-                        # a loss
-                        num_losses += 1
-                        if cw > 0:
-                            if cw > biggest_winstreak:
-                                biggest_winstreak = cw
-                            cw = 0
-                        cw -= 1
-
-                    if roulette.points < biggest_loss:
-                        biggest_loss = roulette.points
-                    elif roulette.points > biggest_win:
-                        biggest_win = roulette.points
-
-                # Calculate winrate
-                if num_losses == 0:
-                    winrate = 1
-                elif num_wins == 0:
-                    winrate = 0
-                else:
-                    winrate = num_wins / num_roulettes
-
-                # Finalize win/lose streaks in case we're currently
-                # on the biggest win/lose streak
-                if cw < 0:
-                    if abs(cw) > biggest_losestreak:
-                        biggest_losestreak = abs(cw)
-                elif cw > 0:
-                    if cw > biggest_winstreak:
-                        biggest_winstreak = cw
-
+            if user_roulette_stats is not None and user_roulette_stats.num_roulettes > 0:
                 if 'roulette' in app.module_manager:
                     roulette_base_winrate = 1.0 - app.module_manager['roulette'].settings['rigged_percentage'] / 100
                 else:
                     roulette_base_winrate = 0.45
 
                 roulette_stats = {
-                        'profit': profit,
-                        'total_points': total_points,
-                        'biggest_win': biggest_win,
-                        'biggest_loss': biggest_loss,
-                        'num_roulettes': num_roulettes,
-                        'biggest_winstreak': biggest_winstreak,
-                        'biggest_losestreak': biggest_losestreak,
-                        'winrate': winrate,
-                        'winrate_str': '{:.2f}%'.format(winrate * 100),
+                        'profit': user_roulette_stats.profit,
+                        'total_points': user_roulette_stats.total_points,
+                        'biggest_win': user_roulette_stats.biggest_win,
+                        'biggest_loss': user_roulette_stats.biggest_loss,
+                        'num_roulettes': user_roulette_stats.num_roulettes,
+                        'biggest_winstreak': user_roulette_stats.longest_winstreak,
+                        'biggest_losestreak': user_roulette_stats.longest_losestreak,
+                        'winrate': user_roulette_stats.winrate,
+                        'winrate_str': '{:.2f}%'.format(user_roulette_stats.winrate * 100),
                         'roulette_base_winrate': roulette_base_winrate,
                         }
 
@@ -1,8 +1,10 @@
 import base64
 import binascii
 import datetime
+import hashlib
 import json
 import logging
+import operator
 import urllib.parse
 from functools import update_wrapper
 from functools import wraps
@@ -10,6 +12,7 @@ from functools import wraps
 from flask import abort
 from flask import make_response
 from flask import request
+from flask import Response
 from flask import session
 from flask.ext.scrypt import generate_password_hash
 from flask_restful import reqparse
@@ -89,28 +92,80 @@ def download_logo(client_id, streamer):
     return False
 
 
+# The latest commands snapshot this process has seen, see get_commands_snapshot
+commands_snapshot = None
+
+
 @time_nonclass_method
-def get_cached_commands():
-    CACHE_TIME = 30  # seconds
+def build_commands_json():
+    bot_commands = pajbot.managers.command.CommandManager(
+            socket_manager=None,
+            module_manager=ModuleManager(None).load(),
+            bot=None).load(load_examples=True)
+    bot_commands_list = bot_commands.parse_for_web()
+
+    bot_commands_list.sort(key=lambda x: (x.id or -1, x.main_alias))
+    return json.dumps([c.jsonify() for c in bot_commands_list], separators=(',', ':'))
+
+
+def get_commands_snapshot():
+    """ Returns the current snapshot of the command list as a dictionary with
+    the keys etag, json (the serialized command list) and commands.
+
+    The bot bumps the command list version whenever a command or module changes.
+    The snapshot is only rebuilt when that version changes, or when it's older
+    than MAX_AGE seconds (so the usage statistics stay somewhat up to date).
+    The latest snapshot is also kept in memory, so most requests only cost
+    a single round-trip to redis. """
+    global commands_snapshot
+
+    MAX_AGE = 10 * 60  # seconds
 
     redis = RedisManager.get()
-    commands_key = '{streamer}:cache:commands'.format(streamer=StreamHelper.get_streamer())
-    commands = redis.get(commands_key)
-    if commands is None:
-        log.debug('Updating commands...')
-        bot_commands = pajbot.managers.command.CommandManager(
-                socket_manager=None,
-                module_manager=ModuleManager(None).load(),
-                bot=None).load(load_examples=True)
-        bot_commands_list = bot_commands.parse_for_web()
-
-        bot_commands_list.sort(key=lambda x: (x.id or -1, x.main_alias))
-        bot_commands_list = [c.jsonify() for c in bot_commands_list]
-        redis.setex(commands_key, json.dumps(bot_commands_list, separators=(',', ':')), CACHE_TIME)
-    else:
-        bot_commands_list = json.loads(commands)
+    snapshot_key = '{streamer}:cache:commands_snapshot'.format(streamer=StreamHelper.get_streamer())
+
+    with redis.pipeline() as pipeline:
+        pipeline.get(pajbot.managers.command.CommandManager.get_version_key())
+        pipeline.hmget(snapshot_key, ['version', 'etag'])
+        version, (snapshot_version, etag) = pipeline.execute()
+
+    version = version or '0'
+
+    if snapshot_version == version and etag is not None:
+        if commands_snapshot is not None and etag == commands_snapshot['etag']:
+            return commands_snapshot
+
+        commands_json = redis.hget(snapshot_key, 'json')
+        if commands_json is None:
+            # The snapshot expired in between our two calls
+            etag = None
+
+    if snapshot_version != version or etag is None:
+        log.debug('Updating commands snapshot...')
+        commands_json = build_commands_json()
+        etag = '{}-{}'.format(version, hashlib.sha1(commands_json.encode('utf-8')).hexdigest()[:16])
+
+        with redis.pipeline() as pipeline:
+            pipeline.delete(snapshot_key)
+            pipeline.hmset(snapshot_key, {
+                'version': version,
+                'etag': etag,
+                'json': commands_json,
+                })
+            pipeline.expire(snapshot_key, MAX_AGE)
+            pipeline.execute()
+
+    commands_snapshot = {
+            'etag': etag,
+            'json': commands_json,
+            'commands': json.loads(commands_json),
+            }
 
-    return bot_commands_list
+    return commands_snapshot
+
+
+def get_cached_commands():
+    return get_commands_snapshot()['commands']
 
 
 def json_serial(obj):
@@ -137,11 +192,54 @@ def jsonify_query(query):
     return [v.jsonify() for v in query]
 
 
+def get_cached_count(query, cache_time):
+    """ Returns query.count(), cached in redis for `cache_time` seconds.
+    The cache key is based on the SQL and parameters of the query. """
+    if not cache_time:
+        return query.count()
+
+    statement = query.statement.compile()
+    query_hash = hashlib.sha1('{}{}'.format(statement, sorted(statement.params.items())).encode('utf-8')).hexdigest()
+
+    redis = RedisManager.get()
+    count_key = '{streamer}:cache:count:{hash}'.format(streamer=StreamHelper.get_streamer(), hash=query_hash)
+    count = redis.get(count_key)
+    if count is None:
+        count = query.count()
+        redis.setex(count_key, count, cache_time)
+
+    return int(count)
+
+
 def jsonify_list(key, query, base_url=None,
         default_limit=None, max_limit=None,
-        jsonify_method=jsonify_query):
-    """ Must be called in the context of a request """
-    _total = query.count()
+        jsonify_method=jsonify_query,
+        keyset_column=None,
+        total_cache_time=10,
+        extra=None):
+    """ Must be called in the context of a request
+
+    query can also be a list of items that are already serialized (pass jsonify_method=list),
+    then keyset_column is the name of the key to paginate on.
+    The items of `extra` are added to the payload.
+
+    Supports two kinds of pagination:
+     - ?limit=X&offset=Y - the default
+     - ?limit=X&after_id=Y - keyset pagination, only if keyset_column is set.
+       Only rows where keyset_column is greater than Y are returned, ordered by keyset_column.
+       The cost of a page does not grow with how far into the list it is.
+    If keyset_column is set and no offset is specified, the next link uses keyset pagination.
+
+    _total is cached for `total_cache_time` seconds (set it to None to always count)
+
+    Large pages are serialized while they are being sent rather than all at once """
+    STREAM_THRESHOLD = 100  # rows
+
+    is_list = isinstance(query, list)
+    if is_list:
+        _total = len(query)
+    else:
+        _total = get_cached_count(query, total_cache_time)
 
     paginate_args = paginate_parser.parse_args()
 
@@ -157,22 +255,48 @@ def jsonify_list(key, query, base_url=None,
 
     # By default we perform no offsetting
     offset = None
+    after_id = None
 
-    if paginate_args['offset'] and paginate_args['offset'] > 0:
+    if keyset_column is not None and paginate_args['after_id'] is not None:
+        # Keyset pagination, the offset is ignored
+        after_id = paginate_args['after_id']
+        if is_list:
+            query = [item for item in query if item[keyset_column] > after_id]
+        else:
+            query = query.filter(keyset_column > after_id)
+    elif paginate_args['offset'] and paginate_args['offset'] > 0:
         # If an offset has been specified in the query arguments, use it
         offset = paginate_args['offset']
 
-    if limit:
-        query = query.limit(limit)
+    if keyset_column is not None:
+        # Any ordering of the query is replaced, the pages only line up if the rows are ordered by keyset_column
+        if is_list:
+            query = sorted(query, key=operator.itemgetter(keyset_column))
+        else:
+            query = query.order_by(None).order_by(keyset_column)
+
+    if is_list:
+        rows = query[offset or 0:]
+        if limit:
+            rows = rows[:limit]
+    else:
+        if limit:
+            query = query.limit(limit)
 
-    if offset:
-        query = query.offset(offset)
+        if offset:
+            query = query.offset(offset)
+
+        rows = query.all()
+    items = jsonify_method(rows)
 
     payload = {
             '_total': _total,
-            key: jsonify_method(query),
+            key: items,
             }
 
+    if extra:
+        payload.update(extra)
+
     if base_url:
         payload['_links'] = {}
 
@@ -182,16 +306,26 @@ def jsonify_list(key, query, base_url=None,
             payload['_links']['self'] = base_url
 
         if limit:
-            payload['_links']['next'] = base_url + '?' + urllib.parse.urlencode([('limit', limit), ('offset', (offset or 0) + limit)])
+            if keyset_column is not None and offset is None:
+                if len(rows) >= limit:
+                    last_id = rows[-1][keyset_column] if is_list else getattr(rows[-1], keyset_column.key)
+                    payload['_links']['next'] = base_url + '?' + urllib.parse.urlencode([('limit', limit), ('after_id', last_id)])
+            else:
+                payload['_links']['next'] = base_url + '?' + urllib.parse.urlencode([('limit', limit), ('offset', (offset or 0) + limit)])
 
             if offset:
                 payload['_links']['prev'] = base_url + '?' + urllib.parse.urlencode([('limit', limit), ('offset', max(0, offset - limit))])
 
+    if len(items) > STREAM_THRESHOLD:
+        encoder = json.JSONEncoder(default=json_serial)
+        return Response(encoder.iterencode(payload), mimetype='application/json')
+
     return payload
 
 paginate_parser = reqparse.RequestParser()
 paginate_parser.add_argument('limit', type=int, required=False)
 paginate_parser.add_argument('offset', type=int, required=False)
+paginate_parser.add_argument('after_id', type=int, required=False)
 
 
 def pleblist_login(in_password, bot_config):
@@ -440,6 +440,68 @@ function play_custom_sound(url)
     audio.play();
 }
 
+function handle_event(json_data)
+{
+    if (json_data['event'] === undefined) {
+        return;
+    }
+
+    switch (json_data['event']) {
+        case 'new_box':
+            add_random_box(json_data['data']['color']);
+            break;
+        case 'new_emote':
+            add_emote(json_data['data']['emote']);
+            break;
+        case 'notification':
+            add_notification(json_data['data']['message']);
+            break;
+        case 'timeout':
+            add_notification('<span class="user">' + json_data['data']['user'] + '</span> timed out <span class="victim">' + json_data['data']['victim'] + '</span> EleGiggle');
+            setTimeout(function() {
+                play_sound('slap');
+            }, 100);
+            break;
+        case 'play_sound':
+            play_sound(json_data['data']['sample']);
+            break;
+        case 'play_custom_sound':
+            play_custom_sound(json_data['data']['url']);
+            break;
+        case 'emote_combo':
+            refresh_emote_combo(json_data['data']['emote'], json_data['data']['count']);
+            break;
+        case 'hsbet_new_game':
+            hsbet_new_game(json_data['data']['time_left'], json_data['data']['win'], json_data['data']['loss']);
+            break;
+        case 'hsbet_update_data':
+            hsbet_update_data(json_data['data']['win'], json_data['data']['loss']);
+            break;
+        case 'show_custom_image':
+            show_custom_image(json_data['data']);
+            break;
+        case 'refresh':
+        case 'reload':
+            location.reload(true);
+            break;
+    }
+}
+
+var ws_topics = [
+    'new_box',
+    'new_emote',
+    'notification',
+    'timeout',
+    'play_sound',
+    'play_custom_sound',
+    'emote_combo',
+    'hsbet_new_game',
+    'hsbet_update_data',
+    'show_custom_image',
+    'refresh',
+    'reload',
+];
+
 function connect_to_ws()
 {
     if (isopen) {
@@ -453,52 +515,21 @@ function connect_to_ws()
     socket.onopen = function() {
         console.log('Connected!');
         isopen = true;
+        socket.send(JSON.stringify({
+            'type': 'subscribe',
+            'topics': ws_topics,
+            'batch': true
+        }));
     }
 
     socket.onmessage = function(e) {
         if (typeof e.data == "string") {
             var json_data = JSON.parse(e.data);
             console.log(json_data);
-            if (json_data['event'] !== undefined) {
-                switch (json_data['event']) {
-                    case 'new_box':
-                        add_random_box(json_data['data']['color']);
-                        break;
-                    case 'new_emote':
-                        add_emote(json_data['data']['emote']);
-                        break;
-                    case 'notification':
-                        add_notification(json_data['data']['message']);
-                        break;
-                    case 'timeout':
-                        add_notification('<span class="user">' + json_data['data']['user'] + '</span> timed out <span class="victim">' + json_data['data']['victim'] + '</span> EleGiggle');
-                        setTimeout(function() {
-                            play_sound('slap');
-                        }, 100);
-                        break;
-                    case 'play_sound':
-                        play_sound(json_data['data']['sample']);
-                        break;
-                    case 'play_custom_sound':
-                        play_custom_sound(json_data['data']['url']);
-                        break;
-                    case 'emote_combo':
-                        refresh_emote_combo(json_data['data']['emote'], json_data['data']['count']);
-                        break;
-                    case 'hsbet_new_game':
-                        hsbet_new_game(json_data['data']['time_left'], json_data['data']['win'], json_data['data']['loss']);
-                        break;
-                    case 'hsbet_update_data':
-                        hsbet_update_data(json_data['data']['win'], json_data['data']['loss']);
-                        break;
-                    case 'show_custom_image':
-                        show_custom_image(json_data['data']);
-                        break;
-                    case 'refresh':
-                    case 'reload':
-                        location.reload(true);
-                        break;
-                }
+            if (Array.isArray(json_data)) {
+                json_data.forEach(handle_event);
+            } else {
+                handle_event(json_data);
             }
         } else {
             var arr = new Uint8Array(e.data);
@@ -38,6 +38,10 @@ function connect_to_ws()
     socket.onopen = function() {
         console.log('Connected!');
         isopen = true;
+        socket.send(JSON.stringify({
+            'type': 'subscribe',
+            'topics': ['notify']
+        }));
     }
 
     socket.onmessage = function(e) {
@@ -26,6 +26,10 @@ function connect_to_ws()
     socket.onopen = function() {
         console.log('Connected!');
         isopen = true;
+        socket.send(JSON.stringify({
+            'type': 'subscribe',
+            'topics': ['new_sub', 'resub']
+        }));
     }
 
     socket.onmessage = function(e) {
@@ -74,6 +74,7 @@ function onPlayerStateChange(event)
 
 var pleblist_songs = [];
 var latest_song_id = -1;
+var pleblist_version = undefined;
 var pleblist_started = false;
 
 function start_pleblist()
@@ -85,23 +86,32 @@ function start_pleblist()
     }
 }
 
-function start_getting_new_songs()
+function start_getting_new_songs(delay)
 {
     setTimeout(function() {
+        var url = '/api/v1/pleblist/list/after/' + latest_song_id;
+        if (pleblist_version !== undefined) {
+            // The server answers once the pleblist has changed, or after ~25 seconds
+            url += '?version=' + pleblist_version;
+        }
+        var request_start = Date.now();
         $.ajax({
             dataType: 'json',
-            timeout: 10 * 1000,
-            'url': '/api/v1/pleblist/list/after/' + latest_song_id,
+            timeout: 40 * 1000,
+            'url': url,
             success: function(response) {
-                start_getting_new_songs();
+                // If nothing changed and the server answered right away, it didn't wait (i.e. too many requests were waiting already)
+                var next_delay = (response.version === pleblist_version && Date.now() - request_start < 1000) ? 5 * 1000 : 0;
+                pleblist_version = response.version;
                 process_songs(response.songs);
+                start_getting_new_songs(next_delay);
             },
             error: function(response) {
-                start_getting_new_songs();
+                start_getting_new_songs(5 * 1000);
                 console.log(response);
             }
         });
-    }, 5 * 1000);
+    }, delay);
 }
 
 function add_to_pleblist(song)
@@ -255,11 +265,12 @@ $(document).ready(function() {
                 dataType: 'json',
                 'url': '/api/v1/pleblist/list',
                 success: function(response) {
+                    pleblist_version = response.version;
                     process_songs(response.songs);
-                    start_getting_new_songs();
+                    start_getting_new_songs(0);
                 },
                 error: function(response) {
-                    start_getting_new_songs();
+                    start_getting_new_songs(5 * 1000);
                 }
             });
         }, 500);
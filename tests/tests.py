@@ -37,24 +37,1988 @@ class TestURLMethods(unittest2.TestCase):
         self.assertFalse(is_same_url(Url('pajlada.com'), Url('pajlada.com/abc')))
 
     def test_find_unique_urls(self):
-        from pajbot.modules.linkchecker import find_unique_urls
-        from pajbot.bot import Bot
-        import re
+        from pajbot.urls import find_unique_urls
+
+        self.assertEqual(find_unique_urls('pajlada.se test http://pajlada.se'), {'http://pajlada.se'})
+        self.assertEqual(find_unique_urls('pajlada.se pajlada.com foobar.se'), {'http://pajlada.se', 'http://pajlada.com', 'http://foobar.se'})
+        self.assertEqual(find_unique_urls('foobar.com foobar.com'), {'http://foobar.com'})
+        self.assertEqual(find_unique_urls('foobar.com foobar.se'), {'http://foobar.com', 'http://foobar.se'})
+        self.assertEqual(find_unique_urls('www.foobar.com foobar.se'), {'http://www.foobar.com', 'http://foobar.se'})
+
+        self.assertEqual(find_unique_urls('pajlada.se/ pajlada.se'), {'http://pajlada.se'})
+        self.assertEqual(find_unique_urls('https://pajlada.se/ https://pajlada.se'), {'https://pajlada.se'})
+        self.assertEqual(find_unique_urls('HTTPS://PajLada.se//foo//bar/?a=B'), {'https://pajlada.se/foo/bar?a=B'})
+        self.assertEqual(find_unique_urls('http://pajlada.se:80 https://pajlada.se:8080'), {'http://pajlada.se', 'https://pajlada.se:8080'})
+
+    def test_find_urls_punctuation(self):
+        from pajbot.urls import find_urls
+
+        self.assertEqual(find_urls('check this out (pajlada.se/foo), or pajlada.com.'), ['http://pajlada.se/foo', 'http://pajlada.com'])
+        self.assertEqual(find_urls('https://en.wikipedia.org/wiki/Kappa_(emote)'), ['https://en.wikipedia.org/wiki/Kappa_(emote)'])
+        self.assertEqual(find_urls('"192.168.0.1/admin"'), ['http://192.168.0.1/admin'])
+
+        # Links glued to other characters are found inside the word
+        self.assertEqual(find_urls('!evil.com'), ['http://evil.com'])
+        self.assertEqual(find_urls('*evil.com*'), ['http://evil.com'])
+        self.assertEqual(find_urls('hi,evil.com'), ['http://evil.com'])
+        self.assertEqual(find_urls('...evil.com'), ['http://evil.com'])
+        self.assertEqual(find_urls('e_vil.com'), ['http://e_vil.com'])
+        self.assertEqual(find_urls('evil.com\u200b'), ['http://evil.com'])
+        self.assertEqual(find_urls('evil.com\u200bhi'), ['http://evil.com'])
+        self.assertEqual(find_urls('pajlada.se,evil.com'), ['http://pajlada.se', 'http://evil.com'])
+        self.assertEqual(find_urls('hi,HTTPS://evil.com:443/foo?a=1'), ['https://evil.com/foo?a=1'])
+
+    def test_find_urls_not_urls(self):
+        from pajbot.urls import find_urls
+
+        self.assertEqual(find_urls('no links here Kappa'), [])
+        self.assertEqual(find_urls('hello...there'), [])
+        self.assertEqual(find_urls('version 1.5 of the file.exe'), [])
+        self.assertEqual(find_urls('ftp://pajlada.se localhost'), [])
+        self.assertEqual(find_urls('http://localhost'), ['http://localhost'])
+
+    def test_url_parsed(self):
+        from pajbot.urls import find_urls
+
+        url, = find_urls('pajlada.se/foo?bar=1')
+        self.assertEqual(url.url, 'http://pajlada.se/foo?bar=1')
+        self.assertEqual(url.parsed.netloc, 'pajlada.se')
+        self.assertEqual(url.parsed.query, 'bar=1')
+
+
+class TestParticipantSet(unittest2.TestCase):
+    def test_add(self):
+        from pajbot.models.participants import ParticipantSet
+
+        participants = ParticipantSet()
+
+        self.assertTrue(participants.add('pajlada'))
+        self.assertTrue(participants.add('forsen', weight=5))
+        self.assertFalse(participants.add('pajlada'))
+
+        self.assertEqual(len(participants), 2)
+        self.assertTrue('forsen' in participants)
+        self.assertFalse('karl_kons' in participants)
+        self.assertEqual(participants.total_weight, 6)
+
+        participants.clear()
+        self.assertEqual(len(participants), 0)
+        self.assertEqual(participants.choice(), None)
+
+    def test_sample(self):
+        from pajbot.models.participants import ParticipantSet
+
+        participants = ParticipantSet()
+        for i in range(0, 100):
+            participants.add('user{}'.format(i))
+
+        winners = participants.sample(20)
+        self.assertEqual(len(winners), 20)
+        self.assertEqual(len(set(winners)), 20)
+        self.assertTrue(all(winner in participants for winner in winners))
+
+        self.assertEqual(len(participants.sample(500)), 100)
+
+
+class TestAPIBase(unittest2.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import http.server
+        import json
+        import socketserver
+        import threading
+        import time
+
+        cls.requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                cls.requests.append((self.path, self.client_address[1]))
+                status = 404 if self.path == '/missing' else 200
+                body = json.dumps({'path': self.path, 'n': len(cls.requests)}).encode('utf-8')
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if self.path == '/limited':
+                    self.send_header('Ratelimit-Remaining', '0')
+                    self.send_header('Ratelimit-Reset', str(int(time.time()) + 1))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        cls.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get_api(self, strict=True):
+        from pajbot.apiwrappers import APIBase
+
+        api = APIBase(strict=strict)
+        api.base_url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        api.headers = {}
+        return api
+
+    def test_keep_alive(self):
+        api = self.get_api()
+        num_requests = len(self.requests)
+
+        api.get(['one'])
+        api.get(['two'])
+
+        ports = set(port for path, port in self.requests[num_requests:])
+        self.assertEqual(len(ports), 1)
+
+    def test_cache(self):
+        from pajbot.apiwrappers import APIBase
+
+        api = self.get_api()
+        host = '127.0.0.1:{}'.format(self.server.server_address[1])
+        cache_hits = APIBase.get_metrics().get(host, {}).get('cache_hits', 0)
+
+        first = api.get(['cached'], cache_ttl=60)
+        second = api.get(['cached'], cache_ttl=60)
+        third = api.get(['cached'])
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        self.assertEqual(APIBase.get_metrics()[host]['cache_hits'], cache_hits + 1)
+
+    def test_http_error(self):
+        import urllib.error
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.get_api().get(['missing'])
+        self.assertEqual(context.exception.code, 404)
+        self.assertEqual(context.exception.read().decode('utf-8'), '{"path": "/missing", "n": ' + str(len(self.requests)) + '}')
+
+        self.assertEqual(self.get_api(strict=False).get(['missing']), None)
+
+    def test_rate_limit(self):
+        from pajbot.apiwrappers import TokenBucket
+
+        bucket = TokenBucket(rate=100, capacity=2)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertGreater(bucket.acquire(), 0)
+
+        api = self.get_api()
+        api.get(['limited'])
+        host = '127.0.0.1:{}'.format(self.server.server_address[1])
+        self.assertGreater(api.get_bucket(host).blocked_until, 0)
+
+
+class TestQueryStats(unittest2.TestCase):
+    def test_get_shape(self):
+        from pajbot.managers.querystats import QueryStats
+
+        self.assertEqual(QueryStats.get_shape('SELECT id\n  FROM tb_user WHERE username IN (%s, %s, %s)'),
+                'SELECT id FROM tb_user WHERE username IN (...)')
+        self.assertEqual(QueryStats.get_shape('SELECT id FROM tb_user WHERE username IN (?)'),
+                'SELECT id FROM tb_user WHERE username IN (...)')
+
+    def test_context(self):
+        from pajbot.managers.querystats import QueryStats
+
+        QueryStats.reset()
+        with QueryStats.context('message'):
+            with QueryStats.context('command'):
+                QueryStats.after_cursor_execute(FakeConnection(), None, 'SELECT 1', None, None, False)
+
+        report = QueryStats.get_report()
+        self.assertEqual(report['contexts']['message']['num_statements'], 1)
+        self.assertEqual(report['contexts']['command']['statements_histogram']['<=1'], 1)
+        self.assertEqual(report['shapes'][0]['shape'], 'SELECT 1')
+
+
+class TestMetricsManager(unittest2.TestCase):
+    def test_render(self):
+        from pajbot.managers.metrics import MetricsManager
+
+        counter = MetricsManager.counter('test_messages_total', 'Messages', ['type'])
+        histogram = MetricsManager.histogram('test_duration_seconds', 'Duration', buckets=(0.1, 1.0))
+        counter.reset()
+        histogram.reset()
+
+        counter.inc('pubmsg')
+        counter.inc('pubmsg', amount=2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        MetricsManager.add_collector('test', lambda: [('test_queue_size', 'gauge', 'Queue size', [({'queue': 'a"b'}, 4)])])
+
+        lines = MetricsManager.render().splitlines()
+        MetricsManager.remove_collector('test')
+
+        self.assertIn('# TYPE test_messages_total counter', lines)
+        self.assertIn('test_messages_total{type="pubmsg"} 3', lines)
+        self.assertIn('test_duration_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_duration_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('test_duration_seconds_count 2', lines)
+        self.assertIn('test_duration_seconds_sum 0.55', lines)
+        self.assertIn('test_queue_size{queue="a\\"b"} 4', lines)
+        self.assertIs(MetricsManager.counter('test_messages_total', 'Messages', ['type']), counter)
+
+
+class TestTMI(unittest2.TestCase):
+    def test_parse_line(self):
+        from pajbot.tmi import parse_line
+
+        event = parse_line('@display-name=Foo;emotes=25:0-4,12-16/1902:6-10;subscriber=1;system-msg=hi\\sthere\\:) :foo!foo@foo.tmi.twitch.tv PRIVMSG #pajlada :Kappa Keepo Kappa')
+        self.assertEqual(event.type, 'pubmsg')
+        self.assertEqual(event.source.user, 'foo')
+        self.assertEqual(event.target, '#pajlada')
+        self.assertEqual(event.arguments, ['Kappa Keepo Kappa'])
+        self.assertEqual(event.tags['display-name'], 'Foo')
+        self.assertEqual(event.tags['system-msg'], 'hi there;)')
+        self.assertEqual(event.tags.emotes, [('25', ((0, 4), (12, 16))), ('1902', ((6, 10), ))])
+        self.assertNotIn('login', event.tags)
+
+        event = parse_line('@emotes= :foo!foo@foo.tmi.twitch.tv PRIVMSG #pajlada :\x01ACTION dances\x01')
+        self.assertEqual(event.type, 'action')
+        self.assertEqual(event.arguments, ['dances'])
+        self.assertIsNone(event.tags['emotes'])
+        self.assertEqual(event.tags.emotes, [])
+
+        event = parse_line('@login=foo;msg-id=resub :tmi.twitch.tv USERNOTICE #pajlada')
+        self.assertEqual(event.type, 'usernotice')
+        self.assertEqual(event.arguments, [])
+        self.assertEqual(dict(event.tags), {'login': 'foo', 'msg-id': 'resub'})
+
+        self.assertEqual(parse_line(':foo!foo@foo.tmi.twitch.tv WHISPER pajbot :!points').arguments, ['!points'])
+        self.assertIsNone(parse_line('PING :tmi.twitch.tv'))
+        self.assertIsNone(parse_line(':tmi.twitch.tv 001 pajbot :Welcome, GLHF!'))
+
+    def test_from_list(self):
+        from pajbot.tmi import Tags
+
+        tags = Tags.from_list([{'key': 'emotes', 'value': '25:0-4'}, {'key': 'system-msg', 'value': 'a\\sb'}])
+        self.assertEqual(tags.emotes, [('25', ((0, 4), ))])
+        # irc.client has already unescaped the values
+        self.assertEqual(tags['system-msg'], 'a\\sb')
+
+
+class TestMessageFeatures(unittest2.TestCase):
+    def test_features(self):
+        from pajbot.models.message import MessageFeatures
+
+        features = MessageFeatures('Kappa Keepo Kappa www.google.com')
+        self.assertEqual(features.length, 32)
+        self.assertEqual(features.lower_tokens, ['kappa', 'keepo', 'kappa', 'www.google.com'])
+        self.assertEqual(features.urls, ['http://www.google.com'])
+        self.assertEqual(features.emote_codes, set())
+
+        features.emotes = [{'code': 'Kappa', 'count': 2}, {'code': 'Keepo', 'count': 1}]
+        self.assertEqual(features.emote_codes, {'Kappa', 'Keepo'})
+        self.assertEqual(MessageFeatures('').non_alnum_ratio, 0.0)
+        self.assertAlmostEqual(MessageFeatures('a!!!').non_alnum_ratio, 0.75)
+
+    def test_trigger(self):
+        from pajbot.managers.handler import HandlerManager
+        from pajbot.models.message import MessageFeatures
+
+        received = []
+
+        def old_handler(source, message):
+            received.append(('old', message))
+
+        def new_handler(source, message, features=None):
+            received.append(('new', features))
+
+        features = MessageFeatures('hello')
+        HandlerManager.init_handlers()
+        HandlerManager.add_handler('on_pubmsg', old_handler)
+        HandlerManager.add_handler('on_pubmsg', new_handler)
+        HandlerManager.trigger('on_pubmsg', None, 'hello', features=features)
+
+        self.assertIn(('old', 'hello'), received)
+        self.assertIn(('new', features), received)
+
+
+class TestChannelManager(unittest2.TestCase):
+    def test_context(self):
+        from pajbot.managers.channel import Channel
+        from pajbot.managers.channel import ChannelManager
+        from pajbot.managers.handler import HandlerManager
+        from pajbot.streamhelper import StreamHelper
+
+        received = []
+
+        def handler(name):
+            def on_stream_start():
+                received.append((name, StreamHelper.get_streamer()))
+            return on_stream_start
+
+        forsen = Channel('forsen')
+        pajlada = Channel('pajlada')
+        for channel in (forsen, pajlada):
+            with ChannelManager.context(channel):
+                HandlerManager.init_handlers()
+                HandlerManager.add_handler('on_stream_start', handler(channel.streamer))
+
+        self.assertIsNone(ChannelManager.current())
+
+        with ChannelManager.context(forsen):
+            HandlerManager.trigger('on_stream_start')
+            wrapped = ChannelManager.wrap(HandlerManager.trigger)
+        self.assertEqual(received, [('forsen', 'forsen')])
+
+        with ChannelManager.context(pajlada):
+            wrapped('on_stream_start')
+        self.assertEqual(received, [('forsen', 'forsen'), ('forsen', 'forsen')])
+
+
+class TestPleblistQueue(unittest2.TestCase):
+    def test_queue(self):
+        from pajbot.models.pleblist import PleblistQueue
+
+        songs = [
+                {'id': 5, 'youtube_id': 'dQw4w9WgXcQ', 'skip_after': None, 'info': {'title': 'Never Gonna Give You Up', 'duration': 213, 'default_thumbnail': 'x.jpg'}},
+                {'id': 3, 'youtube_id': 'abcdefghijk', 'skip_after': 60, 'info': None},
+                ]
+        queue = PleblistQueue(7, {'stream_id': 2, 'songs': songs})
+
+        song = queue.current_song
+        self.assertIs(song, queue.current_song)
+        self.assertEqual(song.id, 5)
+        self.assertEqual(song.stream_id, 2)
+        self.assertEqual(song.link, 'youtu.be/dQw4w9WgXcQ')
+        self.assertEqual(song.song_info.title, 'Never Gonna Give You Up')
+        self.assertEqual(song.jsonify(), songs[0])
+        self.assertEqual(queue.get_songs_after(4), [songs[0]])
+
+        self.assertIsNone(PleblistQueue(8, {'stream_id': None, 'songs': []}).current_song)
+
+
+def create_fake_redis():
+    import fakeredis
+    import redis
+
+    class FakePipeline(redis.client.Pipeline):
+        def load_scripts(self):
+            # fakeredis doesn't know SCRIPT EXISTS, which pipelines use to check if their scripts are loaded
+            for script in self.scripts:
+                script.sha = self.immediate_execute_command('SCRIPT LOAD', script.script)
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def pipeline(self, transaction=True, shard_hint=None):
+            return FakePipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+    return FakeRedis(decode_responses=True)
+
+
+class RedisTestCase(unittest2.TestCase):
+    """ Every test runs against an empty fake redis server """
+
+    def setUp(self):
+        from pajbot.managers.redis import RedisManager
+        from pajbot.streamhelper import StreamHelper
+
+        self.old_redis = RedisManager.redis
+        RedisManager.redis = self.redis = create_fake_redis()
+        RedisManager.scripts = {}
+        self.redis.flushall()
+        StreamHelper.init_web('pajlada')
+
+    def tearDown(self):
+        from pajbot.managers.redis import RedisManager
+
+        self.redis.flushall()
+        RedisManager.redis = self.old_redis
+        RedisManager.scripts = {}
+
+
+class TestLeaderboardManager(RedisTestCase):
+    def test_add_minutes(self):
+        from pajbot.managers.leaderboard import LeaderboardManager
+
+        self.redis.hset('pajlada:users:username_raw', 'forsen', 'Forsen')
+
+        with self.redis.pipeline() as pipeline:
+            LeaderboardManager.add_minutes(pipeline, ['forsen', 'pajlada'], 5, True)
+            LeaderboardManager.add_minutes(pipeline, ['forsen'], 5, True)
+            LeaderboardManager.add_minutes(pipeline, ['pajlada'], 10, False)
+            pipeline.execute()
+
+        self.assertEqual(LeaderboardManager.get_top_users('minutes_in_chat_online', 10), [('Forsen', 10), ('pajlada', 5)])
+        self.assertEqual(LeaderboardManager.get_top_users('minutes_in_chat_offline', 10), [('pajlada', 10)])
+
+    def test_duel_stats(self):
+        from pajbot.managers.leaderboard import LeaderboardManager
+
+        class UserDuelStats:
+            def __init__(self, user_id, duels_won, duels_lost, profit):
+                self.user_id = user_id
+                self.duels_won = duels_won
+                self.duels_lost = duels_lost
+                self.duels_total = duels_won + duels_lost
+                self.profit = profit
+
+        LeaderboardManager.update_duel_stats(UserDuelStats(1, 6, 2, 500))
+        LeaderboardManager.update_duel_stats(UserDuelStats(2, 1, 7, -300))
+
+        self.assertEqual(LeaderboardManager.get_top('duels_won', 2), [('1', 6), ('2', 1)])
+        self.assertEqual(LeaderboardManager.get_top('duel_profit', 1, reverse=True), [('2', -300)])
+        self.assertEqual(LeaderboardManager.get_top('duel_winrate', 10, score_cast_func=float), [('1', 75.0)])
+        self.assertEqual(LeaderboardManager.get_top('duel_winrate_bottom', 10, reverse=True, score_cast_func=float), [('2', 12.5)])
+
+        # Not enough duels won to stay on the top winrate board
+        LeaderboardManager.update_duel_stats(UserDuelStats(1, 4, 2, 500))
+        self.assertEqual(LeaderboardManager.get_top('duel_winrate', 10), [])
+
+
+def init_test_database(*models):
+    """ Create the tables of the given models in an empty in-memory SQLite database """
+    from sqlalchemy import event
+
+    from pajbot.managers.db import DBManager
+
+    DBManager.init('sqlite://')
+    engine = DBManager.get_engine()
+
+    @event.listens_for(engine, 'connect')
+    def add_mysql_collations(dbapi_connection, connection_record):
+        dbapi_connection.create_collation('utf8mb4_bin', lambda a, b: (a > b) - (a < b))
+
+    for model in models:
+        model.__table__.create(engine)
+
+
+class TestPointsManager(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        from pajbot.models.user import User
+
+        init_test_database(User)
+
+    def get_sql_points(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            return dict(db_session.query(User.username, User.points))
+
+    def test_add_and_spend(self):
+        from pajbot.managers.points import PointsManager
+
+        self.assertIsNone(PointsManager.add_points('forsen', 10))
+        self.assertIsNone(PointsManager.spend_points('forsen', 10))
+
+        self.assertEqual(PointsManager.add_points('forsen', 10, seed=100), 110)
+        self.assertEqual(PointsManager.add_points('forsen', -20, seed=5000), 90)
+        self.assertEqual(PointsManager.spend_points('forsen', 100), (False, 90))
+        self.assertEqual(PointsManager.spend_points('forsen', 40), (True, 50))
+        self.assertEqual(PointsManager.get_points('forsen'), 50)
+        self.assertEqual(PointsManager.seed_points('forsen', 1000), 50)
+
+        self.assertEqual(self.redis.smembers(PointsManager.get_dirty_key()), {'forsen'})
+        self.assertEqual([entry.split(' ')[1:] for entry in PointsManager.get_log()], [
+            ['forsen', '10', '110'],
+            ['forsen', '-20', '90'],
+            ['forsen', '-40', '50'],
+            ])
+
+    def test_checkpoint(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.points import PointsManager
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            for username in ('forsen', 'pajlada'):
+                db_session.add(User(username))
+
+        PointsManager.add_points('forsen', 10, seed=0)
+        PointsManager.add_points('pajlada', 20, seed=0)
+        PointsManager.add_points('nobody', 30, seed=0)
+
+        self.assertEqual(PointsManager.checkpoint(), 2)
+        self.assertEqual(self.get_sql_points(), {'forsen': 10, 'pajlada': 20})
+
+        # Users without a row stay dirty until they have one
+        self.assertEqual(self.redis.smembers(PointsManager.get_dirty_key()), {'nobody'})
+        self.assertFalse(self.redis.exists(PointsManager.get_processing_key()))
+        self.assertEqual(PointsManager.reconcile(), [])
+
+        with DBManager.create_session_scope() as db_session:
+            db_session.add(User('nobody'))
+        PointsManager.add_points('forsen', 5)
+
+        self.assertEqual(PointsManager.checkpoint(), 2)
+        self.assertEqual(self.get_sql_points(), {'forsen': 15, 'pajlada': 20, 'nobody': 30})
+        self.assertEqual(self.redis.smembers(PointsManager.get_dirty_key()), set())
+        self.assertEqual(PointsManager.checkpoint(), 0)
+
+    def test_reconcile(self):
+        from pajbot.managers.points import PointsManager
+
+        self.redis.hset(PointsManager.get_points_key(), 'forsen', 500)
+        self.assertEqual(PointsManager.reconcile(fix=True), [('forsen', 500, None)])
+        self.assertEqual(self.redis.smembers(PointsManager.get_dirty_key()), {'forsen'})
+
+
+class TestHighlightManager(RedisTestCase):
+    def test_add(self):
+        import datetime
+
+        from pajbot.managers.highlight import HighlightManager
+
+        day = datetime.datetime(2016, 6, 12, 16, 41)
+
+        # The index is left alone until it has been built
+        self.assertIsNone(HighlightManager.on_highlight_added(day))
+        self.assertFalse(self.redis.exists(HighlightManager.get_key()))
+
+        self.redis.set(HighlightManager.get_built_key(), 1)
+        self.assertEqual(HighlightManager.on_highlight_added(day), 1)
+        self.assertEqual(HighlightManager.on_highlight_added(day), 2)
+        self.assertEqual(HighlightManager.get_highlight_counts(), {day.date(): 2})
+
+        HighlightManager.on_highlight_removed(day)
+        HighlightManager.on_highlight_removed(day)
+        self.assertEqual(HighlightManager.get_highlight_counts(), {})
+
+
+class TestUserRouletteStats(unittest2.TestCase):
+    def test_add_roulette(self):
+        from pajbot.models.roulette import UserRouletteStats
+
+        stats = UserRouletteStats(1)
+        for points in (10, 50, -20, -30, -5, 100, -40):
+            stats.add_roulette(points)
+
+        self.assertEqual(stats.num_roulettes, 7)
+        self.assertEqual(stats.num_wins, 3)
+        self.assertEqual(stats.num_losses, 4)
+        self.assertEqual(stats.profit, 65)
+        self.assertEqual(stats.total_points, 255)
+        self.assertEqual(stats.biggest_win, 100)
+        self.assertEqual(stats.biggest_loss, -40)
+        self.assertEqual(stats.current_streak, -1)
+        self.assertEqual(stats.longest_winstreak, 2)
+        self.assertEqual(stats.longest_losestreak, 3)
+        self.assertAlmostEqual(stats.winrate, 3 / 7)
+
+    def test_no_roulettes(self):
+        from pajbot.models.roulette import UserRouletteStats
+
+        stats = UserRouletteStats(1)
+        self.assertEqual(stats.winrate, 0)
+        self.assertEqual(stats.longest_winstreak, 0)
+        self.assertEqual(stats.longest_losestreak, 0)
+
+
+class TestUserProfile(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        import os
+
+        from flask import Flask
+        from jinja2 import ChoiceLoader
+        from jinja2 import DictLoader
+
+        import pajbot.web.common.filters
+        import pajbot.web.routes.base.user
+        from pajbot.models.duel import UserDuelStats
+        from pajbot.models.roulette import Roulette
+        from pajbot.models.roulette import UserRouletteStats
+        from pajbot.models.user import User
+
+        init_test_database(User, UserDuelStats, Roulette, UserRouletteStats)
+
+        app = Flask(__name__, template_folder=os.path.abspath('templates'))
+        # Only the profile itself is tested, not the menu/assets of the layout
+        app.jinja_loader = ChoiceLoader([DictLoader({'layout.html': '{% block body %}{% endblock %}'}), app.jinja_loader])
+        app.module_manager = {}
+        app.context_processor(lambda: {'bot': {'name': 'pajbot'}})
+        pajbot.web.common.filters.init(app)
+        pajbot.web.routes.base.user.init(app)
+        self.client = app.test_client()
+
+    def test_profile(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.models.roulette import Roulette
+        from pajbot.models.roulette import UserRouletteStats
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            user = User('forsen')
+            db_session.add(user)
+            db_session.flush()
+            stats = UserRouletteStats(user.id)
+            for points in (1337, -420):
+                db_session.add(Roulette(user.id, points))
+                stats.add_roulette(points)
+            db_session.add(stats)
+        self.redis.hset('pajlada:users:last_seen', 'forsen', 1500000000)
+
+        response = self.client.get('/user/forsen')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        self.assertIn('User Profile - forsen', body)
+        self.assertIn('Roulette history', body)
+        self.assertIn('50.00%', body)
+        self.assertIn('1337', body)
+        self.assertIn('-420', body)
+
+        self.assertEqual(self.client.get('/user/nobody').status_code, 404)
+
+
+class TestSyncSubs(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        from sqlalchemy import event
+
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.user import UserManager
+        from pajbot.models.user import User
+
+        init_test_database(User)
+
+        self.old_chunk_size = UserManager.SYNC_CHUNK_SIZE
+        UserManager.SYNC_CHUNK_SIZE = 2
+
+        self.updates = []
+
+        @event.listens_for(DBManager.get_engine(), 'before_cursor_execute')
+        def record_updates(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE'):
+                self.updates.append(parameters)
+
+        with DBManager.create_session_scope() as db_session:
+            for username in ('forsen', 'pajlada', 'nymn', 'reckful', 'nani', 'xqc'):
+                user = User(username)
+                user.subscriber = username in ('forsen', 'pajlada', 'nymn')
+                db_session.add(user)
+
+    def tearDown(self):
+        from pajbot.managers.user import UserManager
+
+        UserManager.SYNC_CHUNK_SIZE = self.old_chunk_size
+
+        super().tearDown()
+
+    def get_subs(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            return set(username for username, in db_session.query(User.username).filter_by(subscriber=True))
+
+    def test_sync_subs(self):
+        from pajbot.managers.user import UserManager
+
+        added, removed = UserManager.sync_subs(None, ['Forsen', 'reckful', 'nani', 'xqc'])
+        self.assertEqual(added, {'reckful', 'nani', 'xqc'})
+        self.assertEqual(removed, {'pajlada', 'nymn'})
+        self.assertEqual(self.get_subs(), {'forsen', 'reckful', 'nani', 'xqc'})
+
+        # The removed subs fit in one chunk, the added subs are split up in two
+        self.assertEqual(len(self.updates), 3)
+        self.assertTrue(all(len(parameters) <= 1 + UserManager.SYNC_CHUNK_SIZE for parameters in self.updates))
+
+        # Nothing is written if the subscribers did not change
+        self.updates = []
+        self.assertEqual(UserManager.sync_subs(None, ['forsen', 'reckful', 'nani', 'xqc']), (set(), set()))
+        self.assertEqual(self.updates, [])
+
+        # Subscribers without a row are created
+        self.assertEqual(UserManager.sync_subs(None, ['forsen', 'reckful', 'nani', 'xqc', 'newuser']), ({'newuser'}, set()))
+        self.assertEqual(self.get_subs(), {'forsen', 'reckful', 'nani', 'xqc', 'newuser'})
+
+    def test_cache_invalidation(self):
+        from pajbot.managers.user import UserManager
+        from pajbot.models.user import NoCacheHit
+        from pajbot.models.user import User
+        from pajbot.models.user import UserSQLCache
+
+        for username, subscriber in (('forsen', True), ('pajlada', True), ('reckful', False)):
+            user = User(username)
+            user.subscriber = subscriber
+            UserSQLCache.save(user)
+
+        UserManager.sync_subs(None, ['forsen', 'reckful'])
+
+        self.assertTrue(UserSQLCache.get('forsen', 'subscriber'))
+        with self.assertRaises(NoCacheHit):
+            UserSQLCache.get('pajlada', 'subscriber')
+        with self.assertRaises(NoCacheHit):
+            UserSQLCache.get('reckful', 'subscriber')
+
+        UserSQLCache._clear_cache()
+
+
+class TestUserScripts(RedisTestCase):
+    def test_use_warning(self):
+        from pajbot.models.user import UserCombined
+
+        class WarningModule:
+            settings = {
+                    'total_chances': 2,
+                    'length': 3600,
+                    'base_timeout': 10,
+                    'redis_prefix': '',
+                    }
+
+        user = UserCombined('forsen')
+        self.assertEqual(user.timeout(600, WarningModule), (10, 'timed out for 10 seconds (warning)'))
+        self.assertEqual(user.timeout(600, WarningModule), (20, 'timed out for 20 seconds (warning)'))
+        self.assertEqual(user.timeout(600, WarningModule), (600, 'timed out for 600 seconds'))
+        self.assertEqual(user.timeout(600, WarningModule, use_warnings=False), (600, 'timed out for 600 seconds'))
+
+        warning_keys = user.get_warning_keys(2, '')
+        self.assertEqual(user.get_warnings(self.redis, warning_keys), ['1', '1'])
+        for key in warning_keys:
+            self.assertTrue(0 < self.redis.ttl(key) <= 3600)
+
+        # An expired warning can be used again
+        self.redis.delete(warning_keys[0])
+        self.assertEqual(user.timeout(600, WarningModule), (20, 'timed out for 20 seconds (warning)'))
+
+    def test_spend_tokens(self):
+        from pajbot.models.user import UserCombined
+
+        key = 'pajlada:users:tokens'
+
+        user = UserCombined('forsen')
+        user.tokens = 5
+        self.assertEqual(self.redis.zscore(key, 'forsen'), 5)
+
+        self.assertTrue(user._spend_tokens(3))
+        self.assertEqual(user.tokens, 2)
+        self.assertFalse(user._spend_tokens(3))
+        self.assertEqual(user.tokens, 2)
+        self.assertEqual(self.redis.zscore(key, 'forsen'), 2)
+
+        # Users without any tokens are removed from the sorted set
+        self.assertTrue(user._spend_tokens(2))
+        self.assertEqual(user.tokens, 0)
+        self.assertIsNone(self.redis.zscore(key, 'forsen'))
+
+        self.assertFalse(UserCombined('nymn')._spend_tokens(1))
+
+    def test_kvi(self):
+        from pajbot.managers.kvi import KVIManager
+
+        kvi = KVIManager()
+        self.assertEqual(kvi['active_subs'].get(), 0)
+        self.assertEqual(kvi['active_subs'].inc(), 1)
+        self.assertEqual(kvi['active_subs'].inc(), 2)
+        self.assertEqual(kvi['active_subs'].dec(), 1)
+        self.assertEqual(kvi['active_subs'].dec(), 0)
+        self.assertEqual(kvi['active_subs'].dec(), -1)
+        self.assertEqual(str(kvi['active_subs']), '-1')
+
+        kvi['active_subs'].set(10)
+        self.assertEqual(kvi['active_subs'].add(5), 15)
+        self.assertEqual(self.redis.hget('pajlada:kvi', 'active_subs'), '15')
+
+
+class FakeEmotes:
+    def __init__(self):
+        self.counted = []
+        self.tagged = []
+
+    def count_emotes(self, emote_counts, pipeline):
+        self.counted.append(emote_counts)
+
+    def add_user_tags(self, source, new_user_tags, pipeline):
+        if len(new_user_tags) > 0:
+            self.tagged.append((source.username, new_user_tags))
+
+
+class TestBackgroundMessageManager(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        import threading
+
+        from pajbot.managers.backgroundmessage import BackgroundMessageManager
+        from pajbot.managers.handler import HandlerManager
+
+        HandlerManager.init_handlers()
+
+        class RecordingBackgroundMessageManager(BackgroundMessageManager):
+            def handle_batch(manager, batch):
+                self.batches.append([message.message for message in batch])
+                super().handle_batch(batch)
+
+        class FakeBot:
+            emotes = FakeEmotes()
+
+        self.batches = []
+        self.background = []
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+        def on_message_background(source, message, emotes, whisper, urls, event):
+            self.background.append((source.username, message))
+            self.unblocked.wait(5)
+
+        HandlerManager.add_handler('on_message_background', on_message_background)
+
+        self.bot = FakeBot()
+        self.manager = RecordingBackgroundMessageManager(self.bot)
+
+    def tearDown(self):
+        self.unblocked.set()
+        self.manager.wait()
+
+        super().tearDown()
+
+    def create_message(self, username, message, emotes=[], whisper=False, handled=True, new_user_tags=[]):
+        from pajbot.managers.backgroundmessage import BackgroundMessage
+        from pajbot.models.user import UserCombined
+
+        return BackgroundMessage(UserCombined(username), message, emotes, new_user_tags, whisper, [], None, handled=handled)
+
+    def test_handle_batch(self):
+        self.manager.handle_batch([
+            self.create_message('forsen', 'Kappa Kappa', emotes=[{'code': 'Kappa', 'count': 2}], new_user_tags=['pleb']),
+            self.create_message('nymn', 'Kappa', emotes=[{'code': 'Kappa', 'count': 5}], whisper=True),
+            self.create_message('pajlada', 'Kappa PogChamp', emotes=[{'code': 'Kappa', 'count': 1}, {'code': 'PogChamp', 'count': 1}], handled=False),
+            ])
+
+        # The emotes of a batch are counted together, whispers are not counted
+        self.assertEqual(self.bot.emotes.counted, [{'Kappa': 3, 'PogChamp': 1}])
+        self.assertEqual(self.bot.emotes.tagged, [('forsen', ['pleb'])])
+
+        # Messages that were stopped by a handler are only counted
+        self.assertEqual(set(self.redis.hkeys('pajlada:users:last_seen')), {'forsen', 'nymn'})
+        self.assertEqual(set(self.redis.hkeys('pajlada:users:last_active')), {'forsen', 'nymn'})
+        self.assertEqual(self.background, [('forsen', 'Kappa Kappa'), ('nymn', 'Kappa')])
+
+    def test_cached_last_seen(self):
+        from pajbot.managers.backgroundmessage import BackgroundMessage
+
+        user = self.create_message('forsen', 'hello').source
+        user.redis_load()
+        self.assertTrue(user.new)
+
+        message = BackgroundMessage(user, 'hello', [], [], False, [], None)
+        self.manager.add(message)
+
+        # The cached values are updated right away, before the background thread writes them to redis
+        self.assertFalse(user.new)
+        self.assertEqual(user.values['last_seen'], message.timestamp)
+        self.assertEqual(user.values['last_active'], message.timestamp)
+
+        self.assertTrue(self.manager.wait())
+        self.assertEqual(float(self.redis.hget('pajlada:users:last_seen', 'forsen')), message.timestamp)
+
+        # Messages that were stopped by a handler don't count
+        user = self.create_message('nymn', 'hello').source
+        user.redis_load()
+        self.manager.add(BackgroundMessage(user, 'hello', [], [], False, [], None, handled=False))
+        self.assertTrue(user.new)
+
+    def test_batching(self):
+        import time
+
+        self.unblocked.clear()
+        self.manager.add(self.create_message('forsen', 'first'))
+
+        # Wait until the background thread is busy with the first message
+        for i in range(0, 500):
+            if len(self.background) > 0:
+                break
+            time.sleep(0.01)
+
+        for i in range(0, 5):
+            self.manager.add(self.create_message('forsen', str(i)))
+        self.assertFalse(self.manager.wait(timeout=0.05))
+
+        self.unblocked.set()
+        self.assertTrue(self.manager.wait())
+
+        # The messages that were queued up while the first batch was handled are handled in one batch, in order
+        self.assertEqual(self.batches, [['first'], ['0', '1', '2', '3', '4']])
+        self.assertEqual([message for username, message in self.background], ['first', '0', '1', '2', '3', '4'])
+
+
+class TestQuestReward(RedisTestCase):
+    def test_finish_quest(self):
+        from pajbot.managers.handler import HandlerManager
+        from pajbot.models.user import UserCombined
+        from pajbot.modules.quests.base import BaseQuest
+
+        HandlerManager.init_handlers()
+        whispers = []
+        HandlerManager.add_handler('send_whisper', lambda username, message: whispers.append(username))
+
+        class QuestModule:
+            settings = {
+                    'reward_type': 'tokens',
+                    'reward_amount': 5,
+                    'max_tokens': 12,
+                    }
+
+        quest = BaseQuest()
+        quest.quest_module = QuestModule
+
+        forsen = UserCombined('forsen')
+        forsen.tokens = 4
+        # Tokens that were spent somewhere else after the user was loaded are not overwritten
+        self.redis.zincrby('pajlada:users:tokens', 'forsen', -2)
+
+        quest.finish_quest(self.redis, forsen)
+        self.assertEqual(self.redis.zscore('pajlada:users:tokens', 'forsen'), 7)
+        self.assertEqual(forsen.tokens, 7)
+
+        # Finishing the same quest again does not give out another reward
+        quest.finish_quest(self.redis, forsen)
+        self.assertEqual(forsen.tokens, 7)
+
+        nymn = UserCombined('nymn')
+        nymn.tokens = 10
+        quest.finish_quest(self.redis, nymn)
+        self.assertEqual(nymn.tokens, 12)
+        self.assertEqual(self.redis.zscore('pajlada:users:tokens', 'nymn'), 12)
+
+        self.assertEqual(whispers, ['forsen', 'nymn'])
+
+
+class TestLineFarming(RedisTestCase):
+    def test_on_pubmsg(self):
+        from pajbot.models.user import UserCombined
+        from pajbot.modules.linefarming import LineFarmingModule
+
+        class Bot:
+            is_online = True
+
+        module = LineFarmingModule()
+        module.bot = Bot
+        module.settings = {'count_offline': False}
+
+        user = UserCombined('forsen')
+        self.assertEqual(user.num_lines, 0)
+        # Lines counted somewhere else after the user was loaded are not overwritten
+        self.redis.zincrby('pajlada:users:num_lines', 'forsen', 5)
+
+        module.on_pubmsg(user, 'hello')
+        self.assertEqual(user.num_lines, 6)
+        self.assertEqual(self.redis.zscore('pajlada:users:num_lines', 'forsen'), 6)
+
+        Bot.is_online = False
+        module.on_pubmsg(user, 'hello')
+        self.assertEqual(user.num_lines, 6)
+
+        module.settings['count_offline'] = True
+        module.on_pubmsg(user, 'hello')
+        self.assertEqual(self.redis.zscore('pajlada:users:num_lines', 'forsen'), 7)
+
+
+class TestPleblistWait(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        import json
+
+        from pajbot.models.pleblist import PleblistManager
+
+        PleblistManager.queues = {}
+        self.redis.hmset('pajlada:pleblist:queue', {'version': 3, 'data': json.dumps({'stream_id': 1, 'songs': []})})
+
+    def test_timeout(self):
+        from pajbot.models.pleblist import PleblistManager
+
+        self.assertEqual(PleblistManager.wait_for_queue(2).version, 3)
+        self.assertEqual(PleblistManager.wait_for_queue(3, timeout=0.05).version, 3)
+
+    def test_max_waiters(self):
+        import threading
+        import time
+
+        from pajbot.models.pleblist import PleblistManager
+
+        old_waiters = PleblistManager.waiters
+        PleblistManager.waiters = threading.BoundedSemaphore(1)
+        try:
+            PleblistManager.waiters.acquire()
+
+            # Someone else is waiting already, so the queue is returned right away
+            start = time.time()
+            self.assertEqual(PleblistManager.wait_for_queue(3, timeout=5).version, 3)
+            self.assertLess(time.time() - start, 1)
+
+            PleblistManager.waiters.release()
+            self.assertEqual(PleblistManager.wait_for_queue(3, timeout=0.05).version, 3)
+            self.assertTrue(PleblistManager.waiters.acquire(blocking=False))
+        finally:
+            PleblistManager.waiters = old_waiters
+
+    def test_api_requires_login(self):
+        import time
+
+        import pajbot.web.utils
+        from pajbot.models.pleblist import PleblistManager
+        from pajbot.web import app
+        from pajbot.web.routes.api.pleblist import get_queue
+
+        old_bot_config = getattr(app, 'bot_config', None)
+        app.bot_config = {'web': {'pleblist_password': 'hunter2', 'pleblist_password_salt': 'salt'}}
+        old_timeout = PleblistManager.WAIT_TIMEOUT
+        PleblistManager.WAIT_TIMEOUT = 0.2
+        try:
+            for cookie, should_wait in ((None, False), ('bad', False), (pajbot.web.utils.create_pleblist_login(app.bot_config), True)):
+                headers = {'Cookie': 'password=' + cookie} if cookie else {}
+                with app.test_request_context('/api/v1/pleblist/list?version=3', headers=headers):
+                    start = time.time()
+                    self.assertEqual(get_queue().version, 3)
+                    self.assertEqual(time.time() - start >= 0.2, should_wait)
+        finally:
+            PleblistManager.WAIT_TIMEOUT = old_timeout
+            app.bot_config = old_bot_config
+
+
+def create_fake_websocket_client(topics=None, batch=False):
+    from pajbot.managers.websocket import BackloggedProducer
+
+    class FakeWebSocketClient(BackloggedProducer):
+        def __init__(self):
+            self.topics = topics
+            self.batch = batch
+            self.sent = []
+
+        def sendMessage(self, payload, isBinary):
+            self.sent.append(payload)
+
+    return FakeWebSocketClient()
+
+
+class TestWebSocketManager(unittest2.TestCase):
+    def setUp(self):
+        from pajbot.managers.websocket import WebSocketManager
+
+        class FakeReactor:
+            def __init__(reactor):
+                reactor.calls = []
+
+            def callFromThread(reactor, f, *args):
+                reactor.calls.append((f, args))
+
+            def callLater(reactor, delay, f):
+                pass
+
+        class FakeServer:
+            def __init__(server):
+                server.clients = []
+                server.reactor = FakeReactor()
+
+        class FakeBot:
+            config = {}
+
+        self.manager = WebSocketManager(FakeBot)
+        self.manager.server = FakeServer()
+
+    def test_flush(self):
+        import json
+
+        everything = create_fake_websocket_client()
+        emotes = create_fake_websocket_client(topics={'new_emote'}, batch=True)
+        nothing = create_fake_websocket_client(topics=set())
+        for client in (everything, emotes, nothing):
+            client.init_backlog(self.manager)
+            self.manager.server.clients.append(client)
+
+        self.manager.emit('new_emote', {'code': 'Kappa'})
+        self.manager.emit('notification', {'message': 'hi'})
+        self.manager.emit('new_emote', {'code': 'PogChamp'})
+
+        # Only one flush is scheduled for all of the events
+        self.assertEqual(len(self.manager.server.reactor.calls), 1)
+        self.manager.flush()
+
+        self.assertEqual([json.loads(payload.decode('utf8'))['event'] for payload in everything.sent], ['new_emote', 'notification', 'new_emote'])
+        self.assertEqual(len(emotes.sent), 1)
+        self.assertEqual([event['data']['code'] for event in json.loads(emotes.sent[0].decode('utf8'))], ['Kappa', 'PogChamp'])
+        self.assertEqual(nothing.sent, [])
+
+        metrics = self.manager.get_metrics()
+        self.assertEqual((metrics['emitted'], metrics['batches'], metrics['batched_events'], metrics['queued']), (3, 1, 3, 0))
+        self.assertIn(('pajbot_websocket_batches_total', 'counter', 'Number of flushes that sent events to the websocket clients', [({}, 1)]), self.manager.collect_metrics())
+
+        # The next event schedules a new flush
+        self.manager.emit('notification', {'message': 'hi'})
+        self.assertEqual(len(self.manager.server.reactor.calls), 2)
+
+    def test_full_queue(self):
+        self.manager.MAX_QUEUE_SIZE = 2
+        for i in range(0, 3):
+            self.manager.emit('test', {'i': i})
+
+        self.assertEqual([data['i'] for event, data in self.manager.queue], [1, 2])
+        self.assertEqual(self.manager.get_metrics()['dropped'], 1)
+
+    def test_backlog(self):
+        client = create_fake_websocket_client()
+        client.init_backlog(self.manager)
+        client.backlog = type(client.backlog)(maxlen=2)
+
+        client.pauseProducing()
+        client.send_payloads([b'1', b'2'])
+        client.send_payloads([b'3'])
+        self.assertEqual(client.sent, [])
+        self.assertEqual(self.manager.metrics['dropped'], 1)
+
+        # The oldest payload was dropped
+        client.resumeProducing()
+        self.assertEqual(client.sent, [b'2', b'3'])
+
+        client.send_payloads([b'4'])
+        self.assertEqual(client.sent, [b'2', b'3', b'4'])
+
+
+class TestCommandsSnapshot(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        import pajbot.web.utils
+
+        self.builds = 0
+
+        def build_commands_json():
+            self.builds += 1
+            return '[{{"main_alias":"build{}"}}]'.format(self.builds)
+
+        self.old_build_commands_json = pajbot.web.utils.build_commands_json
+        pajbot.web.utils.build_commands_json = build_commands_json
+        pajbot.web.utils.commands_snapshot = None
+
+    def tearDown(self):
+        import pajbot.web.utils
+
+        pajbot.web.utils.build_commands_json = self.old_build_commands_json
+        pajbot.web.utils.commands_snapshot = None
+
+        super().tearDown()
+
+    def test_snapshot(self):
+        import pajbot.web.utils
+        from pajbot.managers.command import CommandManager
+
+        snapshot = pajbot.web.utils.get_commands_snapshot()
+        self.assertEqual(snapshot['commands'], [{'main_alias': 'build1'}])
+        self.assertTrue(snapshot['etag'].startswith('0-'))
+
+        # The snapshot is reused until the version changes
+        self.assertIs(pajbot.web.utils.get_commands_snapshot(), snapshot)
+        self.assertEqual(self.builds, 1)
+
+        # Other processes read the snapshot from redis instead of building it again
+        pajbot.web.utils.commands_snapshot = None
+        self.assertEqual(pajbot.web.utils.get_commands_snapshot(), snapshot)
+        self.assertEqual(self.builds, 1)
+
+        self.redis.incr(CommandManager.get_version_key())
+        new_snapshot = pajbot.web.utils.get_commands_snapshot()
+        self.assertEqual(self.builds, 2)
+        self.assertEqual(new_snapshot['commands'], [{'main_alias': 'build2'}])
+        self.assertTrue(new_snapshot['etag'].startswith('1-'))
+        self.assertIs(pajbot.web.utils.get_cached_commands(), new_snapshot['commands'])
+
+        # The snapshot is built again if it expired
+        self.redis.delete('pajlada:cache:commands_snapshot')
+        pajbot.web.utils.get_commands_snapshot()
+        self.assertEqual(self.builds, 3)
+
+
+class TestJsonifyList(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        init_test_database(User)
+
+        with DBManager.create_session_scope() as db_session:
+            for i in range(0, 150):
+                db_session.add(User('user{}'.format(i)))
+
+    def jsonify_list(self, url, query, **options):
+        import json
+
+        from flask import Response
+
+        import pajbot.web.utils
+        from pajbot.web import app
+
+        with app.test_request_context(url):
+            payload = pajbot.web.utils.jsonify_list('users', query, base_url='/users',
+                    jsonify_method=lambda users: [user.id for user in users], **options)
+            self.streamed = isinstance(payload, Response)
+            if self.streamed:
+                payload = json.loads(''.join(chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk for chunk in payload.response))
+            return payload
+
+    def test_keyset_pagination(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            # The ordering of the query is replaced by the keyset column
+            query = db_session.query(User).order_by(User.id.desc())
+
+            payload = self.jsonify_list('/users?limit=10', query, keyset_column=User.id)
+            self.assertEqual(payload['users'], list(range(1, 11)))
+            self.assertEqual(payload['_total'], 150)
+            self.assertEqual(payload['_links']['next'], '/users?limit=10&after_id=10')
+
+            payload = self.jsonify_list('/users?limit=10&after_id=10', query, keyset_column=User.id)
+            self.assertEqual(payload['users'], list(range(11, 21)))
+
+            payload = self.jsonify_list('/users?limit=10&after_id=145', query, keyset_column=User.id)
+            self.assertEqual(payload['users'], list(range(146, 151)))
+            self.assertNotIn('next', payload['_links'])
+
+            # Without keyset_column, the offset pagination is used
+            payload = self.jsonify_list('/users?limit=10&offset=20', db_session.query(User).order_by(User.id))
+            self.assertEqual(payload['users'], list(range(21, 31)))
+            self.assertEqual(payload['_links']['next'], '/users?limit=10&offset=30')
+            self.assertEqual(payload['_links']['prev'], '/users?limit=10&offset=10')
+
+    def test_list(self):
+        import pajbot.web.utils
+        from pajbot.web import app
+        from pajbot.web.routes.api.pleblist import jsonify_queue
+
+        songs = [{'id': song_id} for song_id in (5, 3, 9, 1, 7)]
+
+        def jsonify_songs(url):
+            with app.test_request_context(url):
+                return pajbot.web.utils.jsonify_list('songs', songs, base_url='/songs', jsonify_method=list, keyset_column='id')
+
+        # Lists are paginated like queries, with keyset_column as the key to paginate on
+        payload = jsonify_songs('/songs?limit=2')
+        self.assertEqual(payload['songs'], [{'id': 1}, {'id': 3}])
+        self.assertEqual(payload['_total'], 5)
+        self.assertEqual(payload['_links']['next'], '/songs?limit=2&after_id=3')
+
+        payload = jsonify_songs('/songs?limit=2&after_id=5')
+        self.assertEqual(payload['songs'], [{'id': 7}, {'id': 9}])
+
+        payload = jsonify_songs('/songs?limit=2&offset=4')
+        self.assertEqual(payload['songs'], [{'id': 9}])
+        self.assertEqual(payload['_links']['prev'], '/songs?limit=2&offset=2')
+
+        class Queue:
+            version = 4
+
+        with app.test_request_context('/songs?limit=3'):
+            payload = jsonify_queue(Queue, songs, '/songs')
+        self.assertEqual(payload['version'], 4)
+        self.assertEqual([song['id'] for song in payload['songs']], [1, 3, 5])
+        self.assertEqual(payload['_links']['next'], '/songs?limit=3&after_id=5')
+
+    def test_cached_count(self):
+        import pajbot.web.utils
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            query = db_session.query(User).filter(User.id > 100)
+            self.assertEqual(pajbot.web.utils.get_cached_count(query, 10), 50)
+
+            db_session.add(User('newuser'))
+            db_session.flush()
+
+            self.assertEqual(pajbot.web.utils.get_cached_count(query, 10), 50)
+            self.assertEqual(pajbot.web.utils.get_cached_count(query, None), 51)
+            # Queries with other parameters are cached separately
+            self.assertEqual(pajbot.web.utils.get_cached_count(db_session.query(User).filter(User.id > 140), 10), 11)
+
+            for key in self.redis.keys('pajlada:cache:count:*'):
+                self.assertTrue(0 < self.redis.ttl(key) <= 10)
+
+    def test_stream(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        with DBManager.create_session_scope() as db_session:
+            # Large pages are sent as a streamed response
+            payload = self.jsonify_list('/users', db_session.query(User), keyset_column=User.id)
+            self.assertTrue(self.streamed)
+            self.assertEqual(payload['users'], list(range(1, 151)))
+            self.assertEqual(payload['_total'], 150)
+
+            self.jsonify_list('/users?limit=100', db_session.query(User), keyset_column=User.id)
+            self.assertFalse(self.streamed)
+
+
+class TestBulkUsers(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        from flask import Flask
+        from flask_restful import Api
+
+        import pajbot.web.routes.api.users
+        import pajbot.web.utils
+        from pajbot.managers.db import DBManager
+        from pajbot.models.user import User
+
+        init_test_database(User)
+
+        with DBManager.create_session_scope() as db_session:
+            for username, points in (('forsen', 500), ('pajlada', 1000), ('nymn', 500), ('reckful', 0)):
+                user = User(username)
+                user.points = points
+                db_session.add(user)
+                self.redis.hset('pajlada:users:last_seen', username, 1500000000)
+                self.redis.hset('pajlada:users:last_active', username, 1500000000)
+
+        self.redis.zadd('pajlada:users:num_lines', 'forsen', 30)
+        self.redis.zadd('pajlada:users:num_lines', 'nymn', 10)
+
+        app = Flask(__name__)
+        api = Api(app, prefix='/api/v1')
+        pajbot.web.utils.init_json_serializer(api)
+        pajbot.web.routes.api.users.init(api)
+        self.client = app.test_client()
+
+    def test_bulk_jsonify(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.points import PointsManager
+        from pajbot.managers.user import UserManager
+
+        # Points in the ledger are newer than the ones in SQL
+        PointsManager.seed_points('nymn', 2000)
+
+        with DBManager.create_session_scope() as db_session:
+            users = UserManager.bulk_find_static(['@Nymn', 'nobody', 'forsen', 'reckful'], db_session)
+            self.assertEqual([user.username for user in users], ['nymn', 'forsen', 'reckful'])
+
+            data = UserManager.bulk_jsonify(users, db_session)
+
+            self.assertEqual([(user['username'], user['points'], user['points_rank'], user['nl_rank'], user['num_lines']) for user in data], [
+                ('nymn', 2000, 1, 2, 10),
+                ('forsen', 500, 2, 1, 30),
+                ('reckful', 0, 4, 2, 0),
+                ])
+
+            # The same as jsonify without precomputed ranks, except for the points rank of the ledger value
+            self.assertEqual(data[1], users[1].jsonify())
+            self.assertEqual(UserManager.bulk_jsonify([], db_session), [])
+
+    def test_routes(self):
+        import json
+
+        response = self.client.get('/api/v1/users?names=forsen,,pajlada,nobody')
+        self.assertEqual(response.status_code, 200)
+        users = json.loads(response.get_data(as_text=True))['users']
+        self.assertEqual([(user['username'], user['points_rank']) for user in users], [('forsen', 2), ('pajlada', 1)])
+
+        response = self.client.get('/api/v1/users/forsen')
+        self.assertEqual(json.loads(response.get_data(as_text=True)), users[0])
+        self.assertEqual(self.client.get('/api/v1/users/nobody').status_code, 404)
+
+        response = self.client.get('/api/v1/users?names=' + ','.join('user{}'.format(i) for i in range(0, 101)))
+        self.assertEqual(response.status_code, 400)
+
+
+class TestRedisStats(unittest2.TestCase):
+    def test_call_sites(self):
+        import fakeredis
+
+        import pajbot.managers.redis
+        from pajbot.managers.redis import InstrumentedRedis
+        from pajbot.managers.redis import RedisStats
+
+        RedisStats.reset()
+        redis = InstrumentedRedis(connection_pool=fakeredis.FakeRedis(decode_responses=True).connection_pool, decode_responses=True)
+
+        for i in range(0, 3):
+            redis.set('foo', i)
+        with redis.pipeline() as pipeline:
+            pipeline.get('foo')
+            pipeline.get('bar')
+            self.assertEqual(pipeline.execute(), ['2', None])
+
+        report = RedisStats.get_report()
+        self.assertEqual(sorted((stats['commands'], stats['round_trips']) for stats in report), [(2, 1), (3, 3)])
+        for stats in report:
+            self.assertIn('tests.py:', stats['call_site'])
+            self.assertTrue(stats['call_site'].endswith(' test_call_sites'), stats['call_site'])
+
+        # The name of each call site is only built once
+        self.assertEqual(len([call_site for call_site in pajbot.managers.redis.call_site_names.values() if call_site.endswith(' test_call_sites')]), 2)
+
+        RedisStats.reset()
+
+    def test_instrument_option(self):
+        import redis
+
+        from pajbot.managers.redis import InstrumentedRedis
+        from pajbot.managers.redis import RedisManager
+
+        old_redis = RedisManager.redis
+        try:
+            # Nothing is listening on this socket, the scripts are just not preloaded
+            RedisManager.init(unix_socket_path='/nonexistent/redis.sock')
+            self.assertIs(type(RedisManager.redis), redis.Redis)
+
+            RedisManager.init(unix_socket_path='/nonexistent/redis.sock', instrument='1')
+            self.assertIs(type(RedisManager.redis), InstrumentedRedis)
+        finally:
+            RedisManager.redis = old_redis
+
+
+class FakeBot:
+    """ Collects everything that would be sent to chat """
+
+    def __init__(self):
+        from pajbot.managers.user import UserManager
+
+        self.users = UserManager()
+        self.messages = []
+        self.websocket_manager = self
+
+    def say(self, message):
+        self.messages.append(message)
+
+    def me(self, message):
+        self.messages.append(message)
+
+    def whisper(self, username, message):
+        self.messages.append('{}: {}'.format(username, message))
+
+    def emit(self, event, data={}):
+        pass
+
+
+class TestBulkPoints(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.handler import HandlerManager
+        from pajbot.models.duel import UserDuelStats
+        from pajbot.models.hsbet import HSBetBet
+        from pajbot.models.hsbet import HSBetGame
+        from pajbot.models.user import User
+
+        init_test_database(User, UserDuelStats, HSBetGame, HSBetBet)
+        HandlerManager.init_handlers()
+
+        with DBManager.create_session_scope() as db_session:
+            for username in ('forsen', 'pajlada', 'nymn'):
+                user = User(username)
+                user.points = 1000
+                db_session.add(user)
+                self.redis.hset('pajlada:users:last_seen', username, 1500000000)
+
+        self.bot = FakeBot()
+
+    def get_points(self, *usernames):
+        from pajbot.managers.points import PointsManager
+
+        return [PointsManager.get_points(username) for username in usernames]
+
+    def test_bulk_add_points(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.handler import HandlerManager
+        from pajbot.models.user import User
+
+        batches = []
+        HandlerManager.add_handler('on_bulk_add_points', batches.append)
+
+        forsen = self.bot.users['forsen']
+        new_values = self.bot.users.bulk_add_points([(forsen, 100), ('Forsen', 50), ('newuser', 10)])
+
+        # Missing users are seeded with their SQL points, or created
+        self.assertEqual(new_values, {'forsen': 1150, 'newuser': 10})
+        self.assertEqual(forsen.points, 1150)
+        with DBManager.create_session_scope() as db_session:
+            self.assertEqual(db_session.query(User).filter_by(username='newuser').count(), 1)
+
+        self.assertEqual(self.bot.users.bulk_add_points([]), {})
+        self.assertEqual(len(batches), 1)
+
+    def test_duel(self):
+        from pajbot.modules.duel import DuelModule
+
+        module = DuelModule()
+        module.load_settings({
+            'show_on_clr': False,
+            'message_won': '{winner} won the duel vs {loser}',
+            'message_won_points': '{winner} won the duel vs {loser} and {extra_points} points',
+            })
+        module.duel_requests['pajlada'] = 'forsen'
+        module.duel_targets['forsen'] = 'pajlada'
+        module.duel_request_price['pajlada'] = 100
+
+        module.accept_duel(bot=self.bot, source=self.bot.users['forsen'])
+
+        self.assertEqual(sorted(self.get_points('forsen', 'pajlada')), [900, 1070])
+        self.assertEqual(module.duel_targets, {})
+
+    def test_multi_raffle(self):
+        from pajbot.modules.raffle import RaffleModule
+
+        module = RaffleModule()
+        module.bot = self.bot
+        module.raffle_running = True
+        module.raffle_points = 1000
+        for username in ('forsen', 'pajlada', 'nymn'):
+            module.raffle_users.add(username)
+
+        module.multi_end_raffle()
+
+        # Only the winner ends up in the points ledger
+        self.assertEqual([points for points in self.get_points('forsen', 'pajlada', 'nymn') if points is not None], [2000])
+
+    def test_hsbet(self):
+        from pajbot.modules.hsbet import HSBetModule
+
+        module = HSBetModule()
+        module.bot = self.bot
+        module.load_settings({'time_until_bet_closes': 60})
+        module.last_game_id = None
+        module.bets = {'forsen': (True, 100), 'pajlada': (False, 50), 'nymn': (True, 0)}
+        for username, (bet_for_win, points) in module.bets.items():
+            user = self.bot.users[username]
+            user.create_debt(points)
+            self.bot.users.save(user)
+
+        module.poll_trackobot_stage2({'history': [{'id': 1, 'result': 'win'}]})
+
+        self.assertEqual(self.get_points('forsen', 'pajlada', 'nymn'), [1050, 950, None])
+        self.assertEqual(module.bets, {})
+
+
+class TestSocketProtocol(unittest2.TestCase):
+    def setUp(self):
+        import socket
+
+        self.client, self.server = socket.socketpair()
+
+    def tearDown(self):
+        from pajbot.models.sock import SocketClientManager
+
+        self.client.close()
+        self.server.close()
+        SocketClientManager.sock_file = None
+        SocketClientManager.pool = None
+
+    def test_framing(self):
+        from pajbot.models.sock import encode_frame
+        from pajbot.models.sock import SocketConnection
+
+        connection = SocketConnection(self.server)
+        data = encode_frame({'event': 'timer.update', 'data': {'id': 1}}) + encode_frame([{'event': 'timer.remove', 'data': {'id': 2}}])
+
+        # Frames can be split up at any point
+        self.assertEqual(connection.read_payloads(data[:2]), [])
+        self.assertEqual(connection.read_payloads(data[2:10]), [])
+        self.assertEqual(connection.read_payloads(data[10:]), [
+            b'{"event":"timer.update","data":{"id":1}}',
+            b'[{"event":"timer.remove","data":{"id":2}}]',
+            ])
+        self.assertFalse(connection.legacy)
+        self.assertEqual(connection.close(), [])
+
+        with self.assertRaises(ValueError):
+            SocketConnection(self.server).read_payloads(b'\x7f\xff\xff\xff')
+
+    def test_legacy(self):
+        from pajbot.models.sock import SocketConnection
+
+        # Unframed JSON is handled once the client closes the connection
+        connection = SocketConnection(self.server)
+        self.assertEqual(connection.read_payloads(b'{"event": "module.update", '), [])
+        self.assertEqual(connection.read_payloads(b'"data": {"id": "duel"}}'), [])
+        self.assertTrue(connection.legacy)
+        self.assertEqual(connection.close(), [b'{"event": "module.update", "data": {"id": "duel"}}'])
+
+    def test_dispatch(self):
+        import selectors
+
+        from pajbot.models.sock import SocketClientManager
+        from pajbot.models.sock import SocketConnection
+        from pajbot.models.sock import SocketManager
+
+        class Bot:
+            config = {}
+
+            def execute_delayed(self, delay, function, arguments=()):
+                function(*arguments)
+
+        received = []
+        socket_manager = SocketManager(Bot())
+        socket_manager.add_handler('banphrase.update', lambda data, conn: received.append(data['id']))
+
+        # Use our end of the socket pair as the pooled connection
+        SocketClientManager.init('/nonexistent')
+        SocketClientManager.pool.put_nowait(self.client)
+        with SocketClientManager.batch():
+            for banphrase_id in range(0, 50):
+                SocketClientManager.send('banphrase.update', {'id': banphrase_id})
+            SocketClientManager.send('invalid', {})
+            self.assertEqual(received, [])
+
+        # Everything arrived as a single frame
+        connection = SocketConnection(self.server)
+        self.server.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ, connection)
+        socket_manager.read(selector, connection)
+        selector.close()
+
+        self.assertEqual(received, list(range(0, 50)))
+        self.assertEqual(socket_manager.parse_payload(b'not json'), [])
+
+
+class FakeConnection:
+    def __init__(self):
+        import time
+
+        self.info = {'query_start_time': [time.time()]}
+
+
+class TestFakeTMIServer(unittest2.TestCase):
+    def setUp(self):
+        import threading
+        from pajbot.scripts.fake_tmi import FakeTMIServer
+
+        self.server = FakeTMIServer(rate_limit=2)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.connections = []
+
+    def tearDown(self):
+        for sock, f in self.connections:
+            self.close(sock, f)
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def close(self, sock, f):
+        try:
+            f.close()
+        except OSError:
+            pass
+        sock.close()
+
+    def connect(self, nickname):
+        import socket
+
+        sock = socket.create_connection(self.server.server_address, timeout=5)
+        f = sock.makefile('rwb')
+        self.connections.append((sock, f))
+        for line in ['PASS oauth:abc', 'NICK ' + nickname, 'USER {0} 0 * :{0}'.format(nickname),
+                'CAP REQ :twitch.tv/tags twitch.tv/commands', 'JOIN #pajlada']:
+            f.write(line.encode('utf-8') + b'\r\n')
+        f.flush()
+        self.read_until(f, 'ROOMSTATE')
+        return sock, f
+
+    def read_until(self, f, needle):
+        while True:
+            line = f.readline().decode('utf-8')
+            if needle in line or len(line) == 0:
+                return line
+
+    def test_relay(self):
+        _, pajbot = self.connect('pajbot')
+        _, foo = self.connect('foo')
+
+        foo.write(b'PRIVMSG #pajlada :hello\r\n')
+        foo.write(b'PRIVMSG #jtv :/w pajbot hi there\r\n')
+        foo.flush()
+
+        line = self.read_until(pajbot, 'PRIVMSG')
+        self.assertTrue(line.startswith('@'))
+        self.assertIn('display-name=foo;', line)
+        self.assertTrue(line.rstrip().endswith('PRIVMSG #pajlada :hello'))
+
+        line = self.read_until(pajbot, 'WHISPER')
+        self.assertTrue(line.rstrip().endswith('WHISPER pajbot :hi there'))
+        self.assertEqual(self.server.messages, [('#pajlada', 'foo', 'hello')])
+
+    def test_rate_limit_and_reconnect(self):
+        sock, pajbot = self.connect('pajbot')
+
+        for i in range(0, 3):
+            pajbot.write('PRIVMSG #pajlada :{}\r\n'.format(i).encode('utf-8'))
+        pajbot.flush()
+
+        line = self.read_until(pajbot, 'NOTICE')
+        self.assertIn('msg-id=msg_ratelimit', line)
+        self.assertEqual(len(self.server.messages), 2)
+
+        self.server.disconnect_all()
+        self.assertEqual(pajbot.readline(), b'')
+        self.close(sock, pajbot)
+
+        self.connect('pajbot')
+        self.assertEqual(len(self.server.reconnect_times), 1)
+
+
+class FakeChatBot:
+    nickname = 'pajbot'
+    password = 'oauth:abc'
+    version = '1.0'
+
+    def __init__(self):
+        self.said = []
+
+    def say(self, message):
+        self.said.append(message)
+
+
+class TestConnectionManager(unittest2.TestCase):
+    def setUp(self):
+        import threading
+
+        import irc.client
+
+        from pajbot.scripts.fake_tmi import FakeTMIServer
+
+        self.server = FakeTMIServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.reactor = irc.client.Reactor()
+
+    def tearDown(self):
+        for connection in list(self.reactor.connections):
+            connection.close()
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def process_until(self, condition, timeout=5):
+        import time
+
+        end_time = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), end_time, 'Timed out waiting for the fake TMI server')
+            self.reactor.process_once(0.01)
+
+    def joined(self):
+        return [client.nickname for client in self.server.get_clients(channel='#pajlada')]
+
+    def test_reconnect(self):
+        from pajbot.managers.connection import ConnectionManager
+
+        bot = FakeChatBot()
+        manager = ConnectionManager(self.reactor, bot, 20, 'pajlada', backup_conns=1, chat_server=self.server.address)
+        self.assertTrue(manager.start())
+        self.assertEqual(len(manager.connlist), 2)
+        self.assertEqual(bot.said, ['pajbot 1.0 running!'])
+        self.process_until(lambda: self.joined() == ['pajbot'] and len(self.server.get_clients(nickname='pajbot')) == 2)
+
+        self.server.disconnect_all()
+        self.process_until(lambda: not any(connection.conn.is_connected() for connection in manager.connlist))
+
+        manager.run_maintenance()
+        self.assertTrue(len(manager.connlist) > 0)
+        self.assertTrue(all(connection.conn.is_connected() for connection in manager.connlist))
+        self.process_until(lambda: self.joined() == ['pajbot'] and len(self.server.reconnect_times) == 1)
+
+        manager.privmsg('#pajlada', 'back')
+        self.process_until(lambda: len(self.server.messages) == 1)
+        self.assertEqual(self.server.messages, [('#pajlada', 'pajbot', 'back')])
+
+    def test_message_limit(self):
+        from pajbot.managers.connection import ConnectionManager
+
+        manager = ConnectionManager(self.reactor, FakeChatBot(), 6, 'pajlada', backup_conns=1, chat_server=self.server.address)
+        self.assertTrue(manager.start())
+        self.process_until(lambda: self.joined() == ['pajbot'])
+
+        for i in range(0, 7):
+            manager.privmsg('#pajlada', str(i))
+
+        # The main connection is at its limit, so the last message goes through the backup connection
+        self.assertEqual([connection.num_msgs_sent for connection in manager.connlist], [6, 1])
+        self.process_until(lambda: len(self.server.messages) == 7)
+        self.assertEqual(sorted(message for _, _, message in self.server.messages), [str(i) for i in range(0, 7)])
+
+        manager.connlist[0].reduce_msgs_sent()
+        self.assertEqual(manager.connlist[0].num_msgs_sent, 5)
+
+    def test_whisper_reconnect(self):
+        from pajbot.managers.whisperconnection import WhisperConnectionManager
+
+        init_test_database()
+        manager = WhisperConnectionManager(self.reactor, None, 'pajlada', 20, 30, chat_server=self.server.address)
+        manager.update_servers_list()
+        manager.start_connections([{'username': 'pajbot', 'oauth': 'oauth:abc'}, {'username': 'pajbot2', 'oauth': 'oauth:abc'}])
+        self.process_until(lambda: sorted(client.nickname for client in self.server.get_clients()) == ['pajbot', 'pajbot2'])
+
+        manager.whisper('forsen', 'hello')
+        self.process_until(lambda: len(self.server.whispers) == 1)
+
+        self.server.disconnect_all()
+        self.process_until(lambda: not any(connection.conn.is_connected() for connection in manager.connlist))
+
+        manager.run_maintenance()
+        self.assertEqual(sorted(connection.name for connection in manager.connlist), ['pajbot', 'pajbot2'])
+        self.assertTrue(all(connection.conn.is_connected() for connection in manager.connlist))
+        self.process_until(lambda: len(self.server.reconnect_times) == 2)
+
+        manager.whisper('forsen', 'hello again')
+        self.process_until(lambda: len(self.server.whispers) == 2)
+        self.assertEqual([message for _, _, message in self.server.whispers], ['hello', 'hello again'])
+
+
+class TestReplay(unittest2.TestCase):
+    def setUp(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.redis import RedisManager
+
+        self.saved_redis = RedisManager.redis
+        self.saved_db = {key: getattr(DBManager, key, None) for key in ('engine', 'Session', 'ScopedSession')}
+
+    def tearDown(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.redis import RedisManager
+        from pajbot.scripts.replay import ReplayBot
+
+        RedisManager.redis = self.saved_redis
+        for key, value in self.saved_db.items():
+            setattr(DBManager, key, value)
+        ReplayBot.redis = None
+        ReplayBot.enabled_modules = []
+
+    def test_replay(self):
+        import argparse
+
+        from pajbot.managers.redis import RedisManager
+        from pajbot.scripts.replay import ReplayBot
+        from pajbot.scripts.replay import get_config
+        from pajbot.scripts.replay import replay
+        from pajbot.tmi import parse_line
+
+        with open('tests/replay.log', 'r', encoding='utf-8') as log_file:
+            events = [parse_line(line.rstrip('\r\n')) for line in log_file]
+        self.assertEqual([irc_event.type for irc_event in events], ['pubmsg', 'pubmsg', 'action', 'usernotice', 'whisper'])
+
+        ReplayBot.enabled_modules = ['all']
+        bot = ReplayBot(get_config(None, 'pajlada'), argparse.Namespace(silent=None))
+
+        latencies = replay(bot, events)
+        self.assertTrue(bot.background_messages.wait(timeout=10))
+
+        self.assertEqual(len(latencies), 5)
+        self.assertEqual(bot.irc.sent, [('privmsg', '#pajlada', 'Resub hype! Nymn just subscribed, 2 months in a row PogChamp <3')])
+
+        redis = RedisManager.get()
+        self.assertEqual(sorted(redis.hkeys('pajlada:users:last_seen')), ['forsen', 'nymn'])
+        self.assertEqual(redis.hget('pajlada:users:username_raw', 'forsen'), 'Forsen')
+        self.assertEqual(redis.zscore('pajlada:emotes:count', 'Kappa'), 1)
+
+
+class TestMultiChannelBot(unittest2.TestCase):
+    def setUp(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.metrics import MetricsManager
+        from pajbot.managers.redis import RedisManager
+
+        self.saved_redis = RedisManager.redis
+        self.saved_db = {key: getattr(DBManager, key, None) for key in ('engine', 'Session', 'ScopedSession')}
+        self.saved_collectors = dict(MetricsManager.collectors)
+        self.saved_start_http_server = MetricsManager.start_http_server
+
+        self.metrics_servers = []
+        MetricsManager.start_http_server = lambda port, host='127.0.0.1': self.metrics_servers.append(port)
+
+    def tearDown(self):
+        from pajbot.managers.db import DBManager
+        from pajbot.managers.metrics import MetricsManager
+        from pajbot.managers.redis import RedisManager
+        from pajbot.scripts.replay import ReplayBot
+
+        RedisManager.redis = self.saved_redis
+        for key, value in self.saved_db.items():
+            setattr(DBManager, key, value)
+        MetricsManager.collectors = self.saved_collectors
+        MetricsManager.start_http_server = self.saved_start_http_server
+        ReplayBot.redis = None
+
+    def create_host(self):
+        import argparse
+
+        from pajbot.scripts.benchmark_channels import ReplayMultiChannelBot
+        from pajbot.scripts.replay import get_config
+
+        host = ReplayMultiChannelBot(get_config(None, 'pajlada0'), argparse.Namespace(silent=None))
+
+        config = get_config(None, 'pajlada1')
+        config.read_dict({'metrics': {'port': '9101'}})
+        host.add_channel(config)
+
+        return host
+
+    def send(self, host, target, username, message):
+        from pajbot.tmi import parse_line
+
+        event = parse_line('@badges=;color=;display-name={0};emotes=;subscriber=0;user-type= :{0}!{0}@{0}.tmi.twitch.tv PRIVMSG {1} :{2}'.format(username, target, message))
+        host.on_pubmsg(None, event)
+
+    def test_dispatch(self):
+        from pajbot.managers.channel import ChannelManager
+        from pajbot.managers.handler import HandlerManager
+        from pajbot.managers.redis import RedisManager
+
+        host = self.create_host()
+        self.assertEqual(list(host.bots), ['#pajlada0', '#pajlada1'])
+        bot0, bot1 = host.bots.values()
+
+        received = []
+        with ChannelManager.context(bot0.channel_context):
+            HandlerManager.add_handler('on_message', lambda source, message, *args, **kwargs: received.append((ChannelManager.current().streamer, message)))
+
+        self.send(host, '#pajlada0', 'forsen', 'hello 0')
+        self.send(host, '#pajlada1', 'nymn', 'hello 1')
+        self.send(host, '#notjoined', 'forsen', 'hello 2')
+
+        for bot in (bot0, bot1):
+            self.assertTrue(bot.background_messages.wait(timeout=10))
+
+        # The handler added in the first channel only sees the messages of that channel
+        self.assertEqual(received, [('pajlada0', 'hello 0')])
+
+        # Every channel has its own keys
+        redis = RedisManager.get()
+        self.assertEqual(redis.hkeys('pajlada0:users:last_seen'), ['forsen'])
+        self.assertEqual(redis.hkeys('pajlada1:users:last_seen'), ['nymn'])
+        self.assertEqual(redis.keys('notjoined:*'), [])
 
-        regex = re.compile(Bot.url_regex_str, re.IGNORECASE)
+    def test_metrics(self):
+        from pajbot.apiwrappers import APIBase
+        from pajbot.managers.metrics import MetricsManager
 
-        self.assertEqual(find_unique_urls(regex, 'pajlada.se test http://pajlada.se'), {'http://pajlada.se'})
-        self.assertEqual(find_unique_urls(regex, 'pajlada.se pajlada.com foobar.se'), {'http://pajlada.se', 'http://pajlada.com', 'http://foobar.se'})
-        self.assertEqual(find_unique_urls(regex, 'foobar.com foobar.com'), {'http://foobar.com'})
-        self.assertEqual(find_unique_urls(regex, 'foobar.com foobar.se'), {'http://foobar.com', 'http://foobar.se'})
-        self.assertEqual(find_unique_urls(regex, 'www.foobar.com foobar.se'), {'http://www.foobar.com', 'http://foobar.se'})
+        host = self.create_host()
 
-        # TODO: Edge case, this behaviour should probably be changed. These URLs should be considered the same.
-        # Use is_same_url method?
-        self.assertEqual(find_unique_urls(regex, 'pajlada.se/ pajlada.se'), {'http://pajlada.se/', 'http://pajlada.se'})
+        # The channels don't register their own collectors, or start a metrics server from their config
+        self.assertEqual(MetricsManager.collectors['bot'], host.collect_metrics)
+        self.assertEqual(MetricsManager.collectors['api'], APIBase.collect_metrics)
+        self.assertNotIn('websocket', MetricsManager.collectors)
+        self.assertEqual(self.metrics_servers, [])
 
-        # TODO: The protocol of a URL is entirely thrown away, this behaviour should probably be changed.
-        self.assertEqual(find_unique_urls(regex, 'https://pajlada.se/ https://pajlada.se'), {'https://pajlada.se/', 'https://pajlada.se'})
+        metrics = {name: samples for name, metric_type, documentation, samples in host.collect_metrics()}
+        self.assertEqual([labels for labels, value in metrics['pajbot_action_queue_size'] if labels['queue'] == 'action'],
+                [{'queue': 'action', 'channel': 'pajlada0'}, {'queue': 'action', 'channel': 'pajlada1'}])
 
 
 class ActionsTester(unittest2.TestCase):